@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Alex Headley <aheadley@waysaboutstuff.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Benchmark opening and loading the member list of BIG archives.
+
+Usage: python benchmarks/bench_big_load.py [-n FILES] [archive.big ...]
+
+With no archives a synthetic HWRM archive with FILES members is written to a
+temp dir (using the archive writer from the test suite) and loaded with and
+without the decrypted block cache, with each plaintext mirror mode and through
+a cold and a warm sidecar index cache, then the resident memory used by keeping
+several copies of it loaded is reported.
+Given HWRM archives, those are loaded instead.
+"""
+
+import argparse
+import gc
+import sys
+import os
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from naabal.formats.big.hwrm import HomeworldRemasteredBigFile
+from naabal.formats.big.index_cache import BigIndexCache
+from tests.test_formats_big_hw2 import build_hw2_archive
+
+def synthetic_files(count):
+    return [('data/dir{0:03d}/file{1:05d}.dat'.format(i % 50, i), os.urandom(64), False) \
+        for i in xrange(count)]
+
+def bench_load(label, filename, index_cache=None, **kwargs):
+    start = time.time()
+    with HomeworldRemasteredBigFile(filename, **kwargs) as bigfile:
+        bigfile.load(index_cache)
+        seconds = time.time() - start
+        sys.stdout.write('  {0:16s} {1:8.3f}s  {2:d} members  {3!r}\n'.format(
+            label, seconds, len(bigfile), bigfile.block_cache))
+
+def get_rss():
+    """Current resident set size in KB, Linux only
+    """
+
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except IOError:
+        return None
+
+def bench_memory(filename, copies=3):
+    gc.collect()
+    rss_before = get_rss()
+    if rss_before is None:
+        return
+    bigfiles = []
+    for i in xrange(copies):
+        bigfile = HomeworldRemasteredBigFile(filename, cache_size=0)
+        bigfile.load()
+        bigfiles.append(bigfile)
+    gc.collect()
+    sys.stdout.write('  {0:16s} {1:8d}KB per loaded archive\n'.format(
+        'memory', (get_rss() - rss_before) // copies))
+    for bigfile in bigfiles:
+        bigfile.close()
+
+def bench_archive(filename):
+    sys.stdout.write('{0}:\n'.format(filename))
+    bench_load('no cache', filename, cache_size=0)
+    bench_load('block cache', filename)
+    bench_load('memory mirror', filename, mirror=HomeworldRemasteredBigFile.MIRROR_MEMORY)
+    bench_load('tempfile mirror', filename, mirror=HomeworldRemasteredBigFile.MIRROR_TEMPFILE)
+    index_cache = BigIndexCache(tempfile.mkdtemp())
+    try:
+        bench_load('index cold', filename, index_cache=index_cache)
+        bench_load('index warm', filename, index_cache=index_cache)
+    finally:
+        shutil.rmtree(index_cache.cache_dir)
+    bench_memory(filename)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark loading BIG archives')
+    parser.add_argument('-n', '--files', type=int, default=2000,
+        help='members in the synthetic archive')
+    parser.add_argument('archives', nargs='*')
+    args = parser.parse_args()
+
+    if args.archives:
+        for filename in args.archives:
+            bench_archive(filename)
+        return 0
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp_dir, 'synthetic.big')
+        build_hw2_archive(filename, synthetic_files(args.files), os.urandom(0x100))
+        bench_archive(filename)
+    finally:
+        shutil.rmtree(tmp_dir)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
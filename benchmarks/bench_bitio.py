@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Alex Headley <aheadley@waysaboutstuff.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Benchmark the bit I/O layer against the original byte-at-a-time version.
+
+Usage: python benchmarks/bench_bitio.py [-c COUNT]
+
+Writes and then reads back a stream of LZSS-shaped tokens (a flag bit followed
+by an 8 or 16 bit field).
+"""
+
+import argparse
+import sys
+import os
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from naabal.util import StringIO
+from naabal.util.bitio import BitReader, BitWriter
+
+TOKEN_COUNT     = 500 * 1000
+
+class LegacyBitIO(object):
+    BITS_IN_BYTE    = 8
+    DEFAULT_MASK    = 1 << (BITS_IN_BYTE - 1) # 0x80
+
+    def __init__(self, handle):
+        self._data_buffer = handle
+        self._bit_buffer = 0x00
+        self._bit_mask = self.DEFAULT_MASK
+        self._bit_idx = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        pass
+
+    @property
+    def index(self):
+        return self._bit_idx
+
+class LegacyBitWriter(LegacyBitIO):
+    def __exit__(self, type, value, tb):
+        self.flush()
+
+    def write_bit(self, bit):
+        if bit:
+            self._bit_buffer |= self._bit_mask
+        self._bit_mask = self._bit_mask >> 1
+        if self._bit_mask == 0:
+            self._flush_bit_buffer()
+            self._reset_state()
+
+    def write_bits(self, value, bit_count):
+        mask = 1 << (bit_count - 1)
+
+        while mask != 0:
+            if mask & value:
+                self._bit_buffer |= self._bit_mask
+            self._bit_mask = self._bit_mask >> 1
+            if self._bit_mask == 0:
+                self._flush_bit_buffer()
+                self._reset_state()
+            mask = mask >> 1
+
+    def flush(self):
+        if self._bit_mask != self.DEFAULT_MASK:
+            self._flush_bit_buffer()
+            self._reset_state()
+        return self._bit_idx
+
+    def _flush_bit_buffer(self):
+        self._data_buffer.write(chr(self._bit_buffer))
+        self._bit_idx += 1
+
+    def _reset_state(self):
+        self._bit_buffer = 0x00
+        self._bit_mask   = self.DEFAULT_MASK
+
+class LegacyBitReader(LegacyBitIO):
+    def read_bit(self):
+        if self._bit_mask == self.DEFAULT_MASK:
+            self._load_bit_buffer()
+
+        value = self._bit_buffer & self._bit_mask
+        self._bit_mask = self._bit_mask >> 1
+        if self._bit_mask == 0:
+            self._bit_mask = self.DEFAULT_MASK
+
+        return 1 if value else 0
+
+    def read_bits(self, bit_count):
+        mask = 1 << (bit_count - 1)
+        bits_value = 0x00
+
+        while mask != 0:
+            if self._bit_mask == self.DEFAULT_MASK:
+                self._load_bit_buffer()
+
+            if self._bit_buffer & self._bit_mask:
+                bits_value |= mask
+            mask = mask >> 1
+            self._bit_mask = self._bit_mask >> 1
+            if self._bit_mask == 0:
+                self._bit_mask = self.DEFAULT_MASK
+
+        return bits_value
+
+    def _load_bit_buffer(self):
+        c = self._data_buffer.read(1)
+        if c:
+            self._bit_buffer = ord(c)
+            self._bit_idx += 1
+        else:
+            raise IOError('Attempted to read past EOF')
+
+def make_tokens(count, seed=0x4E41):
+    rng = random.Random(seed)
+    tokens = []
+    for i in xrange(count):
+        if rng.random() < 0.5:
+            tokens.append((1, rng.randint(0, 0xFF), 8))
+        else:
+            tokens.append((0, rng.randint(1, 0xFFFF), 16))
+    return tokens
+
+def write_legacy(tokens):
+    output = StringIO()
+    with LegacyBitWriter(output) as writer:
+        for flag, value, bit_count in tokens:
+            writer.write_bit(flag)
+            writer.write_bits(value, bit_count)
+    return output.getvalue()
+
+def write_buffered(tokens):
+    output = StringIO()
+    with BitWriter(output) as writer:
+        for flag, value, bit_count in tokens:
+            writer.write_flag_bits(flag, value, bit_count)
+    return output.getvalue()
+
+def read_legacy(data, count):
+    reader = LegacyBitReader(StringIO(data))
+    for i in xrange(count):
+        if reader.read_bit():
+            reader.read_bits(8)
+        else:
+            reader.read_bits(16)
+
+def read_buffered(data, count):
+    reader = BitReader(StringIO(data))
+    for i in xrange(count):
+        reader.read_flag_bits(8, 16)
+
+def timed(func, *pargs):
+    start = time.time()
+    result = func(*pargs)
+    return time.time() - start, result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark BitReader/BitWriter')
+    parser.add_argument('-c', '--count', type=int, default=TOKEN_COUNT,
+        help='tokens to write and read back')
+    count = parser.parse_args().count
+    tokens = make_tokens(count)
+
+    legacy_write, legacy_data = timed(write_legacy, tokens)
+    buffered_write, buffered_data = timed(write_buffered, tokens)
+    if legacy_data != buffered_data:
+        sys.stdout.write('OUTPUT MISMATCH\n')
+        return 1
+    legacy_read, _ = timed(read_legacy, legacy_data, count)
+    buffered_read, _ = timed(read_buffered, buffered_data, count)
+
+    mb = len(legacy_data) / (1024.0 * 1024.0)
+    sys.stdout.write('{0:d} tokens, {1:d} bytes\n'.format(count, len(legacy_data)))
+    for label, legacy, buffered in [('write', legacy_write, buffered_write),
+            ('read', legacy_read, buffered_read)]:
+        sys.stdout.write('  {0:5s} legacy: {1:7.3f}s {2:6.2f} MB/s  buffered: {3:7.3f}s {4:6.2f} MB/s ({5:.1f}x)\n'.format(
+            label, legacy, mb / legacy, buffered, mb / buffered, legacy / buffered))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
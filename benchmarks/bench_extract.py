@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Alex Headley <aheadley@waysaboutstuff.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+
+"""Benchmark extracting every member of BIG archives with several workers.
+
+Usage: python benchmarks/bench_extract.py [-n FILES] [-s SIZE] [-j JOBS ...] [archive.big ...]
+
+With no archives two synthetic archives of FILES compressible members of SIZE
+bytes are written to a temp dir, a HW1 one (LZSS, extracted in a process pool)
+and a HW2 one (zlib, extracted in a thread pool, using the archive writer from
+the test suite). Each archive is extracted with each of the given job counts
+(default: 1, 2 and the number of CPUs).
+"""
+
+import argparse
+import multiprocessing
+import random
+import sys
+import os
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from naabal.formats.big.hw1 import HomeworldBigFile
+from naabal.util.helpers import big_load
+from tests.test_formats_big_hw2 import build_hw2_archive
+
+WORDS = ['ship', 'mothership', 'frigate', 'corvette', 'fighter', 'resource', 'collector',
+    'ion', 'cannon', 'hyperspace', 'kharak', 'taiidan', '\n']
+
+def synthetic_data(size):
+    words = []
+    length = 0
+    while length < size:
+        word = random.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:size]
+
+def build_hw1_archive(filename, src_dir, files):
+    for name, data, compress in files:
+        member_filename = os.path.join(src_dir, *name.split('/'))
+        if not os.path.isdir(os.path.dirname(member_filename)):
+            os.makedirs(os.path.dirname(member_filename))
+        with open(member_filename, 'wb') as handle:
+            handle.write(data)
+    bigfile = HomeworldBigFile(filename, 'w+b')
+    bigfile.add_all(src_dir + os.sep)
+    bigfile.save(compression_level='fast')
+    bigfile.close()
+
+def bench_archive(filename, job_counts):
+    sys.stdout.write('{0}:\n'.format(filename))
+    for jobs in job_counts:
+        dest_dir = tempfile.mkdtemp()
+        try:
+            with big_load(filename) as bigfile:
+                total_size = sum(m.real_size for m in bigfile.get_members())
+                start = time.time()
+                bigfile.extract_all(path=dest_dir, jobs=jobs)
+                seconds = time.time() - start
+            sys.stdout.write('  {0:2d} jobs {1:8.3f}s  {2:8.1f} MB/s  {3}\n'.format(
+                jobs, seconds, total_size / 1048576.0 / seconds, type(bigfile).__name__))
+        finally:
+            shutil.rmtree(dest_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parallel BIG extraction')
+    parser.add_argument('-n', '--files', type=int, default=200,
+        help='members in the synthetic archives')
+    parser.add_argument('-s', '--size', type=int, default=64 * 1024,
+        help='size of each synthetic member')
+    parser.add_argument('-j', '--jobs', type=int, action='append',
+        help='job counts to try')
+    parser.add_argument('archives', nargs='*')
+    args = parser.parse_args()
+    job_counts = args.jobs or sorted(set([1, 2, multiprocessing.cpu_count()]))
+
+    if args.archives:
+        for filename in args.archives:
+            bench_archive(filename, job_counts)
+        return 0
+
+    random.seed(0)
+    files = [('data/dir{0:02d}/file{1:04d}.txt'.format(i % 20, i), synthetic_data(args.size), True) \
+        for i in xrange(args.files)]
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        hw1_filename = os.path.join(tmp_dir, 'synthetic-hw1.big')
+        build_hw1_archive(hw1_filename, os.path.join(tmp_dir, 'src'), files)
+        bench_archive(hw1_filename, job_counts)
+        hw2_filename = os.path.join(tmp_dir, 'synthetic-hw2.big')
+        build_hw2_archive(hw2_filename, files)
+        bench_archive(hw2_filename, job_counts)
+    finally:
+        shutil.rmtree(tmp_dir)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
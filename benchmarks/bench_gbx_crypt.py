@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Alex Headley <aheadley@waysaboutstuff.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Benchmark GearboxCrypt decryption throughput.
+
+Usage: python benchmarks/bench_gbx_crypt.py [-l LIMIT_MB] [archive.big ...]
+
+With no archives a synthetic buffer is decrypted with a random local key. With
+HWRM archives the whole encrypted region of each is read and decrypted in
+chunks (up to LIMIT_MB if given), which is what extracting everything costs.
+"""
+
+import argparse
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from naabal.util import gbx_crypt
+from naabal.util.gbx_crypt import GearboxCrypt
+from naabal.util.keys import GEARBOX_HWRM_GLOBAL_KEY
+from naabal.formats.big.hwrm import HomeworldRemasteredBigFile
+
+SYNTHETIC_SIZE      = 32 * 1024 * 1024
+REFERENCE_SIZE      = 1024 * 1024
+CHUNK_SIZE          = 1024 * 1024
+
+def reference_decrypt(crypto, data, offset=0):
+    """The original per-byte generator implementation
+    """
+
+    key = crypto.encryption_key
+    ks = len(key)
+    return str(bytearray(0xFF & (c + key[i % ks]) \
+        for c, i in zip(bytearray(data), xrange(offset, offset + len(data)))))
+
+def timed(func, *pargs):
+    start = time.time()
+    result = func(*pargs)
+    return time.time() - start, result
+
+def chunked_decrypt(crypto, data):
+    return ''.join(crypto.decrypt(data[pos:pos + CHUNK_SIZE], pos) \
+        for pos in xrange(0, len(data), CHUNK_SIZE))
+
+def report(label, size, seconds):
+    sys.stdout.write('  {0:12s} {1:8.3f}s {2:9.2f} MB/s\n'.format(
+        label, seconds, size / (1024.0 * 1024.0) / seconds))
+
+def bench_synthetic():
+    local_key = bytearray(os.urandom(0x100))
+    data = os.urandom(SYNTHETIC_SIZE)
+    crypto = GearboxCrypt(len(data), local_key, GEARBOX_HWRM_GLOBAL_KEY)
+
+    sys.stdout.write('synthetic: {0:d} bytes, {1:d} byte key\n'.format(len(data), len(local_key)))
+    sample = data[:REFERENCE_SIZE]
+    ref_time, ref_output = timed(reference_decrypt, crypto, sample, 12345)
+    if crypto.decrypt(sample, 12345) != ref_output:
+        sys.stdout.write('OUTPUT MISMATCH\n')
+        return 1
+    report('reference', len(sample), ref_time)
+
+    numpy_min_size = crypto.NUMPY_MIN_SIZE
+    crypto.NUMPY_MIN_SIZE = sys.maxint
+    report('translate', len(data), timed(chunked_decrypt, crypto, data)[0])
+    if gbx_crypt.numpy is not None:
+        crypto.NUMPY_MIN_SIZE = numpy_min_size
+        report('numpy', len(data), timed(chunked_decrypt, crypto, data)[0])
+    else:
+        sys.stdout.write('  numpy not available\n')
+    return 0
+
+def bench_archive(filename, limit=None):
+    bigfile = HomeworldRemasteredBigFile(filename)
+    crypto = bigfile._load_encryption()
+    size = crypto._data_size
+    if limit is not None:
+        size = min(size, limit)
+    sys.stdout.write('{0}: decrypting {1:d} bytes\n'.format(filename, size))
+
+    handle = bigfile._handle
+    handle.seek(0)
+    start = time.time()
+    offset = 0
+    while offset < size:
+        chunk = handle.read(min(CHUNK_SIZE, size - offset))
+        crypto.decrypt(chunk, offset)
+        offset += len(chunk)
+    report('decrypt', size, time.time() - start)
+    bigfile.close()
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark GearboxCrypt')
+    parser.add_argument('-l', '--limit', type=int, help='MB to decrypt per archive')
+    parser.add_argument('archives', nargs='*')
+    args = parser.parse_args()
+
+    if not args.archives:
+        return bench_synthetic()
+    limit = args.limit * 1024 * 1024 if args.limit else None
+    for filename in args.archives:
+        bench_archive(filename, limit)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
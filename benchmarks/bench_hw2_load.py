@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Alex Headley <aheadley@waysaboutstuff.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+
+"""Benchmark resolving member names while loading HW2 archives.
+
+Usage: python benchmarks/bench_hw2_load.py [-n FILES] [--skip-legacy] [archive.big ...]
+
+With no archives a synthetic HW2 archive with FILES members (30000 by default)
+spread over a few hundred folders is written to a temp dir (using the archive
+writer from the test suite). Each archive is loaded with the current name
+resolution and with the old one, which looked every file_info entry up with
+list.index() and read every name with its own seek.
+"""
+
+import argparse
+import sys
+import os
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from naabal.formats.big.hw2 import Homeworld2BigFile, Homeworld2BigInfo, \
+    Homeworld2BigArchiveHeader, MAX_FILENAME_LENGTH
+from tests.test_formats_big_hw2 import build_hw2_archive
+
+class LegacyHomeworld2BigFile(Homeworld2BigFile):
+    def _get_members(self):
+        self._filename_map = self._build_filename_map()
+        members = []
+        for file_info in self._data['file_info']:
+            member = Homeworld2BigInfo(self)
+            member.load(file_info, self._data['file_info']._data_list.index(file_info))
+            members.append(member)
+        return members
+
+    def _build_filename_map(self):
+        fn_map = [None] * len(self._data['file_info'])
+        for fn, fi in self._walk_contents():
+            fn_map[self._data['file_info']._data_list.index(fi)] = fn
+        return fn_map
+
+    def _walk_contents(self):
+        for toc_entry in self._data['table_of_contents']:
+            for item_path, item in self._walk_folder(self._data['folders'][toc_entry['start_folder_idx']]):
+                yield os.path.join(toc_entry['filename'], item_path), item
+
+    def _walk_folder(self, folder_entry):
+        folder_name = self._read_filename(folder_entry) or ''
+        if folder_entry['first_subfolder_idx'] != folder_entry['last_subfolder_idx']:
+            for subfolder in self._data['folders'][folder_entry['first_subfolder_idx']:folder_entry['last_subfolder_idx']]:
+                for item_path, item in self._walk_folder(subfolder):
+                    yield item_path, item
+        for file_info in self._data['file_info'][folder_entry['first_fileinfo_idx']:folder_entry['last_fileinfo_idx']]:
+            yield os.path.join(folder_name, self._read_filename(file_info)), file_info
+
+    def _read_filename(self, entry):
+        self.seek(Homeworld2BigArchiveHeader.data_size +
+            self._data['section_header']['filename_list_offset'] + entry['filename_offset'])
+        filename = self.read(MAX_FILENAME_LENGTH).split('\x00', 1)[0]
+        return self._normalize_filename(filename)
+
+def synthetic_files(count):
+    return [('data/dir{0:03d}/file{1:05d}.dat'.format(i % 300, i), 'x' * 16, False) \
+        for i in xrange(count)]
+
+def bench_load(label, bigfile_class, filename):
+    start = time.time()
+    with bigfile_class(filename) as bigfile:
+        bigfile.load()
+        seconds = time.time() - start
+        sys.stdout.write('  {0:8s} {1:8.3f}s  {2:d} members\n'.format(label, seconds, len(bigfile)))
+        return bigfile.get_filenames()
+
+def bench_archive(filename, skip_legacy=False):
+    sys.stdout.write('{0}:\n'.format(filename))
+    filenames = bench_load('current', Homeworld2BigFile, filename)
+    if not skip_legacy:
+        assert filenames == bench_load('legacy', LegacyHomeworld2BigFile, filename)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark HW2 member name resolution')
+    parser.add_argument('-n', '--files', type=int, default=30000,
+        help='members in the synthetic archive')
+    parser.add_argument('--skip-legacy', action='store_true',
+        help='only time the current implementation')
+    parser.add_argument('archives', nargs='*')
+    args = parser.parse_args()
+
+    if args.archives:
+        for filename in args.archives:
+            bench_archive(filename, args.skip_legacy)
+        return 0
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp_dir, 'synthetic.big')
+        build_hw2_archive(filename, synthetic_files(args.files))
+        bench_archive(filename, args.skip_legacy)
+    finally:
+        shutil.rmtree(tmp_dir)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
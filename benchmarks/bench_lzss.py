@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Alex Headley <aheadley@waysaboutstuff.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Benchmark LZSS decompression against the original bit-at-a-time decoder.
+
+Usage: python benchmarks/bench_lzss.py [compressed-file ...]
+
+With no arguments a synthetic multi-megabyte stream is generated. Files given on
+the command line should be raw LZSS streams (e.g. members extracted from a HW1
+.big with --no-decompress).
+"""
+
+import argparse
+import sys
+import os
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from naabal.util import StringIO
+from naabal.util.bitio import BitReader
+from naabal.util.lzss import LZSS
+
+SYNTHETIC_SIZE  = 4 * 1024 * 1024
+REPEAT          = 3
+
+def reference_decompress(data):
+    """The original decoder, kept here to check the output is byte-identical
+    """
+
+    input_buffer = StringIO(data)
+    output_buffer = StringIO()
+    current_position = 1
+    window = bytearray(LZSS.WINDOW_SIZE)
+    with BitReader(input_buffer) as bit_reader:
+        while True:
+            if bit_reader.read_bit():
+                c = bit_reader.read_bits(8)
+                output_buffer.write(chr(c))
+                window[current_position] = c
+                current_position = (current_position + 1) % LZSS.WINDOW_SIZE
+            else:
+                match_position = bit_reader.read_bits(LZSS.INDEX_BIT_COUNT)
+                if match_position == LZSS.END_OF_STREAM:
+                    break
+                match_length = bit_reader.read_bits(LZSS.LENGTH_BIT_COUNT) + LZSS.BREAK_EVEN
+                for i in xrange(match_length + 1):
+                    c = window[(match_position + i) % LZSS.WINDOW_SIZE]
+                    output_buffer.write(chr(c))
+                    window[current_position] = c
+                    current_position = (current_position + 1) % LZSS.WINDOW_SIZE
+    return output_buffer.getvalue()
+
+def synthetic_stream(size, seed=0x4E41):
+    """Build a valid LZSS stream of a mix of literals and (sometimes
+    overlapping) matches that decodes to roughly `size` bytes
+    """
+
+    rng = random.Random(seed)
+    output = bytearray()
+    bits = [0, 0]
+
+    def put(value, bit_count):
+        bits[0] = (bits[0] << bit_count) | value
+        bits[1] += bit_count
+        while bits[1] >= 8:
+            bits[1] -= 8
+            output.append((bits[0] >> bits[1]) & 0xFF)
+        bits[0] &= (1 << bits[1]) - 1
+
+    decoded = 0
+    while decoded < size:
+        if decoded < 32 or rng.random() < 0.35:
+            put(1, 1)
+            put(rng.randint(0x20, 0x7E), 8)
+            decoded += 1
+        else:
+            put(0, 1)
+            put(rng.randint(1, LZSS.WINDOW_SIZE - 1), LZSS.INDEX_BIT_COUNT)
+            length = rng.randint(0, (1 << LZSS.LENGTH_BIT_COUNT) - 1)
+            put(length, LZSS.LENGTH_BIT_COUNT)
+            decoded += length + LZSS.BREAK_EVEN + 1
+    put(0, 1)
+    put(LZSS.END_OF_STREAM, LZSS.INDEX_BIT_COUNT)
+    if bits[1]:
+        put(0, 8 - bits[1])
+    return str(output)
+
+def best_time(func, data):
+    timings = []
+    for i in xrange(REPEAT):
+        start = time.time()
+        result = func(data)
+        timings.append(time.time() - start)
+    return min(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark LZSS decompression')
+    parser.add_argument('streams', nargs='*', help='raw LZSS streams to decompress')
+    args = parser.parse_args()
+
+    corpus = []
+    for filename in args.streams:
+        with open(filename, 'rb') as handle:
+            corpus.append((filename, handle.read()))
+    if not corpus:
+        corpus.append(('<synthetic>', synthetic_stream(SYNTHETIC_SIZE)))
+
+    for name, data in corpus:
+        ref_time, ref_output = best_time(reference_decompress, data)
+        new_time, new_output = best_time(LZSS().decompress, data)
+        if ref_output != new_output:
+            sys.stdout.write('{0}: OUTPUT MISMATCH\n'.format(name))
+            return 1
+        mb = len(ref_output) / (1024.0 * 1024.0)
+        sys.stdout.write('{0}: {1:d} -> {2:d} bytes\n'.format(name, len(data), len(ref_output)))
+        sys.stdout.write('  reference: {0:8.3f}s {1:8.2f} MB/s\n'.format(ref_time, mb / ref_time))
+        sys.stdout.write('  batched:   {0:8.3f}s {1:8.2f} MB/s ({2:.1f}x)\n'.format(
+            new_time, mb / new_time, ref_time / new_time))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Alex Headley <aheadley@waysaboutstuff.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Benchmark decoding StructuredFileSection records.
+
+Usage: python benchmarks/bench_sections.py [-n ENTRIES]
+
+Builds a synthetic HW1 table of contents with ENTRIES records and times
+decoding it with the original per-record, per-member loop and with the
+columnar sequence loader.
+"""
+
+import argparse
+import datetime
+import logging
+import struct
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from naabal.util import StringIO
+from naabal.formats.big.hw1 import HomeworldBigTocEntry, HomeworldBigToc
+
+logger = logging.getLogger('naabal.formats')
+
+def legacy_data_format(section):
+    return section.ENDIANNESS + \
+        ''.join(member['fmt'] * member['len'] for member in section.STRUCTURE)
+
+def legacy_data_size(section):
+    return struct.calcsize(legacy_data_format(section))
+
+def legacy_load(section, handle):
+    """The original StructuredFileSection.load() and unpack()
+    """
+
+    section._data = {}
+    logger.debug('Reading %d bytes at offset %d for format: %s',
+        legacy_data_size(section), handle.tell(), legacy_data_format(section))
+    data = handle.read(legacy_data_size(section))
+    if len(data) != legacy_data_size(section):
+        raise ValueError(len(data))
+    unpacked_data = struct.unpack(legacy_data_format(section), data)
+    idx = 0
+    for member in section.STRUCTURE:
+        if member['len'] == 1:
+            member_data = unpacked_data[idx]
+        else:
+            member_data = unpacked_data[idx:idx+member['len']]
+        parsed_member_data = member['read'](member_data)
+        section._data[member['key']] = parsed_member_data
+        logger.debug('Loaded member data: [%s] => %r', member['key'], parsed_member_data)
+        idx += member['len']
+    section.check()
+
+class TocHandle(object):
+    def __init__(self, data, count):
+        self._stream = StringIO(data)
+        self._data = {'header': {'toc_entry_count': count}}
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+    def tell(self):
+        return self._stream.tell()
+
+def build_toc(count):
+    handle = StringIO()
+    entry = HomeworldBigTocEntry()
+    entry['timestamp'] = datetime.datetime(1999, 9, 1)
+    for i in xrange(count):
+        entry['entry_offset'] = i * 100
+        entry['data_real_size'] = i
+        entry['data_stored_size'] = i
+        entry.save(handle)
+    return handle.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark section decoding')
+    parser.add_argument('-n', '--entries', type=int, default=65535)
+    args = parser.parse_args()
+
+    data = build_toc(args.entries)
+    sys.stdout.write('HW1 ToC: {0:d} entries, {1:d} bytes\n'.format(args.entries, len(data)))
+
+    handle = TocHandle(data, args.entries)
+    start = time.time()
+    for i in xrange(args.entries):
+        legacy_load(HomeworldBigTocEntry.__new__(HomeworldBigTocEntry), handle)
+    sys.stdout.write('  {0:12s} {1:8.3f}s\n'.format('legacy', time.time() - start))
+
+    handle = TocHandle(data, args.entries)
+    start = time.time()
+    toc = HomeworldBigToc(handle)
+    sys.stdout.write('  {0:12s} {1:8.3f}s\n'.format('columnar', time.time() - start))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -27,6 +27,7 @@ import os
 import logging
 
 from naabal.util import classproperty, split_by
+from naabal.util.file_io import MappedFile, pread, preadinto
 from naabal.errors import StructuredFileFormatException
 
 logger = logging.getLogger('naabal.formats')
@@ -61,8 +62,18 @@ class StructuredFile(object):
     def newlines(self):
         return None
 
-    def __init__(self, filename, mode='rb'):
-        handle = open(filename, mode)
+    def __init__(self, filename, mode='rb', use_mmap=False):
+        if hasattr(filename, 'read'):
+            # already open, the mode it was opened with wins
+            handle = filename
+            mode = getattr(handle, 'mode', mode)
+        else:
+            handle = open(filename, mode)
+        if use_mmap:
+            if mode not in ('r', 'rb'):
+                handle.close()
+                raise ValueError('Memory mapping is only supported for read-only files')
+            handle = MappedFile(handle)
         self._mode = mode
         self._closed = False
         self._name = handle.name
@@ -110,6 +121,15 @@ class StructuredFile(object):
     def read(self, size=-1):
         return self._handle.read(size)
 
+    def readinto(self, buffer):
+        return self._handle.readinto(buffer)
+
+    def pread(self, size, offset):
+        return pread(self._handle, size, offset)
+
+    def preadinto(self, buffer, offset):
+        return preadinto(self._handle, buffer, offset)
+
     def seek(self, offset, whence=os.SEEK_SET):
         return self._handle.seek(offset, whence)
 
@@ -149,10 +169,76 @@ class StructuredFile(object):
     def _load_defaults(self):
         self._data = {key: member_type() for key, member_type in self.STRUCTURE}
 
+class StructuredFileSectionData(object):
+    """Base for the compact value records sections keep their data in, one
+    subclass with a slot per STRUCTURE key is generated for each section class
+    """
+
+    __slots__ = ()
+
+    def __init__(self, values=()):
+        for key, value in zip(self.__slots__, values):
+            setattr(self, key, value)
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def items(self):
+        return [(key, getattr(self, key, None)) for key in self.__slots__]
+
+class StructuredFileSectionMeta(type):
+    """Compiles a section's STRUCTURE once, when the class is created, into a
+    struct.Struct, a flat table of (key, start, end, read) members where
+    `end` is None for single values and `read` is None when the unpacked value
+    can be used as is, and a StructuredFileSectionData type for its values.
+    Sections are given empty __slots__ unless they declare their own
+    """
+
+    INT_FORMATS         = 'bBhHiIlLqQ'
+
+    def __new__(meta, name, bases, attrs):
+        attrs.setdefault('__slots__', ())
+        return super(StructuredFileSectionMeta, meta).__new__(meta, name, bases, attrs)
+
+    def __init__(cls, name, bases, attrs):
+        super(StructuredFileSectionMeta, cls).__init__(name, bases, attrs)
+        cls._data_type = type(name + 'Data', (StructuredFileSectionData,),
+            {'__slots__': tuple(member['key'] for member in cls.STRUCTURE)})
+        cls._struct = struct.Struct(cls.ENDIANNESS + \
+            ''.join(member['fmt'] * member['len'] for member in cls.STRUCTURE))
+        cls._member_table = []
+        idx = 0
+        for member in cls.STRUCTURE:
+            read = member['read']
+            if (read is int and member['fmt'][-1] in cls.INT_FORMATS) or \
+                    (read is str and member['fmt'][-1] == 's'):
+                read = None
+            if member['len'] == 1:
+                cls._member_table.append((member['key'], idx, None, read))
+            else:
+                cls._member_table.append((member['key'], idx, idx + member['len'], read))
+            idx += member['len']
+        cls._field_count = idx
+
 class StructuredFileSection(object):
+    __metaclass__       = StructuredFileSectionMeta
+
+    __slots__           = ('_data',)
+
     ENDIANNESS          = '<'
     STRUCTURE           = []
-    _data               = None
 
     def __init__(self, handle=None):
         if handle is not None:
@@ -178,14 +264,13 @@ class StructuredFileSection(object):
     @classproperty
     @classmethod
     def data_size(cls):
-        return struct.calcsize(cls.data_format)
+        return cls._struct.size
     __len__ = data_size
 
     @classproperty
     @classmethod
     def data_format(cls):
-        return cls.ENDIANNESS + \
-            ''.join(member['fmt'] * member['len'] for member in cls.STRUCTURE)
+        return cls._struct.format
 
     @classproperty
     @classmethod
@@ -193,35 +278,83 @@ class StructuredFileSection(object):
         return [member['key'] for member in cls.STRUCTURE]
 
     def unpack(self, data):
-        if len(data) != self.data_size:
+        if len(data) != self._struct.size:
             raise StructuredFileFormatException('Data length is not expected: %d != %d' % \
-                (len(data), self.data_size))
+                (len(data), self._struct.size))
         else:
-            return struct.unpack(self.data_format, data)
+            return self._struct.unpack(data)
+
+    def unpack_from(self, buffer, offset=0):
+        if len(buffer) - offset < self._struct.size:
+            raise StructuredFileFormatException('Data length is not expected: %d < %d' % \
+                (len(buffer) - offset, self._struct.size))
+        else:
+            return self._struct.unpack_from(buffer, offset)
 
     def load(self, handle):
-        self._data = {}
-        logger.debug('Reading %d bytes at offset %d for format: %s',
-            self.data_size, handle.tell(), self.data_format)
-        unpacked_data = self.unpack(handle.read(self.data_size))
-        idx = 0
-        for member in self.STRUCTURE:
-            if member['len'] == 1:
-                member_data = unpacked_data[idx]
-            else:
-                member_data = unpacked_data[idx:idx+member['len']]
-            try:
-                parsed_member_data = member['read'](member_data)
-            except Exception as err:
-                logger.error('Failed to parse member [%s] from data: %r',
-                    member['key'], member_data)
-                logger.exception(err)
-                raise StructuredFileFormatException(err)
-            self._data[member['key']] = parsed_member_data
-            logger.debug('Loaded member data: [%s] => %r', member['key'], parsed_member_data)
-            idx += member['len']
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Reading %d bytes at offset %d for format: %s',
+                self._struct.size, handle.tell(), self._struct.format)
+        self._data = self._decode(self.unpack(handle.read(self._struct.size)))
         self.check()
 
+    def load_from(self, buffer, offset=0):
+        self._data = self._decode(self.unpack_from(buffer, offset))
+        self.check()
+
+    @classmethod
+    def unpack_columns(cls, data, count):
+        """Decode `count` consecutive records from `data` at once into a dict
+        of per-member column lists
+        """
+
+        record_size = cls._struct.size
+        if len(data) != record_size * count:
+            raise StructuredFileFormatException('Data length is not expected: %d != %d' % \
+                (len(data), record_size * count))
+        if hasattr(cls._struct, 'iter_unpack'):
+            records = cls._struct.iter_unpack(data)
+        else:
+            unpack_from = cls._struct.unpack_from
+            records = [unpack_from(data, offset) \
+                for offset in xrange(0, record_size * count, record_size)]
+        fields = list(zip(*records)) or [()] * cls._field_count
+
+        columns = {}
+        try:
+            for key, start, end, read in cls._member_table:
+                if end is None:
+                    column = fields[start]
+                else:
+                    column = zip(*fields[start:end])
+                if read is None:
+                    column = list(column)
+                else:
+                    column = [read(value) for value in column]
+                columns[key] = column
+        except Exception as err:
+            logger.error('Failed to parse member [%s] of %d records', key, count)
+            logger.exception(err)
+            raise StructuredFileFormatException(err)
+        return columns
+
+    def _decode(self, unpacked_data):
+        values = []
+        try:
+            for key, start, end, read in self._member_table:
+                if end is None:
+                    value = unpacked_data[start]
+                else:
+                    value = unpacked_data[start:end]
+                if read is not None:
+                    value = read(value)
+                values.append(value)
+        except Exception as err:
+            logger.error('Failed to parse member [%s] from data: %r', key, value)
+            logger.exception(err)
+            raise StructuredFileFormatException(err)
+        return self._data_type(values)
+
     def save(self, handle):
         self.check()
         unpacked_data = []
@@ -231,17 +364,81 @@ class StructuredFileSection(object):
             else:
                 unpacked_data += [struct_m['write'](self._data[struct_m['key']])]
 
-        handle.write(struct.pack(self.data_format, *unpacked_data))
+        handle.write(self._struct.pack(*unpacked_data))
 
     def check(self):
         return True
 
     def _load_defaults(self):
-        self._data = {member['key']: member['default'] for member in self.STRUCTURE}
+        self._data = self._data_type([member['default'] for member in self.STRUCTURE])
+
+class StructuredFileRecord(object):
+    """View of a single record of a columnar StructuredFileSequence, record
+    types are made per CHILD_TYPE so the view still is-a CHILD_TYPE with all
+    of its methods (check(), save(), etc)
+    """
+
+    __slots__ = ()
+
+    _record_types = {}
+
+    def __init__(self, columns, index):
+        self._columns = columns
+        self._index = index
+
+    @classmethod
+    def for_section(cls, section_type):
+        record_type = cls._record_types.get(section_type)
+        if record_type is None:
+            record_type = type(section_type)(section_type.__name__ + 'Record',
+                (cls, section_type), {'__slots__': ('_columns', '_index')})
+            cls._record_types[section_type] = record_type
+        return record_type
+
+    @property
+    def _data(self):
+        # sections look their values up in _data, which for a record is itself
+        return self
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def __setitem__(self, key, value):
+        self._columns[key][self._index] = value
+
+    def __eq__(self, other):
+        # views are made on demand, two views of the same record are equal
+        if isinstance(other, StructuredFileRecord):
+            return self._columns is other._columns and self._index == other._index
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash((id(self._columns), self._index))
+
+    def __repr__(self):
+        return repr(dict((key, column[self._index]) for key, column in self._columns.items()))
+
+    def get(self, key, default=None):
+        column = self._columns.get(key)
+        if column is None:
+            return default
+        return column[self._index]
 
 class StructuredFileSequence(object):
+    """Sequence of CHILD_TYPE records, loaded sequences keep their values in
+    per-member columns and hand out StructuredFileRecord views of them
+    """
+
     CHILD_TYPE      = None
-    _data_list      = None
+    _columns        = None
+    _length         = 0
+    _records        = None
 
     def __init__(self, handle=None):
         if handle is not None:
@@ -250,39 +447,98 @@ class StructuredFileSequence(object):
             self._load_defaults()
 
     def __getitem__(self, key):
-        return self._data_list[key]
+        if self._records is None:
+            if isinstance(key, slice):
+                return [self.record(index) for index in xrange(*key.indices(self._length))]
+            return self.record(key)
+        return self._records[key]
 
     def __setitem__(self, key, value):
         if not issubclass(value.__class__, self.CHILD_TYPE):
             raise ValueError(value)
-        return self._data_list.set(key, value)
+        self._data_list[key] = value
 
     def __iter__(self):
-        return (member for member in self._data_list)
+        if self._records is None:
+            record_type = StructuredFileRecord.for_section(self.CHILD_TYPE)
+            columns = self._columns
+            return (record_type(columns, index) for index in xrange(self._length))
+        return iter(self._records)
 
     def __repr__(self):
-        return repr(self._data_list)
+        return repr(list(self))
 
     def __len__(self):
-        return len(self._data_list)
+        if self._records is not None:
+            return len(self._records)
+        return self._length
+
+    @property
+    def _data_list(self):
+        if self._records is None:
+            record_type = StructuredFileRecord.for_section(self.CHILD_TYPE)
+            self._records = [record_type(self._columns, i) for i in xrange(self._length)]
+        return self._records
+
+    @_data_list.setter
+    def _data_list(self, records):
+        self._records = records
+        self._columns = None
+        self._length = len(records)
+
+    def record(self, index):
+        """The record at `index`, without building views for the whole sequence
+        """
+
+        if self._records is None:
+            if index < 0:
+                index += self._length
+            if not 0 <= index < self._length:
+                raise IndexError('sequence index out of range')
+            return StructuredFileRecord.for_section(self.CHILD_TYPE)(self._columns, index)
+        return self._records[index]
+
+    def column(self, key):
+        """All values of member `key`, in record order
+        """
+
+        if self._columns is None:
+            return [record[key] for record in self._records]
+        return self._columns[key]
 
     def load(self, handle):
-        logger.debug('Loading %d sections of type: %r',
-            self._get_expected_length(handle), self.CHILD_TYPE)
-        self._data_list = [self.CHILD_TYPE(handle) \
-            for i in xrange(self._get_expected_length(handle))]
+        count = self._get_expected_length(handle)
+        logger.debug('Loading %d sections of type: %r', count, self.CHILD_TYPE)
+        self._columns = self.CHILD_TYPE.unpack_columns(
+            handle.read(self.CHILD_TYPE.data_size * count), count)
+        self._length = count
+        self._records = None
+        self._check_columns()
 
     def save(self, handle):
         logger.debug('Saving %d sections of type: %r',
             self._get_expected_length(handle), self.CHILD_TYPE)
-        for child in self._data_list:
+        for child in self:
             child.save(handle)
 
     def check(self):
-        return all(child.check() for child in self._data_list)
+        return all(child.check() for child in self)
 
     def _load_defaults(self):
         self._data_list = []
 
+    def _check_columns(self):
+        check = self.CHILD_TYPE.check
+        if getattr(check, '__func__', check) is \
+                getattr(StructuredFileSection.check, '__func__', StructuredFileSection.check):
+            return
+        # run the per-record checks on a single section, swapping a plain dict
+        # of each record in as its data
+        keys = list(self._columns)
+        section = self.CHILD_TYPE.__new__(self.CHILD_TYPE)
+        for values in zip(*[self._columns[key] for key in keys]):
+            section._data = dict(zip(keys, values))
+            section.check()
+
     def _get_expected_length(self, handle):
         raise NotImplemented()
@@ -25,26 +25,128 @@
 import struct
 import os
 import os.path
+import tempfile
+import itertools
+import collections
+import multiprocessing
+import multiprocessing.pool
+import multiprocessing.util
 import logging
 
 from naabal.formats import StructuredFile, StructuredFileSection, StructuredFileSequence
 from naabal.util import StringIO, datetime_to_timestamp, timestamp_to_datetime
-from naabal.util.file_io import FileInFile, chunked_copy
+from naabal.util.file_io import FileInFile, AnonymousMappedFile, chunked_copy, \
+    chunked_copy_into, kernel_copy, pread, preadinto, pwrite
 from naabal.util.gbx_crypt import GearboxCrypt
+from naabal.util.lru import LRUCache
 from naabal.errors import GearboxEncryptionException
 
 logger = logging.getLogger('naabal.formats.big')
 
+# per-process state for GearboxEncryptedBigFile.decrypt_to_file workers, set
+# once by the pool initializer instead of being pickled with every range
+_decrypt_worker_state = None
+
+def _init_decrypt_worker(crypto, src_filename, dest_filename, chunk_size):
+    global _decrypt_worker_state
+    _decrypt_worker_state = (crypto, src_filename, dest_filename, chunk_size)
+
+def _decrypt_range(crypto, handle, write_func, offset, size, chunk_size):
+    """Decrypt `size` bytes of the encrypted `handle` starting at `offset`, a
+    chunk of up to `chunk_size` bytes at a time. Each decrypted chunk is
+    passed to `write_func` along with its offset. Returns the number of bytes
+    decrypted
+    """
+
+    buffer = bytearray(min(chunk_size, size))
+    view = memoryview(buffer)
+    done = 0
+    while done < size:
+        read_size = preadinto(handle, view[:min(len(buffer), size - done)], offset + done)
+        if not read_size:
+            raise IOError('Unexpected EOF at offset %d of %s' %
+                (offset + done, getattr(handle, 'name', handle)))
+        chunk = buffer if read_size == len(buffer) else view[:read_size]
+        crypto.decrypt_into(chunk, offset + done)
+        write_func(chunk, offset + done)
+        done += read_size
+    return done
+
+def _decrypt_range_in_worker(data_range):
+    offset, size = data_range
+    crypto, src_filename, dest_filename, chunk_size = _decrypt_worker_state
+    with open(src_filename, 'rb') as infile:
+        with open(dest_filename, 'r+b') as outfile:
+            return _decrypt_range(crypto, infile,
+                lambda chunk, chunk_offset: pwrite(outfile, chunk, chunk_offset),
+                offset, size, chunk_size)
+
+# per-process state for BigFile.extract_all workers that run in a process
+# pool, each worker reopens the archive by path
+_extract_worker_state = None
+
+def _init_extract_worker(src_filename, algorithm):
+    global _extract_worker_state
+    handle = open(src_filename, 'rb')
+    # close it when the pool shuts the worker down
+    multiprocessing.util.Finalize(None, handle.close, exitpriority=10)
+    _extract_worker_state = (handle, algorithm)
+
+def _extract_in_worker(task, stream=False):
+    handle, algorithm = _extract_worker_state
+    if stream:
+        return _extract_stream(handle, algorithm, *task)
+    return _extract_batch(lambda size, offset: pread(handle, size, offset), algorithm, *task)
+
+def _extract_stream(handle, algorithm, offset, size, entries):
+    """Write out the single member in `entries` from the real file `handle` a
+    chunk at a time, for members too big to read in one go
+    """
+
+    (start, stored_size, filename, mtime, decompress), = entries
+    with open(filename, 'wb') as outfile:
+        infile = FileInFile(handle, offset + start, stored_size)
+        if decompress:
+            algorithm.decompress_stream(infile, outfile)
+        else:
+            copied = kernel_copy(handle, outfile, stored_size, offset + start)
+            if copied < stored_size:
+                infile.seek(copied)
+                chunked_copy_into(infile.readinto, outfile.write)
+    os.utime(filename, (mtime, mtime))
+    return len(entries)
+
+def _extract_batch(read_func, algorithm, offset, size, entries):
+    """Read `size` bytes at `offset` with a single read and write out each of
+    the (start, stored_size, filename, mtime, decompress) `entries` from its
+    slice of them
+    """
+
+    data = read_func(size, offset)
+    if len(data) != size:
+        raise IOError('Unexpected EOF at offset %d reading %d bytes' % (offset, size))
+    for start, stored_size, filename, mtime, decompress in entries:
+        if start == 0 and stored_size == size:
+            member_data = data
+        else:
+            member_data = data[start:start + stored_size]
+        if decompress:
+            member_data = algorithm.decompress(member_data)
+        with open(filename, 'wb') as outfile:
+            outfile.write(member_data)
+        os.utime(filename, (mtime, mtime))
+    return len(entries)
+
 class BigInfo(object):
-    _bigfile        = None
-    _offset         = 0
-    _name           = None
-    _mtime          = None
-    _real_size      = 0
-    _stored_size    = 0
+    __slots__ = ('_bigfile', '_offset', '_name', '_mtime', '_real_size', '_stored_size')
 
     def __init__(self, bigfile):
-        self._bigfile = bigfile
+        self._bigfile       = bigfile
+        self._offset        = 0
+        self._name          = None
+        self._mtime         = None
+        self._real_size     = 0
+        self._stored_size   = 0
 
     def __repr__(self):
         return '<{0}("{1}")>'.format(self.__class__.__name__, self.name)
@@ -76,6 +178,8 @@ class BigInfo(object):
         return self._stored_size
 
 class ExternalBigInfo(BigInfo):
+    __slots__ = ('_real_filename',)
+
     def open(self, mode='rb'):
         return open(self._real_filename, mode)
 
@@ -98,18 +202,82 @@ class ExternalBigInfo(BigInfo):
         self._stored_size    = fstat.st_size
 
 class BigFile(StructuredFile):
-    _members        = []
+    # resolve members on first use instead of in load()
+    LAZY_MEMBERS    = False
+    # extract_all(jobs=N) decompresses in a process pool when the compression
+    # is pure python and holds the GIL, in a thread pool otherwise
+    EXTRACT_IN_PROCESSES    = False
+    # how much member data (stored + decompressed) may be queued or in flight
+    # in the extract_all workers at once
+    EXTRACT_INFLIGHT_SIZE   = 64 * 1024 * 1024 # 64MB
+    # extract_all works through the archive in data order, merging neighbouring
+    # members into reads of up to EXTRACT_COALESCE_SIZE as long as there are no
+    # more than EXTRACT_COALESCE_GAP bytes of headers/names between them
+    EXTRACT_COALESCE_SIZE   = 1024 * 1024 # 1MB
+    EXTRACT_COALESCE_GAP    = 4 * 1024 # 4KB
+
+    _members        = None
+    _member_index   = None
+    _folded_index   = None
+
+    def __init__(self, *pargs, **kwargs):
+        self._members = []
+        super(BigFile, self).__init__(*pargs, **kwargs)
 
     def __iter__(self):
         return iter(self.get_members())
 
     def __len__(self):
-        return len(self._members)
+        return len(self.get_members())
+
+    @classmethod
+    def probe(cls, handle, header, trailer):
+        """Cheaply check if `handle` is an archive in this format, `header` and
+        `trailer` are the first and last few KB of it
+        """
+
+        return False
 
-    def load(self):
+    def __contains__(self, filename):
+        try:
+            self.get_member(filename)
+        except KeyError:
+            return False
+        return True
+
+    def load(self, index_cache=None):
+        """Read the archive index, `index_cache` is an optional BigIndexCache
+        that is tried first and updated on a miss. A cache hit skips parsing
+        the archive structure that save() needs, so the cache is not used for
+        archives opened for writing
+        """
+
+        if index_cache is not None and any(c in (self.mode or '') for c in 'wa+'):
+            index_cache = None
+        if index_cache is not None:
+            try:
+                members = index_cache.get(self)
+            except (IOError, OSError) as err:
+                logger.warning('Failed to read index cache for %s: %s', self.name, err)
+                members = None
+            if members is not None:
+                # stored in name order already
+                self._members = members
+                self._reset_member_index()
+                return
+        self._load_index()
+        if index_cache is not None:
+            try:
+                index_cache.put(self)
+            except (IOError, OSError) as err:
+                logger.warning('Failed to update index cache for %s: %s', self.name, err)
+
+    def _load_index(self):
         super(BigFile, self).load()
-        self._members = self._get_members()
-        self._sort_members()
+        self._members = None
+        self._reset_member_index()
+        if not self.LAZY_MEMBERS:
+            self.get_members()
 
     def check_format(self):
         key, member_type = self.STRUCTURE[0]
@@ -125,26 +293,54 @@ class BigFile(StructuredFile):
         logger.debug('Opened member [%r] in mode "%s" as: %r', member, mode, handle)
         return handle
 
-    def get_member(self, filename):
-        for member in self.get_members():
-            if member.name == filename:
-                return member
+    def get_member(self, filename, case_sensitive=True):
+        """Look up a member by name, either path separator may be used. With
+        case_sensitive=False names are compared lowercased, the way the game
+        engine compares them
+        """
+
+        if case_sensitive:
+            member = self._get_member_index().get(self._get_index_key(filename))
         else:
+            member = self._get_folded_index().get(self._get_index_key(filename).lower())
+        if member is None:
             raise KeyError(filename)
+        return member
 
     def get_members(self):
+        if self._members is None:
+            self._members = self._get_members()
+            self._sort_members()
         return self._members
 
+    def prefetch_metadata(self, members=None):
+        """Read any member metadata that is loaded lazily for `members` (all of
+        them by default) in one pass, formats that keep everything in the index
+        have nothing to do here
+        """
+
     def get_filenames(self):
         return [member.name for member in self.get_members()]
 
+    def member_view(self, member):
+        """Zero-copy view of the stored (possibly compressed) data of `member`,
+        only available when the archive was opened with use_mmap=True
+        """
+
+        if not hasattr(self._handle, 'view'):
+            raise IOError('Member views need an archive opened with use_mmap=True')
+        return self._handle.view(member._offset, member.stored_size)
+
     def extract_file(self, member, fileobj, decompress=True):
         with self.open_member(member) as infile:
             if decompress and member.is_compressed:
                 logger.debug('Extracting and decompressing member: %r', member)
                 self.COMPRESSION_ALGORITHM.decompress_stream(infile, fileobj)
             else:
-                chunked_copy(infile.read, fileobj.write)
+                copied = self._kernel_copy_member(member, fileobj)
+                if copied < member.stored_size:
+                    infile.seek(copied)
+                    chunked_copy_into(infile.readinto, fileobj.write)
             logger.info('Extracted %r to %r', infile, fileobj)
 
     def extract(self, member, path='', decompress=True):
@@ -159,18 +355,47 @@ class BigFile(StructuredFile):
             self.extract_file(member, outfile, decompress)
         os.utime(full_filename, (mtime, mtime))
 
-    def extract_all(self, members=None, path='', decompress=True):
+    def extract_all(self, members=None, path='', decompress=True, jobs=None, progress=None,
+            coalesce_size=None):
+        """Extract `members` (all by default) under `path`, in the order their
+        data is stored in the archive. Small neighbouring members are read
+        together, up to `coalesce_size` bytes at a time. With `jobs` > 1 the reads
+        are handed to that many workers. `progress` is called with each member
+        once it has been extracted
+        """
+
         if members is None:
             members = self.get_members()
-        for member in members:
-            self.extract(member, path, decompress)
+        if coalesce_size is None:
+            coalesce_size = self.EXTRACT_COALESCE_SIZE
+        # the timestamps are needed for every file, read them in one pass
+        self.prefetch_metadata(members)
+        plan = self._plan_extraction(members, coalesce_size)
+        if jobs is None or jobs <= 1:
+            algorithm = self.COMPRESSION_ALGORITHM
+            for offset, size, batch in plan:
+                if len(batch) == 1:
+                    # stream it, it may well be too big to hold in memory
+                    self.extract(batch[0], path, decompress)
+                else:
+                    _extract_batch(self.pread, algorithm, offset, size,
+                        self._get_extract_entries(offset, batch, path, decompress))
+                if progress is not None:
+                    for member in batch:
+                        progress(member)
+        else:
+            self._extract_parallel(plan, path, decompress, jobs, progress, coalesce_size)
 
     def add_file(self, fileobj):
         self.add(self.get_biginfo(fileobj))
 
     def add(self, biginfo, sort_after=True):
         logger.info('Adding member to archive: %r', biginfo)
-        self._members.append(biginfo)
+        self.get_members().append(biginfo)
+        if self._member_index is not None:
+            self._member_index.setdefault(self._get_index_key(biginfo.name), biginfo)
+        if self._folded_index is not None:
+            self._folded_index.setdefault(self._get_index_key(biginfo.name).lower(), biginfo)
         if sort_after:
             self._sort_members()
 
@@ -201,6 +426,127 @@ class BigFile(StructuredFile):
     def _sort_members(self):
         self._members.sort(key=lambda m: m.name)
 
+    def _plan_extraction(self, members, coalesce_size):
+        """Group `members` into (offset, size, members) reads, in archive order
+        """
+
+        plan = []
+        batch = None
+        for member in sorted(members, key=lambda m: m._offset):
+            start = member._offset
+            end = start + member.stored_size
+            if batch is not None and start - batch_end <= self.EXTRACT_COALESCE_GAP and \
+                    max(batch_end, end) - batch_start <= coalesce_size:
+                batch.append(member)
+                batch_end = max(batch_end, end)
+            else:
+                if batch is not None:
+                    plan.append((batch_start, batch_end - batch_start, batch))
+                batch = [member]
+                batch_start = start
+                batch_end = end
+        if batch is not None:
+            plan.append((batch_start, batch_end - batch_start, batch))
+        logger.debug('Planned %d reads for %d members', len(plan), len(members))
+        return plan
+
+    def _get_extract_entries(self, offset, batch, path, decompress):
+        entries = []
+        for member in batch:
+            full_filename = os.path.join(path, member.name)
+            dir_name = os.path.dirname(full_filename)
+            if dir_name and not os.path.isdir(dir_name):
+                os.makedirs(dir_name)
+            entries.append((member._offset - offset, member.stored_size, full_filename,
+                datetime_to_timestamp(member.mtime), decompress and member.is_compressed))
+        return entries
+
+    def _extract_parallel(self, plan, path, decompress, jobs, progress, coalesce_size):
+        algorithm = self.COMPRESSION_ALGORITHM
+        raw_handle = self._get_raw_handle()
+        # only a plain (unencrypted, unmirrored) archive can be read by
+        # reopening the file, everything else goes through our own pread
+        if self.EXTRACT_IN_PROCESSES and raw_handle is self._handle:
+            logger.info('Extracting %d batches with %d processes', len(plan), jobs)
+            pool = multiprocessing.Pool(jobs, _init_extract_worker, (raw_handle.name, algorithm))
+            submit = lambda task, batch, stream: pool.apply_async(_extract_in_worker, (task, stream))
+        else:
+            logger.info('Extracting %d batches with %d threads', len(plan), jobs)
+            pool = multiprocessing.pool.ThreadPool(jobs)
+            def submit(task, batch, stream):
+                if stream:
+                    return pool.apply_async(self.extract, (batch[0], path, decompress))
+                return pool.apply_async(_extract_batch, (self.pread, algorithm) + task)
+
+        pending = collections.deque()
+        inflight_size = 0
+        try:
+            for offset, size, batch in plan:
+                entries = self._get_extract_entries(offset, batch, path, decompress)
+                # members that didn't fit in a coalesced read are streamed like
+                # extract() does, a worker only ever holds a chunk of them
+                stream = len(batch) == 1 and size > coalesce_size
+                if stream:
+                    task_size = min(size, coalesce_size)
+                else:
+                    task_size = size + sum(m.real_size for m, e in zip(batch, entries) if e[4])
+                while pending and inflight_size + task_size > self.EXTRACT_INFLIGHT_SIZE:
+                    done_batch, result, done_size = pending.popleft()
+                    result.get()
+                    inflight_size -= done_size
+                    if progress is not None:
+                        for member in done_batch:
+                            progress(member)
+                pending.append((batch, submit((offset, size, entries), batch, stream), task_size))
+                inflight_size += task_size
+            while pending:
+                done_batch, result, done_size = pending.popleft()
+                result.get()
+                if progress is not None:
+                    for member in done_batch:
+                        progress(member)
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.close()
+            pool.join()
+
+    def _get_raw_handle(self):
+        return self._handle
+
+    def _kernel_copy_member(self, member, fileobj):
+        # only when the member's bytes are stored as is in the archive file,
+        # not for decrypted or mirrored data
+        raw_handle = self._get_raw_handle()
+        if raw_handle is not self._handle:
+            return 0
+        return kernel_copy(raw_handle, fileobj, member.stored_size, member._offset)
+
+    def _get_index_key(self, filename):
+        return os.path.normpath(filename.replace('\\', '/'))
+
+    def _get_member_index(self):
+        # built on first lookup, then kept up to date by add()
+        if self._member_index is None:
+            index = {}
+            for member in self.get_members():
+                index.setdefault(self._get_index_key(member.name), member)
+            self._member_index = index
+        return self._member_index
+
+    def _get_folded_index(self):
+        if self._folded_index is None:
+            index = {}
+            for member in self.get_members():
+                index.setdefault(self._get_index_key(member.name).lower(), member)
+            self._folded_index = index
+        return self._folded_index
+
+    def _reset_member_index(self):
+        self._member_index = None
+        self._folded_index = None
+
 class BigSection(StructuredFileSection): pass
 class BigSequence(StructuredFileSequence): pass
 
@@ -208,18 +554,114 @@ class GearboxEncryptedBigFile(BigFile):
     MASTER_KEY                  = None
     ENCRYPTION_KEY_MARKER       = 0x00000000
     ENCRYPTION_KEY_MAX_SIZE     = 1024 # 0x0400
+    # decrypted plaintext is cached in aligned blocks of this size so the
+    # many small header/filename reads done while loading don't each have to
+    # hit the disk and decrypt from scratch, reads larger than
+    # CACHE_MAX_READ_SIZE skip the cache so extracting doesn't flush it
+    CACHE_BLOCK_SIZE            = 4 * 1024 # 4KB
+    CACHE_SIZE                  = 4 * 1024 * 1024 # 4MB
+    CACHE_MAX_READ_SIZE         = 16 * 1024 # 16KB
+    # alternatively the whole encrypted region can be decrypted once up front
+    # into a plaintext mirror, in memory if it fits in the memory budget and
+    # in a temp file otherwise
+    MIRROR_AUTO                 = 'auto'
+    MIRROR_MEMORY               = 'memory'
+    MIRROR_TEMPFILE             = 'tempfile'
+    MIRROR_MODES                = (MIRROR_AUTO, MIRROR_MEMORY, MIRROR_TEMPFILE)
+    MIRROR_MEMORY_BUDGET        = 512 * 1024 * 1024 # 512MB
+    DECRYPT_CHUNK_SIZE          = 1024 * 1024 # 1MB
+    # unit of work when decrypting to a file with several processes
+    DECRYPT_RANGE_SIZE          = 64 * 1024 * 1024 # 64MB
 
     _crypto                     = None
+    _block_cache                = None
+    _real_handle                = None
+    _mirror                     = None
+    _mirror_mode                = None
+
+    @classmethod
+    def probe(cls, handle, header, trailer):
+        # [marker][key size][key][marker offset] at the very end of the file
+        if len(trailer) < 4:
+            return False
+        marker_offset = struct.unpack('<L', trailer[-4:])[0]
+        if marker_offset < 10 or marker_offset > len(trailer):
+            return False
+        marker, key_size = struct.unpack_from('<LH', trailer, len(trailer) - marker_offset)
+        if marker != cls.ENCRYPTION_KEY_MARKER or key_size > cls.ENCRYPTION_KEY_MAX_SIZE:
+            return False
+        return marker_offset == key_size + 10
+
+    def __init__(self, filename, mode='rb', cache_size=None, mirror=None, memory_budget=None,
+            use_mmap=False):
+        if mirror is not None and mirror not in self.MIRROR_MODES:
+            raise ValueError('Unknown plaintext mirror mode: %r' % mirror)
+        if cache_size is None:
+            cache_size = self.CACHE_SIZE
+        if cache_size > 0:
+            self._block_cache = LRUCache(cache_size)
+        if memory_budget is None:
+            memory_budget = self.MIRROR_MEMORY_BUDGET
+        self._mirror_request = mirror
+        self._memory_budget = memory_budget
+        super(GearboxEncryptedBigFile, self).__init__(filename, mode, use_mmap)
 
     @property
     def data_size(self):
+        if self._crypto is None:
+            return None
         return self._crypto._data_size
 
-    def load(self):
+    @property
+    def block_cache(self):
+        return self._block_cache
+
+    @property
+    def mirror_mode(self):
+        return self._mirror_mode
+
+    def load(self, index_cache=None):
         self._crypto = self._load_encryption()
         self._real_handle = self._handle
-        self._handle = FileInFile(self._real_handle, 0, self.data_size)
-        super(GearboxEncryptedBigFile, self).load()
+        if self._mirror_request is not None:
+            self._mirror = self._create_mirror(self._mirror_request)
+            data_handle = self._mirror
+        else:
+            data_handle = self._real_handle
+        self._handle = FileInFile(data_handle, 0, self.data_size, name=self._real_handle.name)
+        if self._block_cache is not None:
+            self._block_cache.clear()
+        super(GearboxEncryptedBigFile, self).load(index_cache)
+        logger.debug('Decrypted block cache after load: %r', self._block_cache)
+
+    def member_view(self, member):
+        if not hasattr(self._mirror, 'view'):
+            # a view of the mapped archive itself would just be ciphertext
+            raise GearboxEncryptionException(
+                'Member views of encrypted archives need a memory plaintext mirror')
+        return self._mirror.view(member._offset, member.stored_size)
+
+    def close(self):
+        result = super(GearboxEncryptedBigFile, self).close()
+        if self._mirror is not None:
+            self._mirror.close()
+            self._mirror = None
+        if self._real_handle is not None:
+            self._real_handle.close()
+            self._real_handle = None
+        return result
+
+    def decrypt_to(self, fileobj, chunk_size=None):
+        """Write the whole decrypted region of the archive to `fileobj`,
+        returns the number of bytes written
+        """
+
+        if self._crypto is None:
+            self._crypto = self._load_encryption()
+        if chunk_size is None:
+            chunk_size = self.DECRYPT_CHUNK_SIZE
+        return _decrypt_range(self._crypto, self._real_handle or self._handle,
+            lambda chunk, offset: fileobj.write(chunk), 0, self.data_size, chunk_size)
 
     def check_format(self):
         try:
@@ -229,26 +671,149 @@ class GearboxEncryptedBigFile(BigFile):
         return super(GearboxEncryptedBigFile, self).check_format()
 
     def read(self, size=None):
-        if self.data_size is None:
-            # we don't have the key yet, just pass through
+        if self.data_size is None or self._mirror is not None:
+            # we don't have the key yet or are reading already decrypted data,
+            # just pass through
             return self._handle.read(size)
         else:
             cur_pos = self._handle.tell()
-            if cur_pos < self.data_size:
-                # we're gonna read encrypted data
-                if size is None:
-                    # make sure we don't read past the encrypted data
-                    size = self.data_size - cur_pos
-                else:
-                    if cur_pos + size > self.data_size:
-                        size = self.data_size - cur_pos
-                return self._read_encrypted(size)
-            else:
-                return self._handle.read(size)
+            data = self.pread(size, cur_pos)
+            self._handle.seek(cur_pos + len(data))
+            return data
 
-    def _read_encrypted(self, size):
-        offset = self.tell()
-        return self._crypto.decrypt(self._handle.read(size), offset)
+    def readinto(self, buffer):
+        if self.data_size is None or self._mirror is not None:
+            return self._handle.readinto(buffer)
+        else:
+            cur_pos = self._handle.tell()
+            size = self.preadinto(buffer, cur_pos)
+            self._handle.seek(cur_pos + size)
+            return size
+
+    def pread(self, size, offset):
+        if self.data_size is None or self._mirror is not None or offset >= self.data_size:
+            return pread(self._handle, size, offset)
+        if size is None or size < 0 or offset + size > self.data_size:
+            # make sure we don't read past the encrypted data
+            size = self.data_size - offset
+        buffer = bytearray(size)
+        size = self.preadinto(buffer, offset)
+        if size < len(buffer):
+            del buffer[size:]
+        return str(buffer)
+
+    def preadinto(self, buffer, offset):
+        if self.data_size is None or self._mirror is not None or offset >= self.data_size:
+            return preadinto(self._handle, buffer, offset)
+        if offset + len(buffer) > self.data_size:
+            # don't read past the encrypted data
+            buffer = memoryview(buffer)[:self.data_size - offset]
+        if self._block_cache is not None and len(buffer) <= self.CACHE_MAX_READ_SIZE:
+            return self._preadinto_cached(buffer, offset)
+        size = preadinto(self._handle, buffer, offset)
+        if size:
+            if size < len(buffer):
+                buffer = memoryview(buffer)[:size]
+            self._crypto.decrypt_into(buffer, offset)
+        return size
+
+    def _preadinto_cached(self, buffer, offset):
+        view = memoryview(buffer)
+        size = len(view)
+        block_size = self.CACHE_BLOCK_SIZE
+        pos = 0
+        while pos < size:
+            block_offset = (offset + pos) - ((offset + pos) % block_size)
+            block = self._get_decrypted_block(block_offset)
+            start = offset + pos - block_offset
+            chunk_size = min(size - pos, len(block) - start)
+            if chunk_size <= 0:
+                break
+            view[pos:pos+chunk_size] = memoryview(block)[start:start+chunk_size]
+            pos += chunk_size
+        return pos
+
+    def _get_decrypted_block(self, block_offset):
+        block = self._block_cache.get(block_offset)
+        if block is None:
+            block = bytearray(min(self.CACHE_BLOCK_SIZE, self.data_size - block_offset))
+            size = preadinto(self._handle, block, block_offset)
+            if size < len(block):
+                del block[size:]
+            self._crypto.decrypt_into(block, block_offset)
+            self._block_cache.put(block_offset, block)
+        return block
+
+    def decrypt_to_file(self, filename, jobs=None, chunk_size=None, range_size=None,
+            progress=None):
+        """Write the whole decrypted region of the archive to the file
+        `filename`, splitting it into ranges decrypted by `jobs` processes
+        (defaults to the number of CPUs). `progress` is called with the bytes
+        done and the total after each range. Returns the number of bytes written
+        """
+
+        if self._crypto is None:
+            self._crypto = self._load_encryption()
+        if jobs is None:
+            jobs = multiprocessing.cpu_count()
+        if chunk_size is None:
+            chunk_size = self.DECRYPT_CHUNK_SIZE
+        if range_size is None:
+            range_size = self.DECRYPT_RANGE_SIZE
+        data_size = self.data_size
+        src_filename = (self._real_handle or self._handle).name
+
+        with open(filename, 'wb') as outfile:
+            outfile.truncate(data_size)
+        ranges = [(offset, min(range_size, data_size - offset)) \
+            for offset in xrange(0, data_size, range_size)]
+        worker_state = (self._crypto, src_filename, filename, chunk_size)
+        jobs = min(jobs, len(ranges))
+        logger.info('Decrypting %d bytes of %s in %d ranges with %d jobs',
+            data_size, src_filename, len(ranges), jobs)
+
+        pool = None
+        if jobs > 1:
+            pool = multiprocessing.Pool(jobs, _init_decrypt_worker, worker_state)
+            results = pool.imap_unordered(_decrypt_range_in_worker, ranges)
+        else:
+            _init_decrypt_worker(*worker_state)
+            results = itertools.imap(_decrypt_range_in_worker, ranges)
+        done = 0
+        try:
+            for size in results:
+                done += size
+                if progress is not None:
+                    progress(done, data_size)
+        except BaseException:
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return done
+
+    def _get_raw_handle(self):
+        return self._real_handle
+
+    def _create_mirror(self, mode):
+        if mode == self.MIRROR_AUTO:
+            if self.data_size <= self._memory_budget:
+                mode = self.MIRROR_MEMORY
+            else:
+                mode = self.MIRROR_TEMPFILE
+        if mode == self.MIRROR_MEMORY:
+            mirror = AnonymousMappedFile(self.data_size, name=self._real_handle.name)
+        else:
+            mirror = tempfile.TemporaryFile()
+        logger.info('Decrypting %d bytes of %s to a %s plaintext mirror',
+            self.data_size, self._real_handle.name, mode)
+        self.decrypt_to(mirror)
+        mirror.seek(0)
+        self._mirror_mode = mode
+        return mirror
 
     def _load_encryption(self):
         self.seek(-4, os.SEEK_END)
@@ -25,11 +25,13 @@
 import datetime
 import os.path
 import logging
+from bisect import bisect_left
+from itertools import izip
 
-from naabal.errors import BigFormatException
+from naabal.errors import StructuredFileFormatException, BigFormatException
 from naabal.util import timestamp_to_datetime, datetime_to_timestamp, crc32
 from naabal.util.lzss import LZSS
-from naabal.util.file_io import chunked_copy
+from naabal.util.file_io import chunked_copy, pread
 from naabal.formats import StructuredFileSequence
 from naabal.formats.big import BigFile, BigSection, BigSequence, BigInfo
 
@@ -153,20 +155,21 @@ class HomeworldBigTocEntry(BigSection):
     ]
 
     def check(self):
-        if self['name_crc_start'] < 0 or self['name_crc_start'] > 0xFFFFFFFF:
-            raise BigFormatException('Invalid value for CRC-start: %x' % self['name_crc_start'])
-        if self['name_crc_end'] < 0 or self['name_crc_end'] > 0xFFFFFFFF:
-            raise BigFormatException('Invalid value for CRC-end: %x' % self['name_crc_end'])
-        if self['name_length'] > self.MAX_FILENAME_LEN:
-            raise BigFormatException('Filename length too long: %d' % self['name_length'])
-        if self['data_stored_size'] > self['data_real_size']:
+        data = self._data
+        if data['name_crc_start'] < 0 or data['name_crc_start'] > 0xFFFFFFFF:
+            raise BigFormatException('Invalid value for CRC-start: %x' % data['name_crc_start'])
+        if data['name_crc_end'] < 0 or data['name_crc_end'] > 0xFFFFFFFF:
+            raise BigFormatException('Invalid value for CRC-end: %x' % data['name_crc_end'])
+        if data['name_length'] > self.MAX_FILENAME_LEN:
+            raise BigFormatException('Filename length too long: %d' % data['name_length'])
+        if data['data_stored_size'] > data['data_real_size']:
             raise BigFormatException('Stored data size is larger than real size by %d bytes' %
-                (self['data_stored_size'] - self['data_real_size']))
-        if self['timestamp'] > A_YEAR_IN_THE_FUTURE:
-            raise BigFormatException('Invalid timestamp: %s' % self['timestamp'])
-        if self['compression_flag'] is not (self['data_stored_size'] < self['data_real_size']):
+                (data['data_stored_size'] - data['data_real_size']))
+        if data['timestamp'] > A_YEAR_IN_THE_FUTURE:
+            raise BigFormatException('Invalid timestamp: %s' % data['timestamp'])
+        if data['compression_flag'] is not (data['data_stored_size'] < data['data_real_size']):
             raise BigFormatException('Data compression flag does not match data sizes: %s != (%d < %d)' %
-                (self['compression_flag'], self['data_stored_size'], self['data_real_size']))
+                (data['compression_flag'], data['data_stored_size'], data['data_real_size']))
         return True
 
 class HomeworldBigToc(BigSequence):
@@ -176,30 +179,125 @@ class HomeworldBigToc(BigSequence):
         return handle._data['header']['toc_entry_count']
 
 class HomeworldBigInfo(BigInfo):
+    __slots__ = ('_toc_entry',)
+
     def load(self, data):
+        # the name is stored in front of the data, it is read on first use
+        self._toc_entry     = data
         self._offset        = data['entry_offset'] + data['name_length'] + 1
-        self._name          = self._bigfile._read_filename(data)
         self._mtime         = data['timestamp']
         self._real_size     = data['data_real_size']
         self._stored_size   = data['data_stored_size']
 
+    @property
+    def name(self):
+        if self._name is None:
+            self._name = self._bigfile._read_filename(self._toc_entry)
+        return self._name
+
 class HomeworldBigFile(BigFile):
     STRUCTURE       = [
         ('header',              HomeworldBigHeader),
         ('table_of_contents',   HomeworldBigToc),
     ]
 
+    LAZY_MEMBERS                = True
+    EXTRACT_IN_PROCESSES        = True
     MIN_COMPRESSION_RATIO       = 0.950
     COMPRESSION_ALGORITHM       = LZSS()
+    # each name sits in front of its member's data, when resolving all of the
+    # members the names that fit in a span this size are read together
+    FILENAME_READ_SIZE          = 64 * 1024 # 64KB
+
+    _toc_members    = None
+    _crc_index      = None
+
+    @classmethod
+    def probe(cls, handle, header, trailer):
+        header_type = cls.STRUCTURE[0][1]
+        toc_entry_type = cls.STRUCTURE[1][1].CHILD_TYPE
+        if not header.startswith('RBF1.23') or len(header) < header_type.data_size:
+            return False
+        try:
+            archive_header = header_type()
+            archive_header.load_from(header)
+            if archive_header['toc_entry_count'] == 0:
+                return True
+            if len(header) < header_type.data_size + toc_entry_type.data_size:
+                return False
+            toc_entry = toc_entry_type()
+            toc_entry.load_from(header, header_type.data_size)
+        except StructuredFileFormatException:
+            # includes the BigFormatExceptions raised by the section checks
+            return False
+        # the original and classic ToC entries only differ in their size and
+        # padding, so check that the first entry actually lines up with the
+        # name it claims to describe
+        if toc_entry['entry_offset'] < header_type.data_size + \
+                archive_header['toc_entry_count'] * toc_entry_type.data_size:
+            return False
+        filename = cls._decode_filename(pread(handle, toc_entry['name_length'], toc_entry['entry_offset']))
+        return cls._get_filename_crcs(filename) == (toc_entry['name_crc_start'], toc_entry['name_crc_end'])
+
+    def get_member(self, filename, case_sensitive=True):
+        """Look up a member the way the game does: hash the name, binary search
+        the ToC by CRC and only decode the names of the matching entries
+        """
+
+        if self._toc_members is None:
+            # members were added or rewritten since load, the ToC is stale
+            return super(HomeworldBigFile, self).get_member(filename, case_sensitive)
+
+        name = self._get_index_key(filename)
+        crc_start, crc_end = self._get_filename_crcs(self._denormalize_filename(name))
+        crc_key = (crc_start << 32) | crc_end
+        if not case_sensitive:
+            name = name.lower()
+
+        keys, order = self._get_crc_index()
+        i = bisect_left(keys, crc_key)
+        while i < len(keys) and keys[i] == crc_key:
+            member = self._get_toc_member(order[i])
+            if (member.name if case_sensitive else member.name.lower()) == name:
+                return member
+            i += 1
+        raise KeyError(filename)
+
+    def __len__(self):
+        if self._members is None and self._toc_members is not None:
+            return len(self._toc_members)
+        return super(HomeworldBigFile, self).__len__()
+
+    def _load_index(self):
+        super(HomeworldBigFile, self)._load_index()
+        self._toc_members = [None] * self['header']['toc_entry_count']
+        self._crc_index = None
+
+    def add(self, biginfo, sort_after=True):
+        self.get_members()
+        self._toc_members = None
+        self._crc_index = None
+        return super(HomeworldBigFile, self).add(biginfo, sort_after)
+
+    def _get_crc_index(self):
+        if self._crc_index is None:
+            toc = self._data['table_of_contents']
+            crc_fix = lambda crc_start, crc_end: (crc_start << 32) | crc_end
+            keyed = sorted((crc_fix(crc_start, crc_end), i) for i, (crc_start, crc_end) in \
+                enumerate(izip(toc.column('name_crc_start'), toc.column('name_crc_end'))))
+            self._crc_index = ([k for k, i in keyed], [i for k, i in keyed])
+        return self._crc_index
 
     def _read_filename(self, toc_entry):
-        self.seek(toc_entry['entry_offset'])
-        filename = self.read(toc_entry['name_length'] + 1)[:-1] # skip the null byte
+        # a positional read, names are loaded lazily and may be asked for
+        # while other threads are reading member data
+        filename = self.pread(toc_entry['name_length'], toc_entry['entry_offset'])
         filename = self._decode_filename(filename)
         filename = self._normalize_filename(filename)
         return filename
 
-    def _decode_filename(self, filename):
+    @staticmethod
+    def _decode_filename(filename):
         encoded_filename = bytearray(filename)
         decoded_filename = bytearray(len(filename) + 1)
         decoded_filename[0] = 0xD5 # Game/bigfile.c:530 of HW1 source
@@ -228,7 +326,8 @@ class HomeworldBigFile(BigFile):
         filename = '\\'.join(filename.split(os.sep))
         return filename
 
-    def _get_filename_crcs(self, decoded_filename):
+    @staticmethod
+    def _get_filename_crcs(decoded_filename):
         """Compute the CRC32 checksums of the first and last halves of the un-encoded
         (but not normalized) filename.
 
@@ -244,18 +343,46 @@ class HomeworldBigFile(BigFile):
             decoded_filename, *crcs)
         return crcs
 
-    def _get_members(self):
-        members = []
-        for toc_entry in self._data['table_of_contents']:
+    def _get_toc_member(self, index):
+        member = self._toc_members[index]
+        if member is None:
             member = HomeworldBigInfo(self)
-            member.load(toc_entry)
-            members.append(member)
+            member.load(self._data['table_of_contents'].record(index))
+            self._toc_members[index] = member
+        return member
+
+    def _get_members(self):
+        members = [self._get_toc_member(i) for i in xrange(len(self._toc_members))]
+        # read the names in one forward pass over the archive instead of
+        # seeking back and forth in ToC order, with one read for each run of
+        # names that fits in FILENAME_READ_SIZE
+        pending = sorted((m for m in members if m._name is None), key=lambda m: m._offset)
+        start = 0
+        while start < len(pending):
+            span_offset = pending[start]._toc_entry['entry_offset']
+            end = start + 1
+            while end < len(pending) and pending[end]._offset - 1 - span_offset <= self.FILENAME_READ_SIZE:
+                end += 1
+            span = self.pread(pending[end - 1]._offset - 1 - span_offset, span_offset)
+            for member in pending[start:end]:
+                name_offset = member._toc_entry['entry_offset'] - span_offset
+                filename = self._decode_filename(
+                    span[name_offset:name_offset + member._toc_entry['name_length']])
+                member._name = self._normalize_filename(filename)
+            start = end
         return members
 
-    def save(self):
+    def save(self, compression_level=None):
         logger.info('Writing bigfile: %r', self)
 
+        if compression_level is None:
+            compressor = self.COMPRESSION_ALGORITHM
+        else:
+            compressor = LZSS(level=compression_level)
+
         members = self.get_members()
+        self._toc_members = None
+        self._crc_index = None
         member_count = len(members)
         logger.debug('Found %d members to write', member_count)
         self['header']['toc_entry_count'] = len(members)
@@ -291,7 +418,7 @@ class HomeworldBigFile(BigFile):
             data_offset = self.tell()
 
             with self.open_member(member) as member_handle:
-                self.COMPRESSION_ALGORITHM.compress_stream(member_handle, self)
+                compressor.compress_stream(member_handle, self)
                 stored_size = self.tell() - data_offset
                 logger.debug('Wrote %d bytes (compressed) of file data at offset: %d',
                     stored_size, data_offset)
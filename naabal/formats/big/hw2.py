@@ -373,14 +373,36 @@ class Homeworld2BigFileEntryList(BigSequence):
         return handle._data['section_header']['filename_list_count']
 
 class Homeworld2BigInfo(BigInfo):
-    def load(self, data):
-        metadata = self._bigfile._get_file_metadata(data)
+    __slots__ = ('_crc32',)
+
+    def __init__(self, bigfile):
+        super(Homeworld2BigInfo, self).__init__(bigfile)
+        self._crc32         = None
+
+    def load(self, data, index):
+        # the timestamp and CRC live in front of the file data, they are read
+        # on first use (or by Homeworld2BigFile.prefetch_metadata)
         self._offset        = self._bigfile._get_file_data_offset(data)
-        self._name          = self._bigfile._get_full_filename(data)
-        self._mtime         = metadata['timestamp']
+        self._name          = self._bigfile._get_full_filename(index)
         self._real_size     = data['data_real_size']
         self._stored_size   = data['data_stored_size']
 
+    def load_metadata(self, metadata):
+        self._mtime         = metadata['timestamp']
+        self._crc32         = metadata['crc32']
+
+    @property
+    def mtime(self):
+        if self._mtime is None:
+            self.load_metadata(self._bigfile._get_file_metadata(self._offset))
+        return self._mtime
+
+    @property
+    def crc32(self):
+        if self._crc32 is None:
+            self.load_metadata(self._bigfile._get_file_metadata(self._offset))
+        return self._crc32
+
 class Homeworld2BigFile(BigFile):
     STRUCTURE           = [
         ('archive_header',          Homeworld2BigArchiveHeader),
@@ -395,59 +417,93 @@ class Homeworld2BigFile(BigFile):
     COMPRESSION_ALGORITHM       = ZLIB()
     MIN_BATCH_COMPRESSION_SIZE  = 4 * 1024 # 4KB
 
+    @classmethod
+    def probe(cls, handle, header, trailer):
+        return header.startswith('_ARCHIVE')
+
     def _get_members(self):
         self._filename_map = self._build_filename_map()
         members = []
-        for file_info in self._data['file_info']:
+        for index, file_info in enumerate(self._data['file_info']):
             member = Homeworld2BigInfo(self)
-            member.load(file_info)
+            member.load(file_info, index)
             members.append(member)
         return members
 
+    def prefetch_metadata(self, members=None):
+        if members is None:
+            members = self.get_members()
+        pending = [m for m in members if isinstance(m, Homeworld2BigInfo) and m._mtime is None]
+        # in data offset order so the reads move forward through the archive
+        for member in sorted(pending, key=lambda m: m._offset):
+            member.load_metadata(self._get_file_metadata(member._offset))
+
     def _build_filename_map(self):
         fn_map = [None] * len(self._data['file_info'])
-        for fn, fi in self._walk_contents():
-            fn_map[self._data['file_info']._data_list.index(fi)] = fn
+        for fn, fi_index in self._walk_contents():
+            fn_map[fi_index] = fn
         return fn_map
 
-    def _read_filename(self, file_info_entry):
-        self.seek(self._get_filename_offset(file_info_entry))
-        filename = self.read(MAX_FILENAME_LENGTH).split('\x00', 1)[0]
-        filename = self._normalize_filename(filename)
-        return filename
+    def _read_filename_list(self):
+        """Read the whole filename list region in one go, names are sliced out
+        of it with _slice_filename
+        """
+
+        start = Homeworld2BigArchiveHeader.data_size + \
+            self._data['section_header']['filename_list_offset']
+        end = Homeworld2BigArchiveHeader.data_size + \
+            self._data['archive_header']['section_header_size']
+        return self.pread(max(end - start, 0), start)
+
+    def _slice_filename(self, filename_list, filename_offset):
+        end = filename_list.find('\x00', filename_offset, filename_offset + MAX_FILENAME_LENGTH)
+        if end < 0:
+            if filename_offset + MAX_FILENAME_LENGTH > len(filename_list):
+                # outside of the filename list region, read it the slow way
+                return self.pread(MAX_FILENAME_LENGTH, Homeworld2BigArchiveHeader.data_size +
+                    self._data['section_header']['filename_list_offset'] +
+                    filename_offset).split('\x00', 1)[0]
+            end = filename_offset + MAX_FILENAME_LENGTH
+        return filename_list[filename_offset:end]
 
     def _normalize_filename(self, filename):
         return os.path.join(*filename.split('\\'))
 
     def _walk_contents(self):
+        """Yield (path, file_info index) for every file in the archive
+        """
+
+        filename_list = self._read_filename_list()
         for toc_entry in self._data['table_of_contents']:
-            for item_path, item in self._walk_folder(self._data['folders'][toc_entry['start_folder_idx']]):
-                yield os.path.join(toc_entry['filename'], item_path), item
-
-    def _walk_folder(self, folder_entry):
-        folder_name = self._read_filename(folder_entry) or ''
-        if folder_entry['first_subfolder_idx'] != folder_entry['last_subfolder_idx']:
-            for subfolder in self._data['folders'][folder_entry['first_subfolder_idx']:folder_entry['last_subfolder_idx']]:
-                for item_path, item in self._walk_folder(subfolder):
-                    yield item_path, item
-        for file_info in self._data['file_info'][folder_entry['first_fileinfo_idx']:folder_entry['last_fileinfo_idx']]:
-            yield os.path.join(folder_name, self._read_filename(file_info)), file_info
+            for item_path, fi_index in self._walk_folder(toc_entry['start_folder_idx'], filename_list):
+                yield os.path.join(toc_entry['filename'], item_path), fi_index
+
+    def _walk_folder(self, folder_index, filename_list):
+        folders = self._data['folders']
+        folder_entry = folders.record(folder_index)
+        folder_name = self._normalize_filename(
+            self._slice_filename(filename_list, folder_entry['filename_offset'])) or ''
+        for subfolder_index in xrange(folder_entry['first_subfolder_idx'], folder_entry['last_subfolder_idx']):
+            for item_path, fi_index in self._walk_folder(subfolder_index, filename_list):
+                yield item_path, fi_index
+        filename_offsets = self._data['file_info'].column('filename_offset')
+        for fi_index in xrange(folder_entry['first_fileinfo_idx'], folder_entry['last_fileinfo_idx']):
+            filename = self._slice_filename(filename_list, filename_offsets[fi_index])
+            yield os.path.join(folder_name, self._normalize_filename(filename)), fi_index
 
     def _get_file_data_offset(self, file_info_entry):
         return self._data['archive_header']['file_data_offset'] + file_info_entry['file_data_offset']
 
-    def _get_filename_offset(self, entry):
-        return Homeworld2BigArchiveHeader.data_size + \
-            self._data['section_header']['filename_list_offset'] + \
-            entry['filename_offset']
-
-    def _get_file_metadata(self, file_info_entry):
-        self.seek(self._get_file_data_offset(file_info_entry) - Homeworld2BigFileEntry.data_size)
-        file_metadata = Homeworld2BigFileEntry(self)
+    def _get_file_metadata(self, file_data_offset):
+        # a positional read, the metadata is loaded lazily and may be asked
+        # for while other threads are reading member data
+        file_metadata = Homeworld2BigFileEntry()
+        file_metadata.load_from(self.pread(Homeworld2BigFileEntry.data_size,
+            file_data_offset - Homeworld2BigFileEntry.data_size))
         return file_metadata
 
-    def _get_full_filename(self, file_info_entry):
-        return self._filename_map[self._data['file_info']._data_list.index(file_info_entry)]
+    def _get_full_filename(self, file_info_index):
+        return self._filename_map[file_info_index]
 
     def _get_tool_key_hash(self):
         md5_hash = hashlib.md5(self.TOOL_KEY)
@@ -24,6 +24,7 @@
 
 import datetime
 import hashlib
+import struct
 
 from naabal.formats.big import GearboxEncryptedBigFile
 from naabal.formats.big.hw1 import HomeworldBigHeader, HomeworldBigTocEntry, \
@@ -129,6 +130,18 @@ class HomeworldClassicBigFile(HomeworldBigFile):
         ('table_of_contents',   HomeworldClassicBigToc),
     ]
 
+    @classmethod
+    def probe(cls, handle, header, trailer):
+        if not super(HomeworldClassicBigFile, cls).probe(handle, header, trailer):
+            return False
+        # the name and size fields line up with an original ToC entry, but the
+        # compression flag is a whole uint32 at the end of the entry, where an
+        # original archive has the next entry's name CRC (or the first name)
+        flag_offset = HomeworldClassicBigHeader.data_size + HomeworldClassicBigTocEntry.data_size - 4
+        if len(header) < flag_offset + 4:
+            return True
+        return struct.unpack_from('<L', header, flag_offset)[0] in (0, 1)
+
 class Homeworld2ClassicBigFile(Homeworld2BigFile): pass
 
 class HomeworldRemasteredBigFile(GearboxEncryptedBigFile, Homeworld2BigFile):
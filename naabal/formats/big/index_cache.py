@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Alex Headley <aheadley@waysaboutstuff.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import os.path
+import struct
+import hashlib
+import tempfile
+import logging
+
+from naabal.formats.big import BigInfo
+from naabal.util import datetime_to_timestamp, timestamp_to_datetime
+from naabal.util.file_io import pread
+
+logger = logging.getLogger('naabal.formats.big.index_cache')
+
+class CachedBigInfo(BigInfo):
+    __slots__ = ('_crc32', '_timestamp')
+
+    def load(self, data):
+        offset, real_size, stored_size, timestamp, crc32, name = data
+        self._offset        = offset
+        self._name          = name
+        self._timestamp     = timestamp
+        self._real_size     = real_size
+        self._stored_size   = stored_size
+        self._crc32         = crc32
+
+    @property
+    def mtime(self):
+        if self._mtime is None:
+            self._mtime = timestamp_to_datetime(self._timestamp)
+        return self._mtime
+
+    @property
+    def crc32(self):
+        return self._crc32
+
+class BigIndexCache(object):
+    """On-disk cache of fully resolved member tables, one file per archive path.
+
+    An entry is only used if the archive's size, mtime and a hash of its first
+    and last few KB still match, entries are evicted least recently used first
+    once the cache grows past `max_size` bytes
+    """
+
+    MAGIC               = 'NBIX'
+    VERSION             = 1
+    FILE_SUFFIX         = '.idx'
+    MAX_SIZE            = 64 * 1024 * 1024 # 64MB
+    HASH_REGION_SIZE    = 4 * 1024 # 4KB
+    HEADER              = struct.Struct('<4sHQd16sL')
+    MEMBER              = struct.Struct('<QQQqLBH')
+    FLAG_HAS_CRC32      = 0x01
+
+    def __init__(self, cache_dir=None, max_size=None):
+        if cache_dir is None:
+            cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME',
+                os.path.join(os.path.expanduser('~'), '.cache')), 'naabal', 'big-index')
+        if max_size is None:
+            max_size = self.MAX_SIZE
+        self._cache_dir = cache_dir
+        self._max_size = max_size
+
+    def __repr__(self):
+        return '<{0}("{1}", max_size={2})>'.format(
+            self.__class__.__name__, self._cache_dir, self._max_size)
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    def get(self, bigfile):
+        """Return the cached members of `bigfile`, sorted by name, or None if
+        there is no valid entry for it
+        """
+
+        cache_filename = self._get_cache_filename(bigfile)
+        try:
+            with open(cache_filename, 'rb') as handle:
+                data = handle.read()
+        except IOError:
+            logger.debug('No index cache entry for: %s', bigfile.name)
+            return None
+        try:
+            members = self._decode(bigfile, data)
+        except (struct.error, ValueError) as err:
+            logger.debug('Ignoring unusable index cache entry %s: %s', cache_filename, err)
+            return None
+        if members is None:
+            logger.debug('Stale index cache entry for: %s', bigfile.name)
+            return None
+        # the file mtime doubles as the last used time for eviction
+        os.utime(cache_filename, None)
+        logger.debug('Loaded %d members from index cache: %s', len(members), cache_filename)
+        return members
+
+    def put(self, bigfile):
+        """Store the member table of the loaded `bigfile`
+        """
+
+        if not os.path.isdir(self._cache_dir):
+            os.makedirs(self._cache_dir)
+        bigfile.prefetch_metadata()
+        data = self._encode(bigfile)
+        if len(data) > self._max_size:
+            return
+        fd, tmp_filename = tempfile.mkstemp(suffix='.tmp', dir=self._cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as handle:
+                handle.write(data)
+            cache_filename = self._get_cache_filename(bigfile)
+            if os.name == 'nt':
+                # rename() won't replace an existing file on windows and
+                # python 2 has no os.replace()
+                try:
+                    os.unlink(cache_filename)
+                except OSError:
+                    pass
+            os.rename(tmp_filename, cache_filename)
+        except Exception:
+            os.unlink(tmp_filename)
+            raise
+        self._evict()
+
+    def clear(self):
+        for cache_filename in self._get_cache_filenames():
+            os.unlink(cache_filename)
+
+    def _encode(self, bigfile):
+        archive_size, archive_mtime, digest = self._get_archive_signature(bigfile)
+        members = bigfile.get_members()
+        format_name = type(bigfile).__name__
+        chunks = [self.HEADER.pack(self.MAGIC, self.VERSION, archive_size, archive_mtime,
+            digest, len(members)), struct.pack('<B', len(format_name)), format_name]
+        for member in members:
+            crc32 = getattr(member, 'crc32', None)
+            chunks.append(self.MEMBER.pack(member._offset, member.real_size, member.stored_size,
+                datetime_to_timestamp(member.mtime), crc32 or 0,
+                self.FLAG_HAS_CRC32 if crc32 is not None else 0, len(member.name)))
+            chunks.append(member.name)
+        return ''.join(chunks)
+
+    def _decode(self, bigfile, data):
+        magic, version, archive_size, archive_mtime, digest, member_count = \
+            self.HEADER.unpack_from(data, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError('Unknown index cache format: %r v%d' % (magic, version))
+        offset = self.HEADER.size
+        format_name_len = ord(data[offset])
+        format_name = data[offset + 1:offset + 1 + format_name_len]
+        offset += 1 + format_name_len
+        if format_name != type(bigfile).__name__ or \
+                (archive_size, archive_mtime, digest) != self._get_archive_signature(bigfile):
+            return None
+
+        members = []
+        member_struct = self.MEMBER
+        for i in xrange(member_count):
+            member_offset, real_size, stored_size, mtime, crc32, flags, name_len = \
+                member_struct.unpack_from(data, offset)
+            offset += member_struct.size
+            name = data[offset:offset + name_len]
+            if len(name) != name_len:
+                raise ValueError('Truncated index cache entry')
+            offset += name_len
+            member = CachedBigInfo(bigfile)
+            member.load((member_offset, real_size, stored_size, mtime,
+                crc32 if flags & self.FLAG_HAS_CRC32 else None, name))
+            members.append(member)
+        return members
+
+    def _get_archive_signature(self, bigfile):
+        handle = bigfile._get_raw_handle()
+        fstat = os.fstat(handle.fileno())
+        region_size = min(fstat.st_size, self.HASH_REGION_SIZE)
+        md5_hash = hashlib.md5(pread(handle, region_size, 0))
+        md5_hash.update(pread(handle, region_size, fstat.st_size - region_size))
+        return fstat.st_size, fstat.st_mtime, md5_hash.digest()
+
+    def _get_cache_filename(self, bigfile):
+        key = hashlib.sha1(os.path.abspath(bigfile.name)).hexdigest()
+        return os.path.join(self._cache_dir, key + self.FILE_SUFFIX)
+
+    def _get_cache_filenames(self):
+        try:
+            filenames = os.listdir(self._cache_dir)
+        except OSError:
+            return []
+        return [os.path.join(self._cache_dir, fn) for fn in filenames if fn.endswith(self.FILE_SUFFIX)]
+
+    def _evict(self):
+        entries = []
+        for cache_filename in self._get_cache_filenames():
+            try:
+                fstat = os.stat(cache_filename)
+            except OSError:
+                continue
+            entries.append((fstat.st_mtime, fstat.st_size, cache_filename))
+        total_size = sum(size for mtime, size, fn in entries)
+        for mtime, size, cache_filename in sorted(entries):
+            if total_size <= self._max_size:
+                break
+            logger.debug('Evicting index cache entry: %s', cache_filename)
+            try:
+                os.unlink(cache_filename)
+            except OSError:
+                continue
+            total_size -= size
@@ -28,11 +28,14 @@ import sys
 import os
 import fnmatch
 import datetime
+import time
 
 from naabal.util.helpers import big_load
 from naabal.formats.big.hw1 import HomeworldBigFile
 from naabal.formats.big.hw2 import Homeworld2BigFile
 from naabal.formats.big.hwrm import HomeworldRemasteredBigFile, HomeworldClassicBigFile
+from naabal.formats.big import GearboxEncryptedBigFile
+from naabal.util.lzss import LZSS
 
 def big_diff():
     parser = argparse.ArgumentParser(prog='big-diff',
@@ -54,6 +57,8 @@ def big_diff():
                             sys.stdout.write('ToC mismatch on key [{0}]: {1} != {2}\n'.format(
                                 key, repr(left_v), repr(right_v)))
             else:
+                left_big.prefetch_metadata()
+                right_big.prefetch_metadata()
                 for i, (left_m, right_m) in enumerate(zip(left_big.get_members(), right_big.get_members())):
                     sys.stdout.write('Checking member #{0:06d}\n'.format(i+1))
                     for key in ['name', 'mtime', 'real_size', 'stored_size']:
@@ -84,6 +89,8 @@ def big_ls():
     parser.add_argument('filename')
     args = parser.parse_args()
     with big_load(args.filename) as bigfile:
+        if args.long:
+            bigfile.prefetch_metadata()
         for member in bigfile:
             if args.long:
                 sys.stdout.write('{0} {1:8d} +{2:8d} {3} {4}\n'.format(
@@ -102,36 +109,51 @@ def big_extract():
         description='Extract contents of a .big file to a directory')
     parser.add_argument('-i', '--include-matching')
     parser.add_argument('--no-decompress', action='store_false')
+    parser.add_argument('-m', '--mirror', choices=GearboxEncryptedBigFile.MIRROR_MODES,
+        help='decrypt encrypted archives once up front (in memory, to a temp file or auto)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='number of members to extract at once')
     parser.add_argument('filename')
     parser.add_argument('destination', default=os.getcwd(), nargs='?')
     args = parser.parse_args()
 
-    with big_load(args.filename) as bigfile:
+    def report_progress(member):
+        sys.stdout.write('Extracted {size:8d} bytes: {name}\n'.format(
+            size=member.real_size, name=member.name))
+
+    with big_load(args.filename, mirror=args.mirror) as bigfile:
         if args.include_matching:
             member_list = [m for m in bigfile.get_members() if fnmatch.fnmatch(m.name, args.include_matching)]
         else:
             member_list = bigfile.get_members()
-        for member in member_list:
-            bigfile.extract(member, args.destination, args.no_decompress)
-            sys.stdout.write('Extracted {size:8d} bytes: {name}\n'.format(
-                size=member.real_size, name=member.name))
+        bigfile.extract_all(member_list, args.destination, args.no_decompress,
+            jobs=args.jobs, progress=report_progress)
     return 0
 
 def big_decrypt():
     parser = argparse.ArgumentParser(prog='big-decrypt',
         description='Extract contents of a .big file to a directory')
-    parser.add_argument('-c', '--chunk-size', type=int, default=1024 * 4)
+    parser.add_argument('-c', '--chunk-size', type=int,
+        default=GearboxEncryptedBigFile.DECRYPT_CHUNK_SIZE)
+    parser.add_argument('-j', '--jobs', type=int,
+        help='number of processes to decrypt with (default: number of CPUs)')
     parser.add_argument('src_filename')
     parser.add_argument('dest_filename')
     args = parser.parse_args()
 
+    start_time = time.time()
+    def report_progress(done, total):
+        elapsed = max(time.time() - start_time, 0.001)
+        sys.stderr.write('\rDecrypted {0:6.1f}/{1:6.1f} MB ({2:5.1f}%) {3:8.1f} MB/s'.format(
+            done / 1048576.0, total / 1048576.0, 100.0 * done / total, done / 1048576.0 / elapsed))
+
     with HomeworldRemasteredBigFile(args.src_filename) as infile:
-        bigfile.load()
-        with open(args.dest_filename, 'w') as outfile:
-            chunk_size = args.chunk_size
-            data_size = infile.data_size
-            for i in xrange(0, data_size, chunk_size):
-                outfile.write(infile.read(chunk_size))
+        size = infile.decrypt_to_file(args.dest_filename, args.jobs, args.chunk_size,
+            progress=report_progress)
+    elapsed = max(time.time() - start_time, 0.001)
+    sys.stderr.write('\n')
+    sys.stdout.write('Decrypted {0:d} bytes in {1:.2f}s ({2:.1f} MB/s)\n'.format(
+        size, elapsed, size / 1048576.0 / elapsed))
     return 0
 
 CREATE_FORMATS = {
@@ -145,17 +167,25 @@ def big_create():
         description='Create a big file')
     parser.add_argument('-f', '--format', choices=CREATE_FORMATS, default='hw2')
     parser.add_argument('-x', '--exclude-matching')
+    parser.add_argument('-l', '--level', choices=LZSS.LEVELS,
+        help='LZSS compression level (hw1 formats only)')
     parser.add_argument('filename')
     parser.add_argument('source', default=os.getcwd(), nargs='?')
     args = parser.parse_args()
 
+    if args.level is not None and not issubclass(CREATE_FORMATS[args.format], HomeworldBigFile):
+        parser.error('--level is only supported for hw1 formats')
+
     with CREATE_FORMATS[args.format](args.filename, 'w') as bigfile:
         if args.exclude_matching:
             exclude = lambda fn: not fnmatch.fnmatch(fn, args.exclude_matching)
         else:
             exclude = None
         bigfile.add_all(args.source, exclude)
-        bigfile.save()
+        if args.level is not None:
+            bigfile.save(compression_level=args.level)
+        else:
+            bigfile.save()
     return 0
 
 
@@ -1,18 +1,37 @@
 # @source http://rosettacode.org/wiki/Bitwise_IO#Python
 # @license http://www.gnu.org/licenses/fdl-1.2.html
 
+import struct
+import os
 import logging
 
 logger = logging.getLogger('naabal.util.bitio')
 
+_WORD = struct.Struct('>L')
+
+class _BitMasks(dict):
+    # masks for the common widths are precomputed, wider ones are built (and
+    # kept) the first time they are asked for
+    def __missing__(self, bit_count):
+        mask = self[bit_count] = (1 << bit_count) - 1
+        return mask
+
+_BIT_MASKS = _BitMasks(((i, (1 << i) - 1) for i in xrange(65)))
+
 class BitIO(object):
     BITS_IN_BYTE    = 8
-    DEFAULT_MASK    = 1 << (BITS_IN_BYTE - 1) # 0x80
+    # bits are moved between the accumulator and the byte buffer a word at a
+    # time, so the accumulator never holds much more than 64 bits
+    WORD_BITS       = 32
+    BUFFER_SIZE     = 8 * 1024
 
-    def __init__(self, handle):
+    def __init__(self, handle, buffer_size=None):
         self._data_buffer = handle
+        if buffer_size is None:
+            buffer_size = self.BUFFER_SIZE
+        self._buffer_size = buffer_size
         self._bit_buffer = 0x00
-        self._bit_mask = self.DEFAULT_MASK
+        self._bit_count = 0
         self._bit_idx = 0
 
     def __enter__(self):
@@ -26,76 +45,151 @@ class BitIO(object):
         return self._bit_idx
 
 class BitWriter(BitIO):
+    def __init__(self, handle, buffer_size=None):
+        super(BitWriter, self).__init__(handle, buffer_size)
+        self._byte_buffer = bytearray()
+
     def __exit__(self, type, value, tb):
         self.flush()
 
+    @property
+    def index(self):
+        return self._bit_idx + self._bit_count // self.BITS_IN_BYTE
+
     def write_bit(self, bit):
-        if bit:
-            self._bit_buffer |= self._bit_mask
-        self._bit_mask = self._bit_mask >> 1
-        if self._bit_mask == 0:
-            self._flush_bit_buffer()
-            self._reset_state()
+        self._bit_buffer = (self._bit_buffer << 1) | (1 if bit else 0)
+        self._bit_count += 1
+        if self._bit_count >= self.WORD_BITS:
+            self._flush_words()
 
     def write_bits(self, value, bit_count):
-        mask = 1 << (bit_count - 1)
-
-        while mask != 0:
-            if mask & value:
-                self._bit_buffer |= self._bit_mask
-            self._bit_mask = self._bit_mask >> 1
-            if self._bit_mask == 0:
-                self._flush_bit_buffer()
-                self._reset_state()
-            mask = mask >> 1
+        self._bit_buffer = (self._bit_buffer << bit_count) | (value & _BIT_MASKS[bit_count])
+        self._bit_count += bit_count
+        if self._bit_count >= self.WORD_BITS:
+            self._flush_words()
+
+    def write_flag_bits(self, flag, value, bit_count):
+        """Write a single flag bit followed by the lowest `bit_count` bits of
+        `value`
+        """
+
+        self._bit_buffer = (self._bit_buffer << (bit_count + 1)) | \
+            ((1 if flag else 0) << bit_count) | (value & _BIT_MASKS[bit_count])
+        self._bit_count += bit_count + 1
+        if self._bit_count >= self.WORD_BITS:
+            self._flush_words()
 
     def flush(self):
-        if self._bit_mask != self.DEFAULT_MASK:
-            self._flush_bit_buffer()
-            self._reset_state()
+        if self._bit_count % self.BITS_IN_BYTE:
+            # pad out the last partial byte with zeroes
+            self.write_bits(0x00, self.BITS_IN_BYTE - (self._bit_count % self.BITS_IN_BYTE))
+        while self._bit_count:
+            self._bit_count -= self.BITS_IN_BYTE
+            self._byte_buffer.append((self._bit_buffer >> self._bit_count) & 0xFF)
+            self._bit_idx += 1
+        self._bit_buffer = 0x00
+        self._flush_byte_buffer()
         return self._bit_idx
 
-    def _flush_bit_buffer(self):
-        self._data_buffer.write(chr(self._bit_buffer))
-        self._bit_idx += 1
-
-    def _reset_state(self):
-        self._bit_buffer = 0x00
-        self._bit_mask   = self.DEFAULT_MASK
+    def _flush_words(self):
+        bit_buffer = self._bit_buffer
+        bit_count = self._bit_count
+        byte_buffer = self._byte_buffer
+        while bit_count >= self.WORD_BITS:
+            bit_count -= self.WORD_BITS
+            byte_buffer += _WORD.pack((bit_buffer >> bit_count) & 0xFFFFFFFF)
+        self._bit_idx += (self._bit_count - bit_count) // self.BITS_IN_BYTE
+        self._bit_buffer = bit_buffer & _BIT_MASKS[bit_count]
+        self._bit_count = bit_count
+        if len(byte_buffer) >= self._buffer_size:
+            self._flush_byte_buffer()
+
+    def _flush_byte_buffer(self):
+        if self._byte_buffer:
+            self._data_buffer.write(str(self._byte_buffer))
+            del self._byte_buffer[:]
 
 class BitReader(BitIO):
-    def read_bit(self):
-        if self._bit_mask == self.DEFAULT_MASK:
-            self._load_bit_buffer()
+    def __init__(self, handle, buffer_size=None):
+        super(BitReader, self).__init__(handle, buffer_size)
+        self._byte_buffer = bytearray()
+        self._byte_pos = 0
 
-        value = self._bit_buffer & self._bit_mask
-        self._bit_mask = self._bit_mask >> 1
-        if self._bit_mask == 0:
-            self._bit_mask = self.DEFAULT_MASK
+    def __exit__(self, type, value, tb):
+        self._return_unused_bytes()
 
-        return 1 if value else 0
+    @property
+    def index(self):
+        return self._bit_idx - self._bit_count // self.BITS_IN_BYTE
+
+    def read_bit(self):
+        if self._bit_count < 1:
+            self._load_bit_buffer(1)
+        self._bit_count -= 1
+        return (self._bit_buffer >> self._bit_count) & 0x01
 
     def read_bits(self, bit_count):
-        mask = 1 << (bit_count - 1)
-        bits_value = 0x00
-
-        while mask != 0:
-            if self._bit_mask == self.DEFAULT_MASK:
-                self._load_bit_buffer()
-
-            if self._bit_buffer & self._bit_mask:
-                bits_value |= mask
-            mask = mask >> 1
-            self._bit_mask = self._bit_mask >> 1
-            if self._bit_mask == 0:
-                self._bit_mask = self.DEFAULT_MASK
-
-        return bits_value
-
-    def _load_bit_buffer(self):
-        c = self._data_buffer.read(1)
-        if c:
-            self._bit_buffer = ord(c)
-            self._bit_idx += 1
-        else:
-            raise IOError('Attempted to read past EOF')
+        if self._bit_count < bit_count:
+            self._load_bit_buffer(bit_count)
+        self._bit_count -= bit_count
+        return (self._bit_buffer >> self._bit_count) & _BIT_MASKS[bit_count]
+
+    def read_flag_bits(self, set_bit_count, clear_bit_count=None):
+        """Read a single flag bit followed by a field of `set_bit_count` bits
+        if the flag was set, or `clear_bit_count` bits if it was not. Returns
+        a tuple of (flag, value)
+        """
+
+        if clear_bit_count is None:
+            clear_bit_count = set_bit_count
+        if self._bit_count < max(set_bit_count, clear_bit_count) + 1:
+            self._load_bit_buffer(1)
+        self._bit_count -= 1
+        flag = (self._bit_buffer >> self._bit_count) & 0x01
+        bit_count = set_bit_count if flag else clear_bit_count
+        if self._bit_count < bit_count:
+            self._load_bit_buffer(bit_count)
+        self._bit_count -= bit_count
+        return flag, (self._bit_buffer >> self._bit_count) & _BIT_MASKS[bit_count]
+
+    def _load_bit_buffer(self, bit_count):
+        byte_buffer = self._byte_buffer
+        while self._bit_count < max(bit_count, self.WORD_BITS):
+            if self._byte_pos + _WORD.size <= len(byte_buffer):
+                self._bit_buffer = ((self._bit_buffer & _BIT_MASKS[self._bit_count]) << self.WORD_BITS) | \
+                    _WORD.unpack_from(byte_buffer, self._byte_pos)[0]
+                self._byte_pos += _WORD.size
+                self._bit_count += self.WORD_BITS
+                self._bit_idx += _WORD.size
+            elif self._byte_pos < len(byte_buffer):
+                self._bit_buffer = ((self._bit_buffer & _BIT_MASKS[self._bit_count]) << self.BITS_IN_BYTE) | \
+                    byte_buffer[self._byte_pos]
+                self._byte_pos += 1
+                self._bit_count += self.BITS_IN_BYTE
+                self._bit_idx += 1
+            else:
+                data = self._data_buffer.read(self._buffer_size)
+                if data:
+                    del byte_buffer[:self._byte_pos]
+                    byte_buffer += data
+                    self._byte_pos = 0
+                elif self._bit_count >= bit_count:
+                    # not a full word left, but enough for this read
+                    break
+                else:
+                    raise IOError('Attempted to read past EOF')
+
+    def _return_unused_bytes(self):
+        # seek the underlying stream back to just after the last byte that
+        # was (at least partially) read
+        unused_bytes = (len(self._byte_buffer) - self._byte_pos) + \
+            self._bit_count // self.BITS_IN_BYTE
+        if unused_bytes:
+            try:
+                self._data_buffer.seek(-unused_bytes, os.SEEK_CUR)
+            except (AttributeError, IOError):
+                return
+        del self._byte_buffer[:]
+        self._byte_pos = 0
+        self._bit_idx -= self._bit_count // self.BITS_IN_BYTE
+        self._bit_count %= self.BITS_IN_BYTE
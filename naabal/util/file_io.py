@@ -23,11 +23,122 @@
 # SOFTWARE.
 
 import functools
+import errno
+import sys
 import os
+import mmap
+import threading
 import logging
 
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
 logger = logging.getLogger('naabal.util.file_io')
 
+def _load_libc():
+    # python 2 doesn't expose pread(2) and friends in the os module, so they
+    # are called from libc directly where it can be found
+    if ctypes is None:
+        return None
+    libc_name = ctypes.util.find_library('c')
+    if libc_name is None:
+        return None
+    try:
+        return ctypes.CDLL(libc_name, use_errno=True)
+    except OSError:
+        return None
+
+def _get_libc_func(libc, names, argtypes):
+    for name in names:
+        func = getattr(libc, name, None)
+        if func is not None:
+            func.argtypes = argtypes
+            func.restype = ctypes.c_ssize_t
+            return func
+    return None
+
+def _call_libc(func, *pargs):
+    while True:
+        result = func(*pargs)
+        if result >= 0:
+            return result
+        err = ctypes.get_errno()
+        if err != errno.EINTR:
+            raise OSError(err, os.strerror(err))
+
+_libc = None if all(hasattr(os, name) for name in ('pread', 'copy_file_range', 'sendfile')) \
+    else _load_libc()
+_libc_pread = None if _libc is None else _get_libc_func(_libc, ('pread64', 'pread'),
+    [ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int64])
+if _libc is not None and sys.platform.startswith('linux'):
+    # the BSDs and OS X have a sendfile(2) with a different signature
+    _libc_copy_file_range = _get_libc_func(_libc, ('copy_file_range',),
+        [ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_int,
+            ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t, ctypes.c_uint])
+    _libc_sendfile = _get_libc_func(_libc, ('sendfile64', 'sendfile'),
+        [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t])
+else:
+    _libc_copy_file_range = None
+    _libc_sendfile = None
+
+def _pread_libc(fileno, size, offset):
+    buffer = ctypes.create_string_buffer(size)
+    size = _call_libc(_libc_pread, fileno, buffer, size, offset)
+    return ctypes.string_at(buffer, size)
+
+def _preadinto_libc(fileno, buffer, offset):
+    if not isinstance(buffer, bytearray):
+        # memoryviews can't be handed to ctypes on python 2
+        data = _pread_libc(fileno, len(buffer), offset)
+        memoryview(buffer)[:len(data)] = data
+        return len(data)
+    if not buffer:
+        return 0
+    address = (ctypes.c_char * len(buffer)).from_buffer(buffer)
+    return _call_libc(_libc_pread, fileno, address, len(buffer), offset)
+
+def _copy_file_range_libc(src_fileno, dst_fileno, count, src_offset, dst_offset):
+    return _call_libc(_libc_copy_file_range, src_fileno, ctypes.byref(ctypes.c_int64(src_offset)),
+        dst_fileno, ctypes.byref(ctypes.c_int64(dst_offset)), count, 0)
+
+def _sendfile_libc(out_fileno, in_fileno, offset, count):
+    return _call_libc(_libc_sendfile, out_fileno, in_fileno,
+        ctypes.byref(ctypes.c_int64(offset)), count)
+
+if hasattr(os, 'pread'):
+    _os_pread = os.pread
+elif _libc_pread is not None:
+    _os_pread = _pread_libc
+else:
+    _os_pread = None
+
+if hasattr(os, 'copy_file_range'):
+    _os_copy_file_range = os.copy_file_range
+elif _libc_copy_file_range is not None:
+    _os_copy_file_range = _copy_file_range_libc
+else:
+    _os_copy_file_range = None
+
+if hasattr(os, 'sendfile'):
+    _os_sendfile = os.sendfile
+elif _libc_sendfile is not None:
+    _os_sendfile = _sendfile_libc
+else:
+    _os_sendfile = None
+
+# serializes the seek+read fallback of pread()/preadinto() for handles without
+# a usable file descriptor
+_seek_lock = threading.RLock()
+
+# errors from copy_file_range(2)/sendfile(2) that just mean this pair of files
+# (or this kernel) doesn't support it and the next method should be tried
+_KERNEL_COPY_FALLBACK_ERRNOS = frozenset(getattr(errno, name) for name in
+    ('EXDEV', 'EINVAL', 'ENOSYS', 'EOPNOTSUPP', 'ENOTSUP', 'EBADF', 'ESPIPE', 'EPERM')
+    if hasattr(errno, name))
+
 def only_if_open(orig_func):
     @functools.wraps(orig_func)
     def new_func(self, *pargs, **kwargs):
@@ -56,6 +167,144 @@ def chunked_copy(read_func, write_func, chunk_size=4 * 1024):
         chunk = read()
     return bytes_copied
 
+def chunked_copy_into(readinto_func, write_func, chunk_size=64 * 1024):
+    bytes_copied = 0
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    size = readinto_func(buffer)
+    while size:
+        write_func(view[:size])
+        bytes_copied += size
+        size = readinto_func(buffer)
+    return bytes_copied
+
+def _get_pread_fileno(handle):
+    if _os_pread is None:
+        return None
+    if any(c in getattr(handle, 'mode', 'r') for c in 'wa+'):
+        # buffered writes may not have hit the descriptor yet
+        return None
+    try:
+        return handle.fileno()
+    except (AttributeError, IOError, ValueError):
+        return None
+
+def pread(handle, size, offset):
+    """Read up to `size` bytes at `offset` of `handle` without using its file
+    position. Uses the handle's own pread() if it has one, then pread(2) on
+    its descriptor, and finally a locked seek+read that puts the file
+    position back afterwards
+    """
+
+    if hasattr(handle, 'pread'):
+        return handle.pread(size, offset)
+    fileno = _get_pread_fileno(handle)
+    if fileno is not None and size is not None and size >= 0:
+        return _os_pread(fileno, size, offset)
+    with _seek_lock:
+        position = handle.tell()
+        try:
+            handle.seek(offset)
+            return handle.read(size)
+        finally:
+            handle.seek(position)
+
+def preadinto(handle, buffer, offset):
+    """Like pread() but reads into the writable `buffer`, returns the
+    number of bytes read
+    """
+
+    if hasattr(handle, 'preadinto'):
+        return handle.preadinto(buffer, offset)
+    fileno = _get_pread_fileno(handle)
+    if fileno is not None:
+        if hasattr(os, 'preadv'):
+            return os.preadv(fileno, [buffer], offset)
+        if _os_pread is _pread_libc:
+            return _preadinto_libc(fileno, buffer, offset)
+        data = _os_pread(fileno, len(buffer), offset)
+        memoryview(buffer)[:len(data)] = data
+        return len(data)
+    with _seek_lock:
+        position = handle.tell()
+        try:
+            handle.seek(offset)
+            if hasattr(handle, 'readinto'):
+                return handle.readinto(buffer)
+            data = handle.read(len(buffer))
+            memoryview(buffer)[:len(data)] = data
+            return len(data)
+        finally:
+            handle.seek(position)
+
+def pwrite(handle, data, offset):
+    """Write all of `data` at `offset` in the real file `handle`, without
+    using (or moving) the file position when the platform has os.pwrite
+    """
+
+    if hasattr(os, 'pwrite'):
+        view = memoryview(data)
+        written = 0
+        while written < len(view):
+            written += os.pwrite(handle.fileno(), view[written:], offset + written)
+        return written
+    else:
+        handle.seek(offset)
+        handle.write(data)
+        return len(data)
+
+def kernel_copy(src_handle, dst_handle, size, offset):
+    """Copy `size` bytes at `offset` of the real file `src_handle` to the
+    current position of `dst_handle` without passing them through user space,
+    with copy_file_range(2) or else sendfile(2). Returns the number of bytes
+    copied, less than `size` (possibly 0) when neither could be used for these
+    files and the caller has to copy the rest itself
+    """
+
+    copy_file_range = _os_copy_file_range
+    sendfile = _os_sendfile
+    if copy_file_range is None and sendfile is None:
+        return 0
+    if any(c in getattr(src_handle, 'mode', 'r') for c in 'wa+'):
+        # buffered writes may not have hit the descriptor yet
+        return 0
+    try:
+        src_fileno = src_handle.fileno()
+        dst_fileno = dst_handle.fileno()
+        dst_handle.flush()
+        dst_position = dst_handle.tell()
+    except (AttributeError, IOError, OSError, ValueError):
+        return 0
+
+    done = 0
+    if copy_file_range is not None:
+        try:
+            while done < size:
+                copied = copy_file_range(src_fileno, dst_fileno, size - done,
+                    offset + done, dst_position + done)
+                if not copied:
+                    break
+                done += copied
+        except OSError as err:
+            if err.errno not in _KERNEL_COPY_FALLBACK_ERRNOS:
+                raise
+            logger.debug('copy_file_range failed, falling back: %s', err)
+    if done < size and sendfile is not None:
+        try:
+            # sendfile writes at (and moves) the descriptor's position
+            os.lseek(dst_fileno, dst_position + done, os.SEEK_SET)
+            while done < size:
+                copied = sendfile(dst_fileno, src_fileno, offset + done, size - done)
+                if not copied:
+                    break
+                done += copied
+        except OSError as err:
+            if err.errno not in _KERNEL_COPY_FALLBACK_ERRNOS:
+                raise
+            logger.debug('sendfile failed, falling back: %s', err)
+    dst_handle.seek(dst_position + done)
+    return done
+
 class FileInFile(object):
     _handle = None
     _mode = None
@@ -135,10 +384,31 @@ class FileInFile(object):
 
     @only_if_open
     def read(self, size=None):
-        size = self._normalize_size(size)
-        self._handle.seek(self._offset + self._position)
+        data = self.pread(size, self._position)
+        self._position += len(data)
+        return data
+
+    @only_if_open
+    def readinto(self, buffer):
+        size = self.preadinto(buffer, self._position)
         self._position += size
-        return self._handle.read(size)
+        return size
+
+    @only_if_open
+    def pread(self, size, offset):
+        size = self._normalize_size(size, offset)
+        if size <= 0:
+            return ''
+        return pread(self._handle, size, self._offset + offset)
+
+    @only_if_open
+    def preadinto(self, buffer, offset):
+        size = self._normalize_size(len(buffer), offset)
+        if size <= 0:
+            return 0
+        if size < len(buffer):
+            buffer = memoryview(buffer)[:size]
+        return preadinto(self._handle, buffer, self._offset + offset)
 
     @only_if_open
     @only_if_writable
@@ -176,12 +446,159 @@ class FileInFile(object):
         else:
             return self._handle.fileno()
 
-    def _normalize_size(self, size):
-        if size is None:
-            size = self._size - self._position
-        return min(size, self._size - self._position)
+    def _normalize_size(self, size, position=None):
+        if position is None:
+            position = self._position
+        if size is None or size < 0:
+            size = self._size - position
+        return min(size, self._size - position)
 
     def _constrain_position(self, pos):
         pos = min(pos, self._size)
         pos = max(pos, 0)
         return pos
+
+class MappedFile(object):
+    """Read-only file-like object over a memory map of the real file `handle`,
+    reads are plain memory copies and view() hands out slices of the mapping
+    without copying at all
+    """
+
+    _map = None
+    _handle = None
+    _closed = True
+    softspace = 0
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def mode(self):
+        return 'rb'
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def size(self):
+        return self._size
+
+    def __init__(self, handle, name=None):
+        self._handle = handle
+        self._size = os.fstat(handle.fileno()).st_size
+        if self._size:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # mmap can't map 0 bytes
+            self._map = mmap.mmap(-1, 1)
+        self._name = handle.name if name is None else name
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def __repr__(self):
+        return '<{state} {cls} \'{fn}\', size {size:d}>'.format(
+            state='closed' if self.closed else 'open',
+            cls=self.__class__.__name__,
+            fn=self.name,
+            size=self.size,
+            )
+
+    def fileno(self):
+        if self._handle is None:
+            raise IOError('%s has no file descriptor' % self.__class__.__name__)
+        return self._handle.fileno()
+
+    @only_if_open
+    def tell(self):
+        return self._map.tell()
+
+    @only_if_open
+    def seek(self, pos, mode=os.SEEK_SET):
+        if mode == os.SEEK_CUR:
+            pos += self._map.tell()
+        elif mode == os.SEEK_END:
+            pos += self._size
+        self._map.seek(max(0, min(pos, self._size)))
+
+    @only_if_open
+    def read(self, size=None):
+        pos = self._map.tell()
+        if size is None or size < 0:
+            size = self._size - pos
+        return self._map.read(min(size, self._size - pos))
+
+    @only_if_open
+    def readinto(self, buffer):
+        pos = self._map.tell()
+        size = self.preadinto(buffer, pos)
+        self._map.seek(pos + size)
+        return size
+
+    @only_if_open
+    def pread(self, size, offset):
+        if size is None or size < 0:
+            size = self._size - offset
+        return self._map[offset:offset+max(0, min(size, self._size - offset))]
+
+    @only_if_open
+    def preadinto(self, buffer, offset):
+        size = max(0, min(len(buffer), self._size - offset))
+        memoryview(buffer)[:size] = self._map[offset:offset+size]
+        return size
+
+    @only_if_open
+    def view(self, offset, size):
+        """Zero-copy view of `size` bytes of the mapping at `offset`
+        """
+
+        size = max(0, min(size, self._size - offset))
+        try:
+            return memoryview(self._map)[offset:offset+size]
+        except TypeError:
+            # py2's mmap only supports the old buffer interface
+            return buffer(self._map, offset, size)
+
+    @only_if_open
+    def flush(self):
+        pass
+
+    def close(self):
+        if not self._closed:
+            self._map.close()
+            if self._handle is not None:
+                self._handle.close()
+            self._closed = True
+
+class AnonymousMappedFile(MappedFile):
+    """Fixed size read/write file-like object backed by an anonymous memory
+    map, so large scratch data lives outside the python heap and can be
+    paged out by the OS
+    """
+
+    @property
+    def mode(self):
+        return 'w+b'
+
+    def __init__(self, size, name=None):
+        self._size = size
+        # mmap can't map 0 bytes
+        self._map = mmap.mmap(-1, max(size, 1))
+        self._name = '<anonymous mmap>' if name is None else name
+        self._closed = False
+
+    @only_if_open
+    def write(self, data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        elif not isinstance(data, bytes):
+            data = bytes(data)
+        if self._map.tell() + len(data) > self._size:
+            raise IOError('Attempted to write bytes beyond end of AnonymousMappedFile')
+        self._map.write(data)
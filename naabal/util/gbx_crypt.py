@@ -22,26 +22,79 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import struct
+import logging
+
 try:
-    # py2
-    from itertools import izip
+    import numpy
 except ImportError:
-    # py3k
-    izip = zip
-import logging
+    numpy = None
 
-from naabal.util import split_by
-from naabal.util.c_macros import COMBINE_BYTES, SPLIT_TO_BYTES, ROTL, CAST_TO_CHAR
+from naabal.util.lru import LRUCache
 
 logger = logging.getLogger('naabal.util.gbx_crypt')
 
+# translation tables that add n (mod 256) to every byte, subtracting n is the
+# same as adding (256 - n)
+_IDENTITY_TABLE = ''.join(chr(i) for i in xrange(256))
+_ADD_TABLES = [_IDENTITY_TABLE[n:] + _IDENTITY_TABLE[:n] for n in xrange(256)]
+_SUB_TABLES = [_ADD_TABLES[-n % 256] for n in xrange(256)]
+
+# combined keys only depend on the keys and the data size, so opening the same
+# archive repeatedly (format probing, worker processes, etc) can reuse them
+COMBINED_KEY_CACHE_SIZE = 256 * 1024
+_combined_key_cache = LRUCache(COMBINED_KEY_CACHE_SIZE)
+
+def combine_keys(local_key, global_key, data_size):
+    """Derive the key stream for `data_size` bytes of data from the archive's
+    local key and the global key, memoized process-wide
+    """
+
+    cache_key = (bytes(local_key), bytes(global_key), data_size)
+    combined_key = _combined_key_cache.get(cache_key)
+    if combined_key is None:
+        combined_key = _schedule_key(cache_key[0], cache_key[1], data_size)
+        _combined_key_cache.put(cache_key, combined_key)
+    else:
+        logger.debug('Reusing combined key for local key of %d bytes', len(local_key))
+    return bytearray(combined_key)
+
+def _schedule_key(local_key, global_key, data_size):
+    logger.debug('Creating combined key from local key of %d bytes', len(local_key))
+    word_count = (len(local_key) + 3) // 4
+    local_words = struct.unpack('<%dL' % word_count, local_key.ljust(word_count * 4, '\x00'))
+    global_words = struct.unpack('<%dL' % (len(global_key) // 4), global_key)
+    combined_key = bytearray(word_count * 4)
+
+    pos = 0
+    for c in local_words:
+        for b in xrange(4):
+            v = (c + data_size) & 0xFFFFFFFF
+            v = ((v << 8) | (v >> 24)) & 0xFFFFFFFF
+            c = global_words[(c ^ v) & 0xFF] ^ (c >> 8)
+            c = global_words[(c ^ (v >> 8)) & 0xFF] ^ (c >> 8)
+            c = global_words[(c ^ (v >> 16)) & 0xFF] ^ (c >> 8)
+            c = global_words[(c ^ (v >> 24)) & 0xFF] ^ (c >> 8)
+            combined_key[pos] = c & 0xFF
+            pos += 1
+    del combined_key[len(local_key):]
+    logger.debug('Created combined key: %s', str(combined_key).encode('hex'))
+    return combined_key
+
 class GearboxCrypt(object):
-    def __init__(self, data_size, local_key, global_key, chunk_size=4 * 1024):
+    # below this many bytes the per-call overhead of numpy isn't worth it
+    NUMPY_MIN_SIZE = 16 * 1024
+
+    def __init__(self, data_size, local_key, global_key, chunk_size=64 * 1024):
         logger.debug('Setting up crypto for data size: %d', data_size)
         self._chunk_size = chunk_size
         self._data_size = data_size
         self._key_size = len(local_key)
         self._encryption_key = self._combine_keys(local_key, global_key)
+        if numpy is not None:
+            self._key_array = numpy.frombuffer(str(self._encryption_key), dtype=numpy.uint8)
+        else:
+            self._key_array = None
 
     @property
     def encryption_key(self):
@@ -60,8 +113,12 @@ class GearboxCrypt(object):
 
     def decrypt(self, data, offset=0):
         data = bytearray(data)
-        key_data = self._key_stream(len(data), offset)
-        return str(bytearray(0xFF & (c + k) for c, k in izip(data, key_data)))
+        self._apply_key(data, offset, True)
+        return str(data)
+
+    def decrypt_into(self, buffer, offset=0):
+        self._apply_key(buffer, offset, True)
+        return len(buffer)
 
     def encrypt_stream(self, input_buffer, output_buffer, offset=0):
         start_pos = input_buffer.tell()
@@ -76,27 +133,52 @@ class GearboxCrypt(object):
 
     def encrypt(self, data, offset=0):
         data = bytearray(data)
-        key_data = self._key_stream(len(data), offset)
-        return str(bytearray(0xFF & (c - k) for c, k in izip(data, key_data)))
+        self._apply_key(data, offset, False)
+        return str(data)
+
+    def encrypt_into(self, buffer, offset=0):
+        self._apply_key(buffer, offset, False)
+        return len(buffer)
+
+    def _apply_key(self, data, offset, add):
+        """Add (or subtract) the key stream starting at `offset` to every byte
+        of `data` in place, `data` may be a bytearray or a writable memoryview
+        """
+
+        if len(data) == 0:
+            return
+        if self._key_array is not None and len(data) >= self.NUMPY_MIN_SIZE:
+            self._apply_key_numpy(data, offset, add)
+        elif isinstance(data, bytearray):
+            self._apply_key_translate(data, offset, add)
+        else:
+            # memoryviews can't do strided slicing on py2
+            buffer = bytearray(data)
+            self._apply_key_translate(buffer, offset, add)
+            data[:] = buffer
+
+    def _apply_key_numpy(self, data, offset, add):
+        if isinstance(data, bytearray):
+            data_array = numpy.frombuffer(data, dtype=numpy.uint8)
+        else:
+            data_array = numpy.asarray(data)
+        # rotate the key to line up with the offset, then tile it out to the
+        # length of the data
+        key_start = offset % self._key_size
+        key_array = numpy.resize(numpy.roll(self._key_array, -key_start), len(data))
+        if add:
+            data_array += key_array
+        else:
+            data_array -= key_array
 
-    def _key_stream(self, length, start_pos=0):
+    def _apply_key_translate(self, data, offset, add):
+        # every byte at the same position relative to the key gets the same
+        # key byte, so each of those strided slices is a single translate()
+        tables = _ADD_TABLES if add else _SUB_TABLES
         key = self._encryption_key
         ks = self._key_size
-        for i in xrange(start_pos, start_pos + length):
-            yield key[i % ks]
+        for i in xrange(min(ks, len(data))):
+            data[i::ks] = data[i::ks].translate(tables[key[(offset + i) % ks]])
 
     def _combine_keys(self, local_key, global_key):
-        logger.debug('Creating combined key from local key of %d bytes', len(local_key))
-        local_key = [COMBINE_BYTES(bytes) for bytes in split_by(local_key, 4)]
-        global_key = [COMBINE_BYTES(bytes) for bytes in split_by(global_key, 4)]
-        combined_key = bytearray(self._key_size)
-
-        for i in xrange(0, self._key_size, 4):
-            c = local_key[i / 4]
-            for b in range(4):
-                bytes = SPLIT_TO_BYTES(ROTL(c + self._data_size, 8))
-                for j in range(4):
-                    c = global_key[CAST_TO_CHAR(c ^ bytes[j])] ^ (c >> 8)
-                combined_key[i + b] = CAST_TO_CHAR(c)
-        logger.debug('Created combined key: %s', str(combined_key).encode('hex'))
-        return combined_key
+        return combine_keys(local_key, global_key, self._data_size)
@@ -22,14 +22,18 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import os
 import logging
 
+from naabal.formats.big import GearboxEncryptedBigFile
 from naabal.formats.big.hw1 import HomeworldBigFile
 from naabal.formats.big.hw2 import Homeworld2BigFile
 from naabal.formats.big.hwrm import HomeworldClassicBigFile, HomeworldRemasteredBigFile
+from naabal.util.file_io import pread
 
 logger = logging.getLogger('naabal.util.helpers')
 
+# probed in order, the first format whose probe() accepts the file wins
 BIG_FORMATS     = [
     HomeworldRemasteredBigFile,
     Homeworld2BigFile,
@@ -37,21 +41,53 @@ BIG_FORMATS     = [
     HomeworldBigFile,
 ]
 
-def big_load(filename):
+PROBE_HEADER_SIZE   = 4 * 1024 # 4KB
+PROBE_TRAILER_SIZE  = 4 * 1024 # 4KB
+
+def detect_big_format(handle, formats=None):
+    """Return the first of `formats` (BIG_FORMATS by default) whose probe
+    accepts the open file `handle`, or None
+    """
+
+    if formats is None:
+        formats = BIG_FORMATS
+    handle.seek(0, os.SEEK_END)
+    size = handle.tell()
+    header = pread(handle, min(size, PROBE_HEADER_SIZE), 0)
+    trailer = pread(handle, min(size, PROBE_TRAILER_SIZE), max(size - PROBE_TRAILER_SIZE, 0))
+    for big_fmt in formats:
+        if big_fmt.probe(handle, header, trailer):
+            return big_fmt
+        logger.debug('Probe rejected format: %s', big_fmt)
+    return None
+
+def big_load(filename, mirror=None, use_mmap=False, index_cache=None):
+    """Open and load `filename` as whichever format it turns out to be,
+    `mirror` selects a plaintext mirror mode for encrypted archives,
+    `use_mmap` memory maps the archive and `index_cache` is a BigIndexCache
+    to load the member list from
+    """
+
     logger.info('Attempting to determine format for big file: %s', filename)
-    for big_fmt in BIG_FORMATS:
-        logger.debug('Trying format: %s', big_fmt)
-        bigfile = big_fmt(filename)
-        try:
-            bigfile.load()
-        except Exception as err:
-            logger.debug('Loading failed for format: %s', big_fmt)
-            logger.exception(err)
+    handle = open(filename, 'rb')
+    try:
+        big_fmt = detect_big_format(handle)
+        if big_fmt is None:
+            raise ValueError('Unable to determine appropriate .big format')
+        logger.info('Determined format as: %r', big_fmt)
+        if issubclass(big_fmt, GearboxEncryptedBigFile):
+            bigfile = big_fmt(handle, mirror=mirror, use_mmap=use_mmap)
         else:
-            logger.info('Determined format as: %r', big_fmt)
-            return bigfile
-    else:
-        raise ValueError('Unable to determine appropriate .big format')
+            bigfile = big_fmt(handle, use_mmap=use_mmap)
+    except Exception:
+        handle.close()
+        raise
+    try:
+        bigfile.load(index_cache)
+    except Exception:
+        bigfile.close()
+        raise
+    return bigfile
 
 def big_open(filename, mode='rb'):
     pass
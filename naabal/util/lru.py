@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Alex Headley <aheadley@waysaboutstuff.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import collections
+import threading
+
+
+class LRUCache(object):
+    """Least-recently-used mapping bounded by the total size of its values
+    (as measured by `size_func`) rather than the number of entries
+    """
+
+    def __init__(self, max_size, size_func=len):
+        self._max_size = max_size
+        self._size_func = size_func
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return '<{0}(size={1}/{2}, hits={3}, misses={4})>'.format(
+            self.__class__.__name__, self._size, self._max_size, self.hits, self.misses)
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    @property
+    def size(self):
+        return self._size
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        value_size = self._size_func(value)
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._size_func(self._entries.pop(key))
+            if value_size > self._max_size:
+                return
+            self._entries[key] = value
+            self._size += value_size
+            while self._size > self._max_size:
+                old_key, old_value = self._entries.popitem(last=False)
+                self._size -= self._size_func(old_value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                return default
+            self._size -= self._size_func(value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
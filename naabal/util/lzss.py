@@ -25,16 +25,21 @@
 __all__ = ['decompress', 'compress', 'LZSS']
 
 import struct
+import os
 import logging
+from array import array
 
 from naabal.util import StringIO
-from naabal.util.bitio import BitReader, BitWriter
+from naabal.util.bitio import BitWriter
 
 logger = logging.getLogger('naabal.util.lzss')
 
 # MOD_WINDOW = lambda value: value & (LZSS.WINDOW_SIZE - 1)
 MOD_WINDOW = lambda value: value % 4096
 
+_WORD = struct.Struct('>L')
+_BIT_MASKS = [(1 << i) - 1 for i in xrange(64)]
+
 class LZSS(object):
     INDEX_BIT_COUNT         = 12
     LENGTH_BIT_COUNT        = 4
@@ -46,20 +51,57 @@ class LZSS(object):
     END_OF_STREAM           = 0x000
     UNUSED                  = 0
 
+    LEVEL_FAST              = 'fast'
+    LEVEL_DEFAULT           = 'default'
+    LEVEL_BEST              = 'best'
+    LEVELS                  = (LEVEL_FAST, LEVEL_DEFAULT, LEVEL_BEST)
+    # (max hash chain length to search, use lazy matching) for the levels that
+    # use hash chains, the default level uses the original binary tree so its
+    # output is identical to the game's tools
+    HASH_CHAIN_LEVELS       = {
+        LEVEL_FAST:     (8, False),
+        LEVEL_BEST:     (WINDOW_SIZE, True),
+    }
+
+    def __init__(self, chunk_size=64 * 1024, level=LEVEL_DEFAULT):
+        if level not in self.LEVELS:
+            raise ValueError('Unknown compression level: %r' % level)
+        self._chunk_size = chunk_size
+        self._level = level
+
+    @property
+    def level(self):
+        return self._level
+
     def compress_stream(self, input_buffer, output_buffer):
+        if self._level in self.HASH_CHAIN_LEVELS:
+            return self._compress_stream_hash_chain(input_buffer, output_buffer)
+        else:
+            return self._compress_stream_tree(input_buffer, output_buffer)
+
+    def _compress_stream_tree(self, input_buffer, output_buffer):
+        window_mask         = self.WINDOW_SIZE - 1
+        look_ahead_size     = self.LOOK_AHEAD_SIZE
+        chunk_size          = self._chunk_size
         current_position    = 1
         match_length        = 0
         match_position      = 0
         window = bytearray(self.WINDOW_SIZE)
+        look_ahead_bytes    = 0
+
+        input_data = bytearray(input_buffer.read(chunk_size))
+        input_pos = 0
 
-        for i in xrange(self.LOOK_AHEAD_SIZE):
-            c = input_buffer.read(1)
-            if len(c) == 0:
+        for i in xrange(look_ahead_size):
+            if input_pos >= len(input_data):
                 break
-            window[current_position + i] = ord(c)
+            window[current_position + i] = input_data[input_pos]
+            input_pos += 1
+            look_ahead_bytes += 1
 
-        look_ahead_bytes = i + 1
         tree = LZSSTree(current_position, window)
+        delete_string = tree.delete_string
+        add_string = tree.add_string
 
         with BitWriter(output_buffer) as bit_writer:
             while look_ahead_bytes > 0:
@@ -68,29 +110,136 @@ class LZSS(object):
 
                 if match_length <= self.BREAK_EVEN:
                     replace_count = 1
-                    bit_writer.write_bit(1)
-                    bit_writer.write_bits(window[current_position], 8)
+                    bit_writer.write_flag_bits(1, window[current_position], 8)
                 else:
-                    bit_writer.write_bit(0)
-                    bit_writer.write_bits(match_position, self.INDEX_BIT_COUNT)
-                    bit_writer.write_bits(match_length - (self.BREAK_EVEN + 1), self.LENGTH_BIT_COUNT)
+                    bit_writer.write_flag_bits(0,
+                        (match_position << self.LENGTH_BIT_COUNT) | (match_length - (self.BREAK_EVEN + 1)),
+                        self.INDEX_BIT_COUNT + self.LENGTH_BIT_COUNT)
                     replace_count = match_length
 
                 for i in xrange(replace_count):
-                    tree.delete_string(MOD_WINDOW(current_position + self.LOOK_AHEAD_SIZE))
-                    c = input_buffer.read(1)
-
-                    if len(c) == 0:
-                        look_ahead_bytes -= 1
+                    next_position = (current_position + look_ahead_size) & window_mask
+                    delete_string(next_position)
+
+                    if input_pos >= len(input_data):
+                        input_data = bytearray(input_buffer.read(chunk_size))
+                        input_pos = 0
+                    if input_pos < len(input_data):
+                        window[next_position] = input_data[input_pos]
+                        input_pos += 1
                     else:
-                        window[MOD_WINDOW(current_position + self.LOOK_AHEAD_SIZE)] = ord(c)
+                        look_ahead_bytes -= 1
 
-                    current_position = MOD_WINDOW(current_position + 1)
+                    current_position = (current_position + 1) & window_mask
                     if look_ahead_bytes:
-                        match_length, match_position = tree.add_string(current_position, match_position)
+                        match_length, match_position = add_string(current_position, match_position)
             # end while
-            bit_writer.write_bit(0)
-            bit_writer.write_bits(self.END_OF_STREAM, self.INDEX_BIT_COUNT)
+            bit_writer.write_flag_bits(0, self.END_OF_STREAM, self.INDEX_BIT_COUNT)
+            size = bit_writer.index
+
+        return size
+
+    def _compress_stream_hash_chain(self, input_buffer, output_buffer):
+        max_chain, lazy_match = self.HASH_CHAIN_LEVELS[self._level]
+        window_mask = self.WINDOW_SIZE - 1
+        # never reach further back than the original encoder's tree can, that
+        # way every match is one the game's decoder has already seen
+        max_distance = self.WINDOW_SIZE - self.LOOK_AHEAD_SIZE
+        max_length = self.LOOK_AHEAD_SIZE
+        min_length = self.BREAK_EVEN + 1
+        chunk_size = self._chunk_size
+
+        # chains are keyed on the first two bytes of each string (the shortest
+        # match worth encoding) and hold absolute input positions
+        head = [-1] * (1 << 16)
+        prev = [-1] * self.WINDOW_SIZE
+        data = bytearray()
+        base = 0
+        idx = 0
+        eof = False
+        pending_match = None
+
+        def find_match(i):
+            avail = len(data) - i
+            if avail < min_length:
+                return 0, 0
+            limit = min(max_length, avail)
+            pos = base + i
+            min_pos = max(pos - max_distance, 0)
+            best_length = min_length - 1
+            best_pos = 0
+            chain = max_chain
+            candidate = head[(data[i] << 8) | data[i + 1]]
+            while candidate >= min_pos and chain:
+                # window slot 0 can't be referenced, it is the end of stream marker
+                if (candidate + 1) & window_mask:
+                    j = candidate - base
+                    if data[j + best_length] == data[i + best_length]:
+                        length = min_length
+                        while length < limit and data[j + length] == data[i + length]:
+                            length += 1
+                        if length > best_length:
+                            best_length = length
+                            best_pos = candidate
+                            if length >= limit:
+                                break
+                candidate = prev[candidate & window_mask]
+                chain -= 1
+            if best_length < min_length:
+                return 0, 0
+            return best_length, best_pos
+
+        def insert_string(i):
+            if i + 1 < len(data):
+                pos = base + i
+                key = (data[i] << 8) | data[i + 1]
+                prev[pos & window_mask] = head[key]
+                head[key] = pos
+
+        with BitWriter(output_buffer) as bit_writer:
+            while True:
+                if not eof and len(data) - idx <= max_length:
+                    chunk = input_buffer.read(chunk_size)
+                    if chunk:
+                        if idx > self.WINDOW_SIZE + chunk_size:
+                            drop = idx - self.WINDOW_SIZE
+                            del data[:drop]
+                            base += drop
+                            idx -= drop
+                        data += chunk
+                        continue
+                    else:
+                        eof = True
+                if idx >= len(data):
+                    break
+
+                if pending_match is None:
+                    match_length, match_position = find_match(idx)
+                else:
+                    match_length, match_position = pending_match
+                    pending_match = None
+                insert_string(idx)
+
+                if lazy_match and min_length <= match_length < max_length:
+                    next_match = find_match(idx + 1)
+                    if next_match[0] > match_length:
+                        # a longer match starts at the next byte, emit this
+                        # one as a literal and take that one instead
+                        pending_match = next_match
+                        match_length = 0
+
+                if match_length >= min_length:
+                    bit_writer.write_flag_bits(0,
+                        (((match_position + 1) & window_mask) << self.LENGTH_BIT_COUNT) | (match_length - min_length),
+                        self.INDEX_BIT_COUNT + self.LENGTH_BIT_COUNT)
+                    for i in xrange(idx + 1, idx + match_length):
+                        insert_string(i)
+                    idx += match_length
+                else:
+                    bit_writer.write_flag_bits(1, data[idx], 8)
+                    idx += 1
+
+            bit_writer.write_flag_bits(0, self.END_OF_STREAM, self.INDEX_BIT_COUNT)
             size = bit_writer.index
 
         return size
@@ -102,32 +251,98 @@ class LZSS(object):
         return output_handle.getvalue()
 
     def decompress_stream(self, input_buffer, output_buffer):
+        window_size = self.WINDOW_SIZE
+        window_mask = window_size - 1
+        index_bit_count = self.INDEX_BIT_COUNT
+        index_mask = (1 << index_bit_count) - 1
+        length_bit_count = self.LENGTH_BIT_COUNT
+        length_mask = (1 << length_bit_count) - 1
+        min_match_length = self.BREAK_EVEN + 1
+        token_bit_count = 1 + index_bit_count + length_bit_count
+        chunk_size = self._chunk_size
+        read_word = _WORD.unpack_from
+
+        # the decoded output doubles as the window, the leading block of zeroes
+        # stands in for the initial (empty) window contents
+        output = bytearray(window_size)
+        flushed = window_size
+        bytes_written = 0
         current_position = 1
-        window = bytearray(self.WINDOW_SIZE)
-        output_buffer_pos_start = output_buffer.tell()
-
-        with BitReader(input_buffer) as bit_reader:
-            while True:
-                pass_through = bit_reader.read_bit()
-                if pass_through:
-                    c = bit_reader.read_bits(8)
-                    output_buffer.write(chr(c))
-                    window[current_position] = c
-                    current_position = MOD_WINDOW(current_position + 1)
-                else:
-                    match_position = bit_reader.read_bits(self.INDEX_BIT_COUNT)
-                    if match_position == self.END_OF_STREAM:
-                        break
-                    match_length = bit_reader.read_bits(self.LENGTH_BIT_COUNT)
-                    match_length += self.BREAK_EVEN
 
-                    for i in xrange(match_length + 1):
-                        c = window[MOD_WINDOW(match_position + i)]
-                        output_buffer.write(chr(c))
-                        window[current_position] = c
-                        current_position = MOD_WINDOW(current_position + 1)
+        data = bytearray()
+        data_len = 0
+        data_pos = 0
+        bit_buffer = 0
+        bit_count = 0
 
-        return output_buffer.tell() - output_buffer_pos_start
+        while True:
+            if bit_count < token_bit_count:
+                if data_pos + _WORD.size > data_len:
+                    data = data[data_pos:] + bytearray(input_buffer.read(chunk_size))
+                    data_len = len(data)
+                    data_pos = 0
+                if data_pos + _WORD.size <= data_len:
+                    bit_buffer = ((bit_buffer & _BIT_MASKS[bit_count]) << 32) | \
+                        read_word(data, data_pos)[0]
+                    data_pos += _WORD.size
+                    bit_count += 32
+                else:
+                    # end of the input, take whatever is left
+                    while data_pos < data_len:
+                        bit_buffer = ((bit_buffer & _BIT_MASKS[bit_count]) << 8) | data[data_pos]
+                        data_pos += 1
+                        bit_count += 8
+                    if bit_count < 1:
+                        raise IOError('Attempted to read past EOF')
+
+            bit_count -= 1
+            if (bit_buffer >> bit_count) & 1:
+                if bit_count < 8:
+                    raise IOError('Attempted to read past EOF')
+                bit_count -= 8
+                output.append((bit_buffer >> bit_count) & 0xFF)
+                current_position = (current_position + 1) & window_mask
+            else:
+                if bit_count < index_bit_count:
+                    raise IOError('Attempted to read past EOF')
+                bit_count -= index_bit_count
+                match_position = (bit_buffer >> bit_count) & index_mask
+                if match_position == self.END_OF_STREAM:
+                    break
+                if bit_count < length_bit_count:
+                    raise IOError('Attempted to read past EOF')
+                bit_count -= length_bit_count
+                match_length = ((bit_buffer >> bit_count) & length_mask) + min_match_length
+
+                # distance back from the end of the output to the start of the match
+                distance = ((current_position - match_position) & window_mask) or window_size
+                start = len(output) - distance
+                if distance >= match_length:
+                    output += output[start:start + match_length]
+                else:
+                    # the match overlaps the bytes it produces, repeat the pattern
+                    output += (output[start:] * (match_length // distance + 1))[:match_length]
+                current_position = (current_position + match_length) & window_mask
+
+                if len(output) - flushed >= chunk_size:
+                    output_buffer.write(str(output[flushed:]))
+                    bytes_written += len(output) - flushed
+                    del output[:-window_size]
+                    flushed = window_size
+
+        if len(output) > flushed:
+            output_buffer.write(str(output[flushed:]))
+            bytes_written += len(output) - flushed
+
+        # hand back any input that was read ahead but not consumed
+        unused_bytes = (data_len - data_pos) + (bit_count // 8)
+        if unused_bytes:
+            try:
+                input_buffer.seek(-unused_bytes, os.SEEK_CUR)
+            except (AttributeError, IOError):
+                pass
+
+        return bytes_written
 
     def decompress(self, input_data):
         input_handle = StringIO(input_data)
@@ -138,78 +353,72 @@ class LZSS(object):
 def decompress(data):
     return LZSS().decompress(data)
 
-def compress(data):
-    return LZSS().compress(data)
-
-class LZSSTreeNode(object):
-    parent = 0
-    smaller_child = 0
-    larger_child = 0
-
-    def __repr__(self):
-        return '<%4d . %4d . %4d>' % (self.parent, self.larger_child, self.smaller_child)
-
-    def copy_node(self, source_node):
-        self.parent = source_node.parent
-        self.smaller_child = source_node.smaller_child
-        self.larger_child = source_node.larger_child
+def compress(data, level=LZSS.LEVEL_DEFAULT):
+    return LZSS(level=level).compress(data)
 
 class LZSSTree(object):
-    _data = None
+    """Binary search tree over the strings in the window, stored as three flat
+    arrays (parent, smaller child, larger child) indexed by window position
+    """
 
     def __init__(self, root_idx, window):
+        node_count = LZSS.WINDOW_SIZE + 1
         self._window = window
-        self._data = [LZSSTreeNode() for i in xrange(LZSS.WINDOW_SIZE + 1)]
-        self[LZSS.TREE_ROOT].larger_child = root_idx
-        self[root_idx].parent = LZSS.TREE_ROOT
-        self[root_idx].larger_child = LZSS.UNUSED
-        self[root_idx].smaller_child = LZSS.UNUSED
-        logger.debug('Init LZSS tree of %d elements', len(self._data))
+        self.parent = array('H', [LZSS.UNUSED]) * node_count
+        self.smaller_child = array('H', [LZSS.UNUSED]) * node_count
+        self.larger_child = array('H', [LZSS.UNUSED]) * node_count
+        self.larger_child[LZSS.TREE_ROOT] = root_idx
+        self.parent[root_idx] = LZSS.TREE_ROOT
+        self.larger_child[root_idx] = LZSS.UNUSED
+        self.smaller_child[root_idx] = LZSS.UNUSED
+        logger.debug('Init LZSS tree of %d elements', node_count)
 
     def __repr__(self):
-        return repr(self._data)
-
-    def __getitem__(self, key):
-        return self._data[key]
-
-    def __setitem__(self, key, value):
-        self._data[key] = value
+        return repr(zip(self.parent, self.larger_child, self.smaller_child))
 
     def contract_node(self, old_node, new_node):
-        self[new_node].parent = self[old_node].parent
-        if self[self[old_node].parent].larger_child == old_node:
-            self[self[old_node].parent].larger_child = new_node
+        parent = self.parent
+        old_parent = parent[old_node]
+        parent[new_node] = old_parent
+        if self.larger_child[old_parent] == old_node:
+            self.larger_child[old_parent] = new_node
         else:
-            self[self[old_node].parent].smaller_child = new_node
-        self[old_node].parent = LZSS.UNUSED
+            self.smaller_child[old_parent] = new_node
+        parent[old_node] = LZSS.UNUSED
 
     def replace_node(self, old_node, new_node):
-        parent = self[old_node].parent
+        parent = self.parent
+        smaller_child = self.smaller_child
+        larger_child = self.larger_child
+        old_parent = parent[old_node]
 
-        if self[parent].smaller_child == old_node:
-            self[parent].smaller_child = new_node
+        if smaller_child[old_parent] == old_node:
+            smaller_child[old_parent] = new_node
         else:
-            self[parent].larger_child = new_node
+            larger_child[old_parent] = new_node
 
-        self[new_node].copy_node(self[old_node])
-        self[self[new_node].smaller_child].parent = new_node
-        self[self[new_node].larger_child].parent = new_node
-        self[old_node].parent = LZSS.UNUSED
+        parent[new_node] = parent[old_node]
+        smaller_child[new_node] = smaller_child[old_node]
+        larger_child[new_node] = larger_child[old_node]
+        parent[smaller_child[new_node]] = new_node
+        parent[larger_child[new_node]] = new_node
+        parent[old_node] = LZSS.UNUSED
 
     def find_next_node(self, node):
-        next = self[node].smaller_child
-        while self[next].larger_child != LZSS.UNUSED:
-            next = self[next].larger_child
+        larger_child = self.larger_child
+        next = self.smaller_child[node]
+        while larger_child[next] != LZSS.UNUSED:
+            next = larger_child[next]
         return next
 
     def delete_string(self, p):
-        if self[p].parent == LZSS.UNUSED:
+        if self.parent[p] == LZSS.UNUSED:
             return
 
-        if self[p].larger_child == LZSS.UNUSED:
-            self.contract_node(p, self[p].smaller_child)
-        elif self[p].smaller_child == LZSS.UNUSED:
-            self.contract_node(p, self[p].larger_child)
+        if self.larger_child[p] == LZSS.UNUSED:
+            self.contract_node(p, self.smaller_child[p])
+        elif self.smaller_child[p] == LZSS.UNUSED:
+            self.contract_node(p, self.larger_child[p])
         else:
             replacement = self.find_next_node(p)
             self.delete_string(replacement)
@@ -219,33 +428,52 @@ class LZSSTree(object):
         if new_node == LZSS.END_OF_STREAM:
             return (0, match_position)
 
-        test_node = self[LZSS.TREE_ROOT].larger_child
+        window = self._window
+        window_mask = LZSS.WINDOW_SIZE - 1
+        look_ahead_size = LZSS.LOOK_AHEAD_SIZE
+        smaller_child = self.smaller_child
+        larger_child = self.larger_child
+        test_node = larger_child[LZSS.TREE_ROOT]
         match_length = 0
+        first_byte = window[new_node]
+        # the new string as a slice when it doesn't wrap around the window, to
+        # short-circuit comparing strings that match completely
+        if new_node + look_ahead_size <= LZSS.WINDOW_SIZE:
+            new_string = window[new_node:new_node + look_ahead_size]
+        else:
+            new_string = None
 
         while True:
-            for i in xrange(LZSS.LOOK_AHEAD_SIZE):
-                delta = self._window[MOD_WINDOW(new_node + i)] - \
-                    self._window[MOD_WINDOW(test_node + i)]
-                if delta != 0:
-                    break
+            delta = first_byte - window[test_node]
+            if delta != 0:
+                i = 0
+            elif new_string is not None and \
+                    new_string == window[test_node:test_node + look_ahead_size]:
+                i = look_ahead_size - 1
+            else:
+                for i in xrange(1, look_ahead_size):
+                    delta = window[(new_node + i) & window_mask] - \
+                        window[(test_node + i) & window_mask]
+                    if delta != 0:
+                        break
 
             if i >= match_length:
                 match_length = i
                 match_position = test_node
-                if match_length >= LZSS.LOOK_AHEAD_SIZE:
+                if match_length >= look_ahead_size:
                     self.replace_node(test_node, new_node)
                     return (match_length, match_position)
 
             if delta >= 0:
-                child_attr = 'larger_child'
+                children = larger_child
             else:
-                child_attr = 'smaller_child'
+                children = smaller_child
 
-            if getattr(self[test_node], child_attr) == LZSS.UNUSED:
-                setattr(self[test_node], child_attr, new_node)
-                self[new_node].parent = test_node
-                self[new_node].larger_child = LZSS.UNUSED
-                self[new_node].smaller_child = LZSS.UNUSED
+            if children[test_node] == LZSS.UNUSED:
+                children[test_node] = new_node
+                self.parent[new_node] = test_node
+                larger_child[new_node] = LZSS.UNUSED
+                smaller_child[new_node] = LZSS.UNUSED
                 return (match_length, match_position)
 
-            test_node = getattr(self[test_node], child_attr)
+            test_node = children[test_node]
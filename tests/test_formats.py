@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Alex Headley <aheadley@waysaboutstuff.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import unittest
+
+from naabal.errors import StructuredFileFormatException
+from naabal.formats import StructuredFileSection, StructuredFileSequence
+from naabal.util import StringIO
+
+class TestSection(StructuredFileSection):
+    STRUCTURE = [
+        {
+            'key':      'magic',
+            'fmt':      'c',
+            'len':      4,
+            'default':  'TEST',
+            'read':     lambda v: ''.join(v),
+            'write':    lambda v: list(v),
+        },
+        {
+            'key':      'count',
+            'fmt':      'H',
+            'len':      1,
+            'default':  0x00,
+            'read':     int,
+            'write':    int,
+        },
+        {
+            'key':      'flag',
+            'fmt':      'B',
+            'len':      1,
+            'default':  False,
+            'read':     bool,
+            'write':    lambda v: 0x01 if v else 0x00,
+        },
+    ]
+
+    def check(self):
+        if self['count'] > 1000:
+            raise StructuredFileFormatException('Count too large: %d' % self['count'])
+        return True
+
+class TestSequence(StructuredFileSequence):
+    CHILD_TYPE = TestSection
+
+    def _get_expected_length(self, handle):
+        return 3
+
+class TestFormatsStructuredFileSection(unittest.TestCase):
+    def test_precompiled_format(self):
+        self.assertEqual('<ccccHB', TestSection.data_format)
+        self.assertEqual(7, TestSection.data_size)
+
+    def test_roundtrip(self):
+        section = TestSection()
+        section['count'] = 123
+        section['flag'] = True
+        handle = StringIO()
+        section.save(handle)
+        self.assertEqual('TEST\x7B\x00\x01', handle.getvalue())
+
+        handle.seek(0)
+        loaded = TestSection(handle)
+        self.assertEqual('TEST', loaded['magic'])
+        self.assertEqual(123, loaded['count'])
+        self.assertIs(True, loaded['flag'])
+
+    def test_compact_records(self):
+        section = TestSection()
+        self.assertFalse(hasattr(section, '__dict__'))
+        self.assertFalse(hasattr(section._data, '__dict__'))
+        self.assertEqual(['magic', 'count', 'flag'], section._data.keys())
+        self.assertRaises(AttributeError, section.__setitem__, 'bogus', 1)
+
+    def test_load_from(self):
+        section = TestSection.__new__(TestSection)
+        section.load_from('xxTEST\x02\x00\x00', 2)
+        self.assertEqual(2, section['count'])
+        self.assertIs(False, section['flag'])
+
+    def test_short_data(self):
+        self.assertRaises(StructuredFileFormatException, TestSection, StringIO('TEST'))
+
+    def test_check(self):
+        self.assertRaises(StructuredFileFormatException, TestSection, StringIO('TEST\xFF\xFF\x00'))
+
+class TestFormatsStructuredFileSequence(unittest.TestCase):
+    TEST_DATA = 'TEST\x01\x00\x00' + 'ABCD\x02\x00\x01' + 'TEST\x03\x00\x00'
+
+    def test_load(self):
+        sequence = TestSequence(StringIO(self.TEST_DATA))
+        self.assertEqual(3, len(sequence))
+        self.assertEqual([1, 2, 3], sequence.column('count'))
+        self.assertEqual('ABCD', sequence[1]['magic'])
+        self.assertIs(True, sequence[1]['flag'])
+        self.assertIsInstance(sequence[1], TestSection)
+        self.assertEqual([1, 3], [record['count'] for record in sequence[::2]])
+        self.assertFalse(hasattr(sequence[0], '__dict__'))
+
+    def test_record_view(self):
+        sequence = TestSequence(StringIO(self.TEST_DATA))
+        record = sequence[2]
+        record['count'] = 5
+        self.assertEqual(5, sequence[2]['count'])
+        self.assertEqual(2, sequence._data_list.index(record))
+        handle = StringIO()
+        sequence.save(handle)
+        self.assertEqual(self.TEST_DATA[:-3] + '\x05\x00\x00', handle.getvalue())
+
+    def test_lazy_records(self):
+        sequence = TestSequence(StringIO(self.TEST_DATA))
+        self.assertEqual(3, sequence[-1]['count'])
+        self.assertEqual([1, 2, 3], [record['count'] for record in sequence])
+        self.assertRaises(IndexError, sequence.__getitem__, 3)
+        self.assertRaises(IndexError, sequence.__getitem__, -4)
+        self.assertEqual(sequence[1], sequence.record(1))
+        self.assertNotEqual(sequence[0], sequence[1])
+        # none of that built views for the whole sequence
+        self.assertIs(None, sequence._records)
+
+    def test_record_check(self):
+        self.assertRaises(StructuredFileFormatException, TestSequence,
+            StringIO(self.TEST_DATA[:11] + '\xFF\xFF' + self.TEST_DATA[13:]))
+
+    def test_short_data(self):
+        self.assertRaises(StructuredFileFormatException, TestSequence,
+            StringIO(self.TEST_DATA[:-1]))
+
+    def test_assigned_records(self):
+        sequence = TestSequence()
+        sequence._data_list = [TestSection(), TestSection()]
+        sequence[1]['count'] = 7
+        self.assertEqual(2, len(sequence))
+        self.assertEqual([0, 7], sequence.column('count'))
+
+if __name__ == '__main__':
+    unittest.main()
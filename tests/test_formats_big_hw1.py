@@ -23,9 +23,16 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import os
+import struct
+import shutil
+import tempfile
+import threading
 import unittest
 
-from naabal.formats.big.hw1 import HomeworldBigFile
+from naabal.errors import StructuredFileFormatException
+from naabal.formats.big.hw1 import HomeworldBigFile, HomeworldBigToc, HomeworldBigTocEntry
+from naabal.util import StringIO, datetime_to_timestamp
 
 class TestFormatsBigHomeworld1(unittest.TestCase):
     def setUp(self):
@@ -43,5 +50,152 @@ class TestFormatsBigHomeworld1(unittest.TestCase):
         self.assertEqual(TEST_FILENAME, self.bigfile._normalize_filename(
             self.bigfile._denormalize_filename(TEST_FILENAME)))
 
+    def test_probe_rejects_bad_toc_entry(self):
+        class BrokenTocEntry(HomeworldBigTocEntry):
+            def check(self):
+                raise StructuredFileFormatException('Broken ToC entry')
+
+        class BrokenToc(HomeworldBigToc):
+            CHILD_TYPE = BrokenTocEntry
+
+        class BrokenBigFile(HomeworldBigFile):
+            STRUCTURE = [HomeworldBigFile.STRUCTURE[0], ('table_of_contents', BrokenToc)]
+
+        header = struct.pack('<7sLL', 'RBF1.23', 1, 1) + '\x00' * HomeworldBigTocEntry.data_size
+        self.assertFalse(BrokenBigFile.probe(StringIO(header), header, header))
+
+class TestFormatsBigHomeworld1Archive(unittest.TestCase):
+    FILES           = {
+        'Data/ReadMe.txt':              'plain text\n' * 100,
+        'Data/Ships/R1/Mothership.peo': os.urandom(2048),
+        'Data/Scripts/level01.script':  'x = 1\n' * 500,
+    }
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        src_dir = os.path.join(self.tmp_dir, 'src')
+        for name, data in self.FILES.items():
+            filename = os.path.join(src_dir, *name.split('/'))
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, 'wb') as handle:
+                handle.write(data)
+        self.filename = os.path.join(self.tmp_dir, 'test.big')
+        bigfile = HomeworldBigFile(self.filename, 'w+b')
+        bigfile.add_all(src_dir + os.sep)
+        bigfile.save()
+        bigfile.close()
+
+        self.bigfile = HomeworldBigFile(self.filename)
+        self.bigfile.load()
+
+    def tearDown(self):
+        self.bigfile.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_member(self):
+        for member in self.bigfile.get_members():
+            self.assertIs(member, self.bigfile.get_member(member.name))
+        member = self.bigfile.get_member('Data\\Ships\\R1\\Mothership.peo')
+        self.assertEqual(2048, member.real_size)
+        self.assertIs(member, self.bigfile.get_member('data/ships/r1/MOTHERSHIP.PEO',
+            case_sensitive=False))
+        self.assertRaises(KeyError, self.bigfile.get_member, 'data/ships/r1/MOTHERSHIP.PEO')
+        self.assertRaises(KeyError, self.bigfile.get_member, 'Data/missing.txt')
+        self.assertIn('Data/ReadMe.txt', self.bigfile)
+        self.assertNotIn('Data/ReadMe.txt.bak', self.bigfile)
+
+    def test_extract_all(self):
+        for jobs, coalesce_size in [(None, None), (2, None), (2, 1)]:
+            dest_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+            extracted = []
+            self.bigfile.extract_all(path=dest_dir, jobs=jobs, progress=extracted.append,
+                coalesce_size=coalesce_size)
+            self.assertEqual(sorted(self.bigfile.get_members(), key=lambda m: m._offset), extracted)
+            self._check_extracted(dest_dir)
+
+    def _check_extracted(self, dest_dir):
+        for name, data in self.FILES.items():
+            filename = os.path.join(dest_dir, *name.split('/'))
+            with open(filename, 'rb') as handle:
+                self.assertEqual(data, handle.read())
+            self.assertEqual(datetime_to_timestamp(self.bigfile.get_member(name).mtime),
+                int(os.path.getmtime(filename)))
+
+    def _count_filename_reads(self, bigfile):
+        decoded = []
+        read_filename = bigfile._read_filename
+        def counting_read_filename(toc_entry):
+            filename = read_filename(toc_entry)
+            decoded.append(filename)
+            return filename
+        bigfile._read_filename = counting_read_filename
+        return decoded
+
+    def test_get_member_decodes_only_matches(self):
+        decoded = self._count_filename_reads(self.bigfile)
+        self.bigfile.get_member('Data/Scripts/level01.script')
+        self.assertEqual([os.path.join('Data', 'Scripts', 'level01.script')], decoded)
+
+    def test_lazy_members(self):
+        with HomeworldBigFile(self.filename) as bigfile:
+            decoded = self._count_filename_reads(bigfile)
+            bigfile.load()
+            self.assertEqual(len(self.FILES), len(bigfile))
+            self.assertEqual([], decoded)
+
+            member = bigfile.get_member('Data/ReadMe.txt')
+            with tempfile.TemporaryFile() as outfile:
+                bigfile.extract_file(member, outfile)
+                outfile.seek(0)
+                self.assertEqual(self.FILES['Data/ReadMe.txt'], outfile.read())
+            self.assertEqual(1, len(decoded))
+
+            # the rest of the names are close enough together for a single read
+            reads = []
+            pread = bigfile.pread
+            bigfile.pread = lambda size, offset: reads.append(offset) or pread(size, offset)
+            self.assertEqual(sorted(os.path.join(*name.split('/')) for name in self.FILES),
+                bigfile.get_filenames())
+            self.assertEqual(1, len(decoded))
+            self.assertEqual(1, len(reads))
+
+    def test_filename_read_spans(self):
+        with HomeworldBigFile(self.filename) as bigfile:
+            bigfile.FILENAME_READ_SIZE = 16
+            bigfile.load()
+            self.assertEqual(sorted(os.path.join(*name.split('/')) for name in self.FILES),
+                bigfile.get_filenames())
+
+    def test_threaded_lazy_names(self):
+        members = self.bigfile.get_members()
+        stored = [(m._offset, self.bigfile.pread(m.stored_size, m._offset)) for m in members]
+        expected = sorted(m.name for m in members)
+        errors = []
+        with HomeworldBigFile(self.filename) as bigfile:
+            bigfile.load()
+            toc = bigfile['table_of_contents']
+
+            def read_members():
+                for i in xrange(200):
+                    for offset, data in stored:
+                        if bigfile.pread(len(data), offset) != data:
+                            errors.append(offset)
+
+            def read_names():
+                for i in xrange(200):
+                    names = sorted(bigfile._read_filename(toc.record(index)) \
+                        for index in xrange(len(toc)))
+                    if names != expected:
+                        errors.append(names)
+
+            threads = [threading.Thread(target=target) \
+                for target in (read_members, read_names, read_members, read_names)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual([], errors)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Alex Headley <aheadley@waysaboutstuff.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+
+import os
+import os.path
+import sys
+import struct
+import zlib
+import datetime
+import tempfile
+import shutil
+import unittest
+
+from naabal.formats.big.hw2 import Homeworld2BigFile, Homeworld2BigArchiveHeader, \
+    Homeworld2BigSectionHeader, Homeworld2BigTocEntry, Homeworld2BigFolderEntry, \
+    Homeworld2BigFileInfoEntry, Homeworld2BigFileEntry
+from naabal.formats.big.hwrm import HomeworldRemasteredBigFile
+from naabal.errors import GearboxEncryptionException
+from naabal.util import crc32
+from naabal.util.gbx_crypt import GearboxCrypt
+from naabal.util.keys import GEARBOX_HWRM_GLOBAL_KEY
+
+
+def build_hw2_archive(filename, files, encryption_key=None):
+    """Write a minimal HW2 archive containing `files` (a list of
+    (name, data, compress) tuples), optionally encrypted like a HWRM archive
+    """
+
+    folders = {}
+    for name, data, compress in files:
+        folder_name, file_name = os.path.split(name)
+        folders.setdefault(folder_name.replace('/', '\\'), []).append(
+            (file_name, data, compress))
+    folder_names = sorted(folders)
+    if '' in folders:
+        folder_names.remove('')
+    folder_names.insert(0, '')
+
+    name_blob = []
+    def add_name(name):
+        offset = sum(len(n) for n in name_blob)
+        name_blob.append(name + '\x00')
+        return offset
+
+    folder_entries = []
+    file_info_entries = []
+    file_entries = []
+    data_offset = 0
+    for idx, folder_name in enumerate(folder_names):
+        folder = Homeworld2BigFolderEntry()
+        folder['filename_offset'] = add_name(folder_name)
+        if idx == 0:
+            folder['first_subfolder_idx'] = 1
+            folder['last_subfolder_idx'] = len(folder_names)
+        folder['first_fileinfo_idx'] = len(file_info_entries)
+        for file_name, data, compress in folders.get(folder_name, []):
+            stored_data = zlib.compress(data) if compress else data
+            file_info = Homeworld2BigFileInfoEntry()
+            file_info['filename_offset'] = add_name(file_name)
+            file_info['compression_flag'] = 1 if compress else 0
+            file_info['file_data_offset'] = data_offset + Homeworld2BigFileEntry.data_size
+            file_info['data_stored_size'] = len(stored_data)
+            file_info['data_real_size'] = len(data)
+            file_entry = Homeworld2BigFileEntry()
+            file_entry['filename'] = file_name
+            file_entry['timestamp'] = datetime.datetime(2015, 2, 25)
+            file_entry['crc32'] = crc32(data)
+            file_info_entries.append(file_info)
+            file_entries.append((file_entry, stored_data))
+            data_offset += Homeworld2BigFileEntry.data_size + len(stored_data)
+        folder['last_fileinfo_idx'] = len(file_info_entries)
+        folder_entries.append(folder)
+
+    section_header = Homeworld2BigSectionHeader()
+    section_header['toc_list_offset'] = Homeworld2BigSectionHeader.data_size
+    section_header['toc_list_count'] = 1
+    section_header['folder_list_offset'] = section_header['toc_list_offset'] + \
+        Homeworld2BigTocEntry.data_size
+    section_header['folder_list_count'] = len(folder_entries)
+    section_header['file_info_list_offset'] = section_header['folder_list_offset'] + \
+        Homeworld2BigFolderEntry.data_size * len(folder_entries)
+    section_header['file_info_list_count'] = len(file_info_entries)
+    section_header['filename_list_offset'] = section_header['file_info_list_offset'] + \
+        Homeworld2BigFileInfoEntry.data_size * len(file_info_entries)
+    section_header['filename_list_count'] = len(name_blob)
+
+    toc_entry = Homeworld2BigTocEntry()
+    toc_entry['last_folder_idx'] = len(folder_entries)
+    toc_entry['last_fileinfo_idx'] = len(file_info_entries)
+
+    archive_header = Homeworld2BigArchiveHeader()
+    archive_header['section_header_size'] = section_header['filename_list_offset'] + \
+        len(''.join(name_blob))
+    archive_header['file_data_offset'] = Homeworld2BigArchiveHeader.data_size + \
+        archive_header['section_header_size']
+
+    with tempfile.TemporaryFile() as handle:
+        archive_header.save(handle)
+        section_header.save(handle)
+        toc_entry.save(handle)
+        for entry in folder_entries + file_info_entries:
+            entry.save(handle)
+        handle.write(''.join(name_blob))
+        for file_entry, stored_data in file_entries:
+            file_entry.save(handle)
+            handle.write(stored_data)
+        handle.seek(0)
+        archive_data = handle.read()
+
+    with open(filename, 'wb') as handle:
+        if encryption_key is None:
+            handle.write(archive_data)
+        else:
+            crypto = GearboxCrypt(len(archive_data), bytearray(encryption_key),
+                GEARBOX_HWRM_GLOBAL_KEY)
+            handle.write(crypto.encrypt(archive_data))
+            handle.write(struct.pack('<LH', HomeworldRemasteredBigFile.ENCRYPTION_KEY_MARKER,
+                len(encryption_key)))
+            handle.write(encryption_key)
+            handle.write(struct.pack('<L', 4 + 2 + len(encryption_key) + 4))
+
+
+class TestFormatsBigHomeworld2(unittest.TestCase):
+    BIGFILE_CLASS       = Homeworld2BigFile
+    BIGFILE_KWARGS      = {}
+    ENCRYPTION_KEY      = None
+    MEMBER_VIEW_ERROR   = IOError
+    KERNEL_COPY         = True
+    FILES               = [
+        ('readme.txt', 'plain text\n' * 100, False),
+        ('data/ship/hgn_mothership.hod', os.urandom(70 * 1024), False),
+        ('data/scripts/rules.lua', 'function OnInit()\nend\n' * 500, True),
+    ]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, 'test.big')
+        build_hw2_archive(self.filename, self.FILES, self.ENCRYPTION_KEY)
+        self.bigfile = self.BIGFILE_CLASS(self.filename, **self.BIGFILE_KWARGS)
+        self.bigfile.load()
+
+    def tearDown(self):
+        self.bigfile.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_filenames(self):
+        self.assertEqual(sorted(os.path.join(*name.split('/')) for name, data, compress in self.FILES),
+            self.bigfile.get_filenames())
+
+    def test_extract_file(self):
+        for name, data, compress in self.FILES:
+            member = self.bigfile.get_member(os.path.join(*name.split('/')))
+            self.assertEqual(compress, member.is_compressed)
+            self.assertEqual(len(data), member.real_size)
+            self.assertEqual(datetime.datetime(2015, 2, 25), member.mtime)
+            with tempfile.TemporaryFile() as outfile:
+                self.bigfile.extract_file(member, outfile)
+                outfile.seek(0)
+                self.assertEqual(data, outfile.read())
+
+    def test_get_member(self):
+        member = self.bigfile.get_member(os.path.join('data', 'ship', 'hgn_mothership.hod'))
+        self.assertIs(member, self.bigfile.get_member('data\\ship\\hgn_mothership.hod'))
+        self.assertIs(member, self.bigfile.get_member('DATA\\Ship\\HGN_Mothership.hod',
+            case_sensitive=False))
+        self.assertRaises(KeyError, self.bigfile.get_member, 'DATA\\Ship\\HGN_Mothership.hod')
+        self.assertRaises(KeyError, self.bigfile.get_member, 'missing.txt')
+        self.assertIn('data/scripts/rules.lua', self.bigfile)
+        self.assertNotIn('data/scripts/missing.lua', self.bigfile)
+
+    def _count_metadata_reads(self, bigfile):
+        offsets = []
+        get_file_metadata = bigfile._get_file_metadata
+        def counting_get_file_metadata(file_data_offset):
+            offsets.append(file_data_offset)
+            return get_file_metadata(file_data_offset)
+        bigfile._get_file_metadata = counting_get_file_metadata
+        return offsets
+
+    def test_lazy_metadata(self):
+        with self.BIGFILE_CLASS(self.filename, **self.BIGFILE_KWARGS) as bigfile:
+            offsets = self._count_metadata_reads(bigfile)
+            bigfile.load()
+            bigfile.get_filenames()
+            self.assertEqual([], offsets)
+
+            name, data, compress = self.FILES[1]
+            member = bigfile.get_member(name)
+            self.assertEqual(crc32(data), member.crc32)
+            self.assertEqual(datetime.datetime(2015, 2, 25), member.mtime)
+            self.assertEqual([member._offset], offsets)
+
+    def test_prefetch_metadata(self):
+        with self.BIGFILE_CLASS(self.filename, **self.BIGFILE_KWARGS) as bigfile:
+            offsets = self._count_metadata_reads(bigfile)
+            bigfile.load()
+            bigfile.prefetch_metadata()
+            self.assertEqual(sorted(m._offset for m in bigfile.get_members()), offsets)
+            for name, data, compress in self.FILES:
+                self.assertEqual(crc32(data), bigfile.get_member(name).crc32)
+            self.assertEqual(len(self.FILES), len(offsets))
+
+    def test_plan_extraction(self):
+        members = sorted(self.bigfile.get_members(), key=lambda m: m._offset)
+        start = members[0]._offset
+        end = members[-1]._offset + members[-1].stored_size
+        self.assertEqual([(start, end - start, members)],
+            self.bigfile._plan_extraction(self.bigfile.get_members(), 1024 * 1024))
+        self.assertEqual([(m._offset, m.stored_size, [m]) for m in members],
+            self.bigfile._plan_extraction(self.bigfile.get_members(), 1))
+
+    def test_extract_all(self):
+        for jobs, inflight_size, coalesce_size in [
+                (None, None, None), (None, None, 1), (2, None, None), (2, 1, None), (2, None, 1)]:
+            if inflight_size is not None:
+                self.bigfile.EXTRACT_INFLIGHT_SIZE = inflight_size
+            dest_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+            extracted = []
+            self.bigfile.extract_all(path=dest_dir, jobs=jobs, progress=extracted.append,
+                coalesce_size=coalesce_size)
+            self.assertEqual(sorted(self.bigfile.get_members(), key=lambda m: m._offset), extracted)
+            for name, data, compress in self.FILES:
+                filename = os.path.join(dest_dir, *name.split('/'))
+                with open(filename, 'rb') as handle:
+                    self.assertEqual(data, handle.read())
+                self.assertEqual(datetime.datetime(2015, 2, 25),
+                    datetime.datetime.utcfromtimestamp(os.path.getmtime(filename)))
+
+    def test_kernel_copy_member(self):
+        name, data, compress = self.FILES[1]
+        member = self.bigfile.get_member(name)
+        with tempfile.TemporaryFile() as outfile:
+            copied = self.bigfile._kernel_copy_member(member, outfile)
+            if self.KERNEL_COPY and sys.platform.startswith('linux'):
+                self.assertEqual(len(data), copied)
+            elif not self.KERNEL_COPY:
+                # the archive holds ciphertext, it can't be copied as is
+                self.assertEqual(0, copied)
+            outfile.seek(0)
+            self.assertEqual(data[:copied], outfile.read())
+
+    def test_readinto(self):
+        name, data, compress = self.FILES[1]
+        member = self.bigfile.get_member(os.path.join(*name.split('/')))
+        buffer = bytearray(len(data) + 10)
+        with self.bigfile.open_member(member) as handle:
+            handle.seek(5)
+            self.assertEqual(len(data) - 5, handle.readinto(memoryview(buffer)[10:]))
+            self.assertEqual(0, handle.readinto(buffer))
+        self.assertEqual(data[5:], str(buffer[10:len(data) + 5]))
+
+    def test_member_view(self):
+        if self.MEMBER_VIEW_ERROR is not None:
+            member = self.bigfile.get_member(self.FILES[0][0])
+            self.assertRaises(self.MEMBER_VIEW_ERROR, self.bigfile.member_view, member)
+            return
+        for name, data, compress in self.FILES:
+            member = self.bigfile.get_member(os.path.join(*name.split('/')))
+            view = self.bigfile.member_view(member)
+            if compress:
+                self.assertEqual(data, zlib.decompress(view))
+            else:
+                self.assertEqual(data, str(view))
+
+class TestFormatsBigHomeworld2Mapped(TestFormatsBigHomeworld2):
+    BIGFILE_KWARGS      = {'use_mmap': True}
+    MEMBER_VIEW_ERROR   = None
+
+class TestFormatsBigHomeworldRemastered(TestFormatsBigHomeworld2):
+    BIGFILE_CLASS       = HomeworldRemasteredBigFile
+    ENCRYPTION_KEY      = os.urandom(200)
+    MEMBER_VIEW_ERROR   = GearboxEncryptionException
+    KERNEL_COPY         = False
+
+    def test_read_past_encrypted_data(self):
+        data_size = self.bigfile.data_size
+        self.bigfile.seek(data_size - 100)
+        buffer = bytearray(200)
+        self.assertEqual(100, self.bigfile.readinto(buffer))
+        self.bigfile.seek(data_size - 100)
+        self.assertEqual(str(buffer[:100]), self.bigfile.read(-1))
+
+    def test_decrypt_to(self):
+        plain_filename = os.path.join(self.tmp_dir, 'plain.big')
+        build_hw2_archive(plain_filename, self.FILES)
+        with open(plain_filename, 'rb') as handle:
+            plain_data = handle.read()
+        with HomeworldRemasteredBigFile(self.filename) as bigfile:
+            with tempfile.TemporaryFile() as outfile:
+                self.assertEqual(len(plain_data), bigfile.decrypt_to(outfile, 1000))
+                outfile.seek(0)
+                self.assertEqual(plain_data, outfile.read())
+
+    def test_decrypt_to_file(self):
+        plain_filename = os.path.join(self.tmp_dir, 'plain.big')
+        build_hw2_archive(plain_filename, self.FILES)
+        with open(plain_filename, 'rb') as handle:
+            plain_data = handle.read()
+        decrypted_filename = os.path.join(self.tmp_dir, 'decrypted.big')
+        progress = []
+        for jobs in (1, 2):
+            with HomeworldRemasteredBigFile(self.filename) as bigfile:
+                self.assertEqual(len(plain_data), bigfile.decrypt_to_file(decrypted_filename,
+                    jobs=jobs, chunk_size=1000, range_size=10000,
+                    progress=lambda done, total: progress.append(done)))
+            with open(decrypted_filename, 'rb') as handle:
+                self.assertEqual(plain_data, handle.read())
+            self.assertEqual(len(plain_data), progress[-1])
+
+    def test_block_cache(self):
+        self.assertGreater(self.bigfile.block_cache.hits, 0)
+        with HomeworldRemasteredBigFile(self.filename, cache_size=0) as uncached:
+            uncached.load()
+            self.assertIsNone(uncached.block_cache)
+            for offset in (0, 100, 4090, self.bigfile.data_size - 10):
+                self.bigfile.seek(offset)
+                uncached.seek(offset)
+                self.assertEqual(uncached.read(300), self.bigfile.read(300))
+                self.assertEqual(uncached.tell(), self.bigfile.tell())
+
+class TestFormatsBigHomeworldRemasteredMapped(TestFormatsBigHomeworldRemastered):
+    BIGFILE_KWARGS      = {'use_mmap': True}
+
+class TestFormatsBigHomeworldRemasteredMemoryMirror(TestFormatsBigHomeworldRemastered):
+    BIGFILE_KWARGS      = {'mirror': HomeworldRemasteredBigFile.MIRROR_MEMORY}
+    MEMBER_VIEW_ERROR   = None
+
+    def test_block_cache(self):
+        self.assertEqual(self.BIGFILE_KWARGS['mirror'], self.bigfile.mirror_mode)
+        self.assertEqual(0, self.bigfile.block_cache.hits + self.bigfile.block_cache.misses)
+
+class TestFormatsBigHomeworldRemasteredAutoMirror(TestFormatsBigHomeworldRemasteredMemoryMirror):
+    BIGFILE_KWARGS      = {'mirror': HomeworldRemasteredBigFile.MIRROR_AUTO, 'memory_budget': 1024}
+    MEMBER_VIEW_ERROR   = GearboxEncryptionException
+
+    def test_block_cache(self):
+        self.assertEqual(HomeworldRemasteredBigFile.MIRROR_TEMPFILE, self.bigfile.mirror_mode)
+
+if __name__ == '__main__':
+    unittest.main()
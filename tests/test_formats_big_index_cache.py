@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Alex Headley <aheadley@waysaboutstuff.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from naabal.formats.big.hw1 import HomeworldBigFile, HomeworldBigInfo
+from naabal.formats.big.index_cache import BigIndexCache, CachedBigInfo
+from naabal.util import crc32
+from naabal.util.helpers import big_load
+from tests.test_formats_big_hw2 import build_hw2_archive
+
+class TestFormatsBigIndexCache(unittest.TestCase):
+    ENCRYPTION_KEY  = None
+    FILES           = [
+        ('readme.txt', 'plain text\n' * 100, False),
+        ('data/ship/hgn_mothership.hod', os.urandom(10 * 1024), False),
+        ('data/scripts/rules.lua', 'function OnInit()\nend\n' * 500, True),
+    ]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, 'test.big')
+        build_hw2_archive(self.filename, self.FILES, self.ENCRYPTION_KEY)
+        self.index_cache = BigIndexCache(os.path.join(self.tmp_dir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _snapshot(self, bigfile):
+        return [(m.name, m._offset, m.real_size, m.stored_size, m.mtime, m.crc32) \
+            for m in bigfile.get_members()]
+
+    def test_warm_load(self):
+        with big_load(self.filename) as bigfile:
+            expected = self._snapshot(bigfile)
+        with big_load(self.filename, index_cache=self.index_cache) as bigfile:
+            self.assertEqual(expected, self._snapshot(bigfile))
+        self.assertEqual(1, len(self.index_cache._get_cache_filenames()))
+
+        with big_load(self.filename, index_cache=self.index_cache) as bigfile:
+            self.assertTrue(all(isinstance(m, CachedBigInfo) for m in bigfile.get_members()))
+            self.assertEqual(expected, self._snapshot(bigfile))
+            for name, data, compress in self.FILES:
+                member = bigfile.get_member(name)
+                self.assertEqual(crc32(data), member.crc32)
+                with tempfile.TemporaryFile() as outfile:
+                    bigfile.extract_file(member, outfile)
+                    outfile.seek(0)
+                    self.assertEqual(data, outfile.read())
+
+    def test_stale_entry(self):
+        with big_load(self.filename, index_cache=self.index_cache) as bigfile:
+            pass
+        build_hw2_archive(self.filename, self.FILES[:2], self.ENCRYPTION_KEY)
+        os.utime(self.filename, (0, 0))
+        with big_load(self.filename, index_cache=self.index_cache) as bigfile:
+            self.assertFalse(any(isinstance(m, CachedBigInfo) for m in bigfile.get_members()))
+            self.assertEqual(2, len(bigfile))
+        with big_load(self.filename, index_cache=self.index_cache) as bigfile:
+            self.assertEqual(2, len(bigfile))
+
+    def test_replace_entry(self):
+        for os_name in (os.name, 'nt'):
+            real_os_name = os.name
+            os.name = os_name
+            try:
+                build_hw2_archive(self.filename, self.FILES, self.ENCRYPTION_KEY)
+                with big_load(self.filename, index_cache=self.index_cache) as bigfile:
+                    self.index_cache.put(bigfile)
+                build_hw2_archive(self.filename, self.FILES[:2], self.ENCRYPTION_KEY)
+                os.utime(self.filename, (0, 0))
+                with big_load(self.filename) as bigfile:
+                    self.index_cache.put(bigfile)
+                    expected = self._snapshot(bigfile)
+            finally:
+                os.name = real_os_name
+            self.assertEqual(1, len(self.index_cache._get_cache_filenames()))
+            with big_load(self.filename, index_cache=self.index_cache) as bigfile:
+                self.assertTrue(all(isinstance(m, CachedBigInfo) for m in bigfile.get_members()))
+                self.assertEqual(expected, self._snapshot(bigfile))
+
+    def test_corrupt_entry(self):
+        with big_load(self.filename, index_cache=self.index_cache) as bigfile:
+            pass
+        cache_filename, = self.index_cache._get_cache_filenames()
+        with open(cache_filename, 'r+b') as handle:
+            handle.truncate(40)
+        with big_load(self.filename, index_cache=self.index_cache) as bigfile:
+            self.assertFalse(any(isinstance(m, CachedBigInfo) for m in bigfile.get_members()))
+            self.assertEqual(len(self.FILES), len(bigfile))
+
+    def test_unusable_cache_dir(self):
+        not_a_dir = os.path.join(self.tmp_dir, 'not_a_dir')
+        with open(not_a_dir, 'wb') as handle:
+            handle.write('x')
+        index_cache = BigIndexCache(os.path.join(not_a_dir, 'cache'))
+        for i in xrange(2):
+            with big_load(self.filename, index_cache=index_cache) as bigfile:
+                self.assertEqual(len(self.FILES), len(bigfile))
+
+    def test_eviction(self):
+        filenames = []
+        for i in xrange(3):
+            filename = os.path.join(self.tmp_dir, 'test{0:d}.big'.format(i))
+            shutil.copy(self.filename, filename)
+            filenames.append(filename)
+        with big_load(filenames[0], index_cache=self.index_cache) as bigfile:
+            pass
+        entry_size = os.path.getsize(self.index_cache._get_cache_filenames()[0])
+
+        index_cache = BigIndexCache(self.index_cache.cache_dir, max_size=entry_size * 2)
+        os.utime(index_cache._get_cache_filenames()[0], (0, 0))
+        for filename in filenames[1:]:
+            with big_load(filename, index_cache=index_cache) as bigfile:
+                pass
+        with big_load(filenames[0]) as bigfile:
+            evicted = index_cache._get_cache_filename(bigfile)
+        self.assertEqual(2, len(index_cache._get_cache_filenames()))
+        self.assertFalse(os.path.exists(evicted))
+
+class TestFormatsBigIndexCacheEncrypted(TestFormatsBigIndexCache):
+    ENCRYPTION_KEY  = os.urandom(0x100)
+
+class TestFormatsBigIndexCacheHomeworld1(unittest.TestCase):
+    FILES           = {
+        'Data/ReadMe.txt':      'plain text\n' * 20,
+        'Data/Ships/A.peo':     os.urandom(512),
+    }
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        src_dir = os.path.join(self.tmp_dir, 'src')
+        for name, data in self.FILES.items():
+            filename = os.path.join(src_dir, *name.split('/'))
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, 'wb') as handle:
+                handle.write(data)
+        self.filename = os.path.join(self.tmp_dir, 'test.big')
+        with HomeworldBigFile(self.filename, 'w+b') as bigfile:
+            bigfile.add_all(src_dir + os.sep)
+            bigfile.save()
+        self.index_cache = BigIndexCache(os.path.join(self.tmp_dir, 'cache'))
+        with big_load(self.filename, index_cache=self.index_cache) as bigfile:
+            pass
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_warm_load(self):
+        with big_load(self.filename, index_cache=self.index_cache) as bigfile:
+            self.assertTrue(all(isinstance(m, CachedBigInfo) for m in bigfile.get_members()))
+            self.assertEqual(len(self.FILES), len(bigfile))
+            for name, data in self.FILES.items():
+                with tempfile.TemporaryFile() as outfile:
+                    bigfile.extract_file(bigfile.get_member(name), outfile)
+                    outfile.seek(0)
+                    self.assertEqual(data, outfile.read())
+
+    def test_writable_skips_cache(self):
+        # save() needs the parsed header and ToC that a cache hit skips
+        with HomeworldBigFile(self.filename, 'r+b') as bigfile:
+            bigfile.load(index_cache=self.index_cache)
+            self.assertEqual(len(self.FILES), bigfile['header']['toc_entry_count'])
+            self.assertTrue(all(isinstance(m, HomeworldBigInfo) for m in bigfile.get_members()))
+
+if __name__ == '__main__':
+    unittest.main()
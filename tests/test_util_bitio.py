@@ -72,5 +72,56 @@ class TestUtilBitIO(unittest.TestCase):
     def test_read_bits(self):
         self.assertEqual(TEST_DATA1_BYTE, self.reader.read_bits(8))
 
+    def test_write_flag_bits(self):
+        # 1 + 0xBC (7 bits) == 0xBC + 0x80
+        self.writer.write_flag_bits(1, 0x5E, 7)
+        self.assertEqual(1, self.writer.flush())
+        self.assertEqual(TEST_DATA1_CHAR, self.output_buffer.getvalue())
+
+    def test_read_flag_bits(self):
+        self.assertEqual((1, 0x5E), self.reader.read_flag_bits(7))
+
+    def test_read_flag_bits_variable(self):
+        reader = BitReader(StringIO('\xD7\x00\x00'))
+        # flag set, 3 bit field
+        self.assertEqual((1, 0x05), reader.read_flag_bits(3, 12))
+        # flag clear, 12 bit field
+        self.assertEqual((0, 0xE00), reader.read_flag_bits(3, 12))
+
+    def test_roundtrip_fields(self):
+        fields = [(i % 2, (i * 2654435761) & ((1 << (i % 17)) - 1), i % 17) for i in xrange(2000)]
+        for flag, value, bit_count in fields:
+            self.writer.write_flag_bits(flag, value, bit_count)
+        size = self.writer.flush()
+        self.assertEqual(size, len(self.output_buffer.getvalue()))
+
+        reader = BitReader(StringIO(self.output_buffer.getvalue()), buffer_size=5)
+        for flag, value, bit_count in fields:
+            self.assertEqual(flag, reader.read_bit())
+            self.assertEqual(value, reader.read_bits(bit_count))
+
+    def test_wide_fields(self):
+        value = (1 << 100) | 0xDEADBEEF
+        self.writer.write_bits(value, 101)
+        self.writer.write_flag_bits(1, value, 120)
+        self.writer.flush()
+
+        reader = BitReader(StringIO(self.output_buffer.getvalue()))
+        self.assertEqual(value, reader.read_bits(101))
+        self.assertEqual((1, value), reader.read_flag_bits(120))
+
+    def test_read_past_eof(self):
+        self.reader.read_bits(6)
+        self.assertRaises(IOError, self.reader.read_bits, 3)
+
+    def test_reader_returns_unused_bytes(self):
+        input_buffer = StringIO(TEST_DATA1_CHAR * 4 + 'tail')
+        with BitReader(input_buffer) as reader:
+            reader.read_bits(12)
+            reader.read_bits(20)
+            reader.read_bit()
+        self.assertEqual(5, reader.index)
+        self.assertEqual('ail', input_buffer.read())
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Alex Headley <aheadley@waysaboutstuff.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+from naabal.util import StringIO
+from naabal.util import file_io
+from naabal.util.file_io import FileInFile, AnonymousMappedFile, kernel_copy
+
+TEST_DATA = os.urandom(256 * 1024)
+
+class TestUtilFileInFile(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(TEST_DATA)
+        self.handle = open(self.filename, 'rb')
+
+    def tearDown(self):
+        self.handle.close()
+        os.unlink(self.filename)
+
+    def test_read(self):
+        with FileInFile(self.handle, 1000, 5000) as handle:
+            handle.seek(10)
+            self.assertEqual(TEST_DATA[1010:1020], handle.read(10))
+            self.assertEqual(TEST_DATA[1020:6000], handle.read())
+            self.assertEqual('', handle.read(10))
+            self.assertEqual(5000, handle.tell())
+
+    def test_readinto(self):
+        buffer = bytearray(100)
+        with FileInFile(self.handle, 1000, 5000) as handle:
+            handle.seek(4950)
+            self.assertEqual(50, handle.readinto(buffer))
+            self.assertEqual(TEST_DATA[5950:6000], str(buffer[:50]))
+            self.assertEqual(0, handle.readinto(buffer))
+
+    def test_pread(self):
+        with FileInFile(self.handle, 1000, 5000) as handle:
+            self.assertEqual(TEST_DATA[1100:1200], handle.pread(100, 100))
+            self.assertEqual(TEST_DATA[5990:6000], handle.pread(100, 4990))
+            self.assertEqual(0, handle.tell())
+
+    def test_interleaved_members(self):
+        left = FileInFile(self.handle, 0, 100 * 1024)
+        right = FileInFile(self.handle, 100 * 1024, 100 * 1024)
+        left_data = []
+        right_data = []
+        for i in xrange(100):
+            left_data.append(left.read(1024))
+            right_data.append(right.read(1024))
+        self.assertEqual(TEST_DATA[:100 * 1024], ''.join(left_data))
+        self.assertEqual(TEST_DATA[100 * 1024:200 * 1024], ''.join(right_data))
+
+    def test_threaded_reads(self):
+        results = {}
+        def read_member(offset):
+            with FileInFile(self.handle, offset, 16 * 1024) as handle:
+                results[offset] = ''.join(iter(lambda: handle.read(333), ''))
+        threads = [threading.Thread(target=read_member, args=(offset,)) \
+            for offset in xrange(0, len(TEST_DATA), 16 * 1024)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for offset, data in results.items():
+            self.assertEqual(TEST_DATA[offset:offset + 16 * 1024], data)
+        self.assertEqual(len(threads), len(results))
+
+class TestUtilAnonymousMappedFile(unittest.TestCase):
+    def test_roundtrip(self):
+        with AnonymousMappedFile(1000) as handle:
+            handle.write(bytearray(TEST_DATA[:600]))
+            handle.write(memoryview(TEST_DATA[600:1000]))
+            self.assertRaises(IOError, handle.write, 'x')
+            handle.seek(0)
+            self.assertEqual(TEST_DATA[:1000], handle.read())
+            self.assertEqual(TEST_DATA[10:20], handle.pread(10, 10))
+
+class TestUtilKernelCopy(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(TEST_DATA)
+        self.handle = open(self.filename, 'rb')
+
+    def tearDown(self):
+        self.handle.close()
+        os.unlink(self.filename)
+
+    def _check_copy_into_file(self):
+        with tempfile.TemporaryFile() as outfile:
+            outfile.write('header')
+            copied = kernel_copy(self.handle, outfile, 100 * 1024, 1000)
+            # on linux copy_file_range(2)/sendfile(2) are called from libc when
+            # the os module doesn't have them, elsewhere the caller may have to
+            # do the copy the slow way
+            if sys.platform.startswith('linux'):
+                self.assertEqual(100 * 1024, copied)
+            self.assertEqual(6 + copied, outfile.tell())
+            outfile.write('trailer')
+            outfile.seek(0)
+            self.assertEqual('header' + TEST_DATA[1000:1000 + copied] + 'trailer', outfile.read())
+
+    def test_copy_into_file(self):
+        self._check_copy_into_file()
+
+    def test_copy_with_sendfile(self):
+        copy_file_range = file_io._os_copy_file_range
+        file_io._os_copy_file_range = None
+        try:
+            self._check_copy_into_file()
+        finally:
+            file_io._os_copy_file_range = copy_file_range
+
+    def test_copy_past_eof(self):
+        with tempfile.TemporaryFile() as outfile:
+            copied = kernel_copy(self.handle, outfile, 1024, len(TEST_DATA) - 10)
+            if sys.platform.startswith('linux'):
+                self.assertEqual(10, copied)
+            self.assertEqual(copied, outfile.tell())
+
+    def test_not_a_real_file(self):
+        self.assertEqual(0, kernel_copy(self.handle, StringIO(), 1024, 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,6 +25,7 @@
 
 import unittest
 
+from naabal.util import gbx_crypt
 from naabal.util.gbx_crypt import GearboxCrypt
 from naabal.util import unpack_key, StringIO
 
@@ -123,6 +124,16 @@ class TestUtilGbxCrypt(unittest.TestCase):
     def test_combined_key(self):
         self.assertEqual(TEST_COMBINED_KEY1, self.crypto.encryption_key)
 
+    def test_combined_key_memoized(self):
+        hits = gbx_crypt._combined_key_cache.hits
+        crypto = GearboxCrypt(len(TEST_DATA), TEST_LOCAL_KEY1, TEST_GLOBAL_KEY1)
+        self.assertEqual(hits + 1, gbx_crypt._combined_key_cache.hits)
+        crypto.encryption_key[0] ^= 0xFF
+        self.assertEqual(TEST_COMBINED_KEY1,
+            GearboxCrypt(len(TEST_DATA), TEST_LOCAL_KEY1, TEST_GLOBAL_KEY1).encryption_key)
+        self.assertNotEqual(TEST_COMBINED_KEY1,
+            GearboxCrypt(len(TEST_DATA) + 1, TEST_LOCAL_KEY1, TEST_GLOBAL_KEY1).encryption_key)
+
     def test_roundtrip(self):
         output = self.crypto.decrypt(self.crypto.encrypt(TEST_DATA))
         self.assertEqual(TEST_DATA, output)
@@ -163,5 +174,14 @@ class TestUtilGbxCrypt(unittest.TestCase):
             self.crypto.encrypt(TEST_DATA[partial_start:partial_end],
                 partial_start))
 
+    def test_large_roundtrip(self):
+        data = TEST_DATA * 50
+        key = self.crypto.encryption_key
+        offset = 1234
+        expected = str(bytearray((c + key[(offset + i) % len(key)]) & 0xFF \
+            for i, c in enumerate(bytearray(data))))
+        self.assertEqual(expected, self.crypto.decrypt(data, offset))
+        self.assertEqual(data, self.crypto.encrypt(expected, offset))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Alex Headley <aheadley@waysaboutstuff.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import struct
+import shutil
+import tempfile
+import unittest
+
+from naabal.formats.big.hw1 import HomeworldBigFile
+from naabal.formats.big.hw2 import Homeworld2BigFile
+from naabal.formats.big.hwrm import HomeworldClassicBigFile, HomeworldRemasteredBigFile
+from naabal.util.helpers import big_load, detect_big_format
+from tests.test_formats_big_hw2 import build_hw2_archive
+
+class TestUtilHelpersBigLoad(unittest.TestCase):
+    FILES           = [
+        # the first ToC entry is compressed and not the first in the data, so
+        # it also reads as a valid classic entry
+        ('Data/Ships/A.txt', 'hello\n', False),
+        ('Data/b.bin', 'x = 1\n' * 50, True),
+    ]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.tmp_dir, 'src')
+        for name, data, compress in self.FILES:
+            filename = os.path.join(self.src_dir, *name.split('/'))
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, 'wb') as handle:
+                handle.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _build_hw1_archive(self, bigfile_class):
+        filename = os.path.join(self.tmp_dir, bigfile_class.__name__ + '.big')
+        bigfile = bigfile_class(filename, 'w+b')
+        bigfile.add_all(self.src_dir + os.sep)
+        bigfile.save()
+        bigfile.close()
+        return filename
+
+    def _build_hw2_archive(self, encryption_key=None):
+        filename = os.path.join(self.tmp_dir, 'hw2.big')
+        build_hw2_archive(filename, self.FILES, encryption_key)
+        return filename
+
+    def assertLoadsAs(self, bigfile_class, filename):
+        with open(filename, 'rb') as handle:
+            self.assertIs(bigfile_class, detect_big_format(handle))
+        with big_load(filename) as bigfile:
+            self.assertIs(bigfile_class, type(bigfile))
+            self.assertEqual(sorted(os.path.join(*name.split('/')) for name, data, compress in self.FILES),
+                bigfile.get_filenames())
+
+    def test_homeworld(self):
+        self.assertLoadsAs(HomeworldBigFile, self._build_hw1_archive(HomeworldBigFile))
+
+    def test_homeworld_classic(self):
+        self.assertLoadsAs(HomeworldClassicBigFile, self._build_hw1_archive(HomeworldClassicBigFile))
+
+    def test_homeworld2(self):
+        self.assertLoadsAs(Homeworld2BigFile, self._build_hw2_archive())
+
+    def test_homeworld_remastered(self):
+        self.assertLoadsAs(HomeworldRemasteredBigFile, self._build_hw2_archive(os.urandom(0x100)))
+
+    def test_unknown_format(self):
+        filename = os.path.join(self.tmp_dir, 'garbage.big')
+        with open(filename, 'wb') as handle:
+            handle.write(os.urandom(1024))
+        self.assertRaises(ValueError, big_load, filename)
+
+    def test_remastered_key_size_mismatch(self):
+        # the marker lines up, but the key size doesn't match its offset
+        trailer = struct.pack('<LH', HomeworldRemasteredBigFile.ENCRYPTION_KEY_MARKER, 0x20) + \
+            '\x00' * 0x10 + struct.pack('<L', 0x10 + 10)
+        data = os.urandom(1024) + trailer
+        self.assertFalse(HomeworldRemasteredBigFile.probe(None, data[:4096], data[-4096:]))
+        trailer = struct.pack('<LH', HomeworldRemasteredBigFile.ENCRYPTION_KEY_MARKER, 0x800) + \
+            '\x00' * 0x800 + struct.pack('<L', 0x800 + 10)
+        data = os.urandom(1024) + trailer
+        self.assertFalse(HomeworldRemasteredBigFile.probe(None, data[:4096], data[-4096:]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Alex Headley <aheadley@waysaboutstuff.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import unittest
+
+from naabal.util.lru import LRUCache
+
+class TestUtilLRUCache(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = LRUCache(10)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', 'xxx')
+        self.assertEqual('xxx', cache.get('a'))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(10)
+        cache.put('a', 'aaaa')
+        cache.put('b', 'bbbb')
+        cache.get('a')
+        cache.put('c', 'cccc')
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(8, cache.size)
+
+    def test_oversized_value(self):
+        cache = LRUCache(4)
+        cache.put('a', 'aaaa')
+        cache.put('a', 'aaaaa')
+        self.assertNotIn('a', cache)
+        self.assertEqual(0, cache.size)
+
+if __name__ == '__main__':
+    unittest.main()
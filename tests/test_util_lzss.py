@@ -25,7 +25,8 @@
 
 import unittest
 
-from naabal.util.lzss import decompress, compress
+from naabal.util import StringIO
+from naabal.util.lzss import decompress, compress, LZSS
 
 
 TEST_DATA1_DECOMPRESSED = """
@@ -83,8 +84,35 @@ class TestUtilLzss(unittest.TestCase):
     def test_decompression(self):
         self.assertEqual(TEST_DATA1_DECOMPRESSED, decompress(TEST_DATA1_COMPRESSED))
 
+    def test_decompression_small_chunks(self):
+        self.assertEqual(TEST_DATA1_DECOMPRESSED,
+            LZSS(chunk_size=7).decompress(TEST_DATA1_COMPRESSED))
+
+    def test_decompress_stream_position(self):
+        input_stream = StringIO(TEST_DATA1_COMPRESSED + 'trailing data')
+        output_stream = StringIO()
+        size = LZSS().decompress_stream(input_stream, output_stream)
+        self.assertEqual(len(TEST_DATA1_DECOMPRESSED), size)
+        self.assertEqual('trailing data', input_stream.read())
+
+    def test_decompression_truncated(self):
+        self.assertRaises(IOError, decompress, TEST_DATA1_COMPRESSED[:-4])
+
     def test_compression(self):
         self.assertEqual(TEST_DATA1_COMPRESSED, compress(TEST_DATA1_DECOMPRESSED))
 
+    def test_compression_levels(self):
+        for level in LZSS.LEVELS:
+            self.assertEqual(TEST_DATA1_DECOMPRESSED,
+                decompress(compress(TEST_DATA1_DECOMPRESSED, level)))
+
+    def test_compression_short_input(self):
+        for level in LZSS.LEVELS:
+            for data in ['', 'a', 'abc']:
+                self.assertEqual(data, decompress(compress(data, level)))
+
+    def test_compression_invalid_level(self):
+        self.assertRaises(ValueError, LZSS, level='fastest')
+
 if __name__ == '__main__':
     unittest.main()